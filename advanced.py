@@ -0,0 +1,139 @@
+"""
+Advanced
+
+This file contains class Advanced Dialog, which shows the spectral, entropy
+and diffusion metrics of the current study for each foot.
+"""
+
+from PyQt6 import QtWidgets
+from PyQt6.QtCore import QSettings, Qt
+
+import sys
+
+import material3_components as mt3
+import metrics
+
+# Groups of metrics.GROUPS shown in the dialog
+GROUPS = {
+    'spectral': ('Análisis Espectral', 'Spectral Analysis'),
+    'entropy': ('Entropía', 'Entropy'),
+    'diffusion': ('Difusión', 'Diffusion')
+}
+
+AXES = {
+    'lat': ('Lateral', 'Lateral'),
+    'ap': ('Antero-Posterior', 'Antero-Posterior'),
+    'centro': ('Centro', 'Center')
+}
+
+# Label and unit by metric key, the name without the axis prefix
+KEYS = {
+    'f50': ('Frecuencia Mediana', 'Median Frequency', 'Hz'),
+    'f95': ('Frecuencia 95 %', '95 % Frequency', 'Hz'),
+    'power': ('Potencia Total', 'Total Power', 'mm²'),
+    'low_ratio': ('Fracción Banda Baja', 'Low Band Fraction', ''),
+    'medium_ratio': ('Fracción Banda Media', 'Medium Band Fraction', ''),
+    'high_ratio': ('Fracción Banda Alta', 'High Band Fraction', ''),
+    'sampen': ('Entropía Muestral', 'Sample Entropy', ''),
+    'ci': ('Índice de Complejidad', 'Complexity Index', ''),
+    'ds': ('Difusión Corto Plazo', 'Short-Term Diffusion', 'mm²/s'),
+    'dl': ('Difusión Largo Plazo', 'Long-Term Diffusion', 'mm²/s'),
+    'tc': ('Tiempo Crítico', 'Critical Time', 's'),
+    'msd_c': ('Desplazamiento Crítico', 'Critical Displacement', 'mm²')
+}
+
+# Metrics requested by the main window for this dialog
+METRICS = [name for group in GROUPS for name in metrics.GROUPS[group]]
+
+
+def metric_label(name: str, language: int) -> str:
+    """ Label of a metric with its axis and unit in the app language """
+    axis, key = name.split('_', 1)
+    label = f'{KEYS[key][language]} {AXES[axis][language]}'
+    return f'{label} ({KEYS[key][2]})' if KEYS[key][2] else label
+
+
+class Advanced(QtWidgets.QDialog):
+    def __init__(self, analyses: tuple):
+        """ UI Advanced metrics dialog class
+
+        Parameters
+        ----------
+        analyses: tuple
+            Analysis results of the left foot, center of pressure and right
+            foot, with the metrics of METRICS
+        """
+        super().__init__()
+        # --------
+        # Settings
+        # --------
+        self.settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
+        self.language_value = int(self.settings.value('language'))
+        self.theme_value = eval(self.settings.value('theme'))
+
+        self.analyses = analyses
+        self.groups_dict = dict(enumerate(GROUPS.values()))
+        rows = max(len(metrics.GROUPS[group]) for group in GROUPS)
+
+        # ----------------
+        # Generación de UI
+        # ----------------
+        width = 360
+        height = 120 + 40 * rows
+        screen_x = int(self.screen().availableGeometry().width() / 2 - (width / 2))
+        screen_y = int(self.screen().availableGeometry().height() / 2 - (height / 2))
+
+        if self.language_value == 0: self.setWindowTitle('Análisis Avanzados')
+        elif self.language_value == 1: self.setWindowTitle('Advanced Analyses')
+        self.setGeometry(screen_x, screen_y, width, height)
+        self.setMinimumSize(width, height)
+        self.setMaximumSize(width, height)
+        self.setModal(True)
+        self.setObjectName('object_advanced')
+        if self.theme_value:
+            self.setStyleSheet(f'QWidget#object_advanced {{ background-color: #E5E9F0;'
+                f'color: #000000 }}')
+        else:
+            self.setStyleSheet(f'QWidget#object_advanced {{ background-color: #3B4253;'
+                f'color: #E5E9F0 }}')
+
+        self.advanced_card = mt3.Card(self, 'advanced_card', (8, 8, width-16, height-16),
+            ('Análisis Avanzados', 'Advanced Analyses'), self.theme_value, self.language_value)
+
+        y = 48
+        self.group_menu = mt3.Menu(self.advanced_card, 'group_menu',
+            (8, y, width-32), len(GROUPS), len(GROUPS), self.groups_dict, self.theme_value, self.language_value)
+        self.group_menu.currentIndexChanged.connect(self.on_group_menu_currentIndexChanged)
+
+        # Label and value labels of the left foot, center of pressure and right foot by row
+        self.rows = []
+        for row in range(rows):
+            y += 40
+            label = mt3.ItemLabel(self.advanced_card, f'metric_{row}_label',
+                (8, y), ('', ''), self.theme_value, self.language_value)
+            values = []
+            for x, foot, color in ((8, 'left', '#FF0000'), (120, 'center', '#00FF00'), (232, 'right', '#0000FF')):
+                value = mt3.ValueLabel(self.advanced_card, f'{foot}_metric_{row}_value',
+                    (x, y + 16, 104), self.theme_value)
+                value.setAlignment(Qt.AlignmentFlag.AlignCenter)
+                value.setStyleSheet(f'QLabel#{value.name} {{ border: 2px solid {color}; border-radius: 16 }}')
+                values.append(value)
+            self.rows.append((label, values))
+
+        self.group_menu.setCurrentIndex(0)
+        self.on_group_menu_currentIndexChanged(0)
+
+    # ---------
+    # Funciones
+    # ---------
+    def on_group_menu_currentIndexChanged(self, index: int) -> None:
+        """ Show the metrics of the selected group """
+        names = metrics.GROUPS[list(GROUPS)[index]] if index >= 0 else []
+        for row, (label, values) in enumerate(self.rows):
+            visible = row < len(names)
+            label.setVisible(visible)
+            for value, analysis in zip(values, self.analyses):
+                value.setVisible(visible)
+                value.setText(f'{analysis[names[row]]:.3f}' if visible else '')
+            if visible:
+                label.setText(metric_label(names[row], self.language_value))
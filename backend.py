@@ -4,7 +4,9 @@ Backend
 This file contains supplementary methods and classes applied to the frontend.
 
 1. Class MPLCanvas: configuration of the plot canvas
-2. Analysis methods: methods to process and analyze balance signals data
+2. Analysis methods: methods to process and analyze balance signals data,
+   with block bootstrap intervals of the velocity, RMS, mean distance and
+   mean frequency metrics only (not the ranges or areas, see Bootstrap)
 3. Database methods: methods of the database operations
 4. About class and method: Dialogs of information about me and Qt
 
@@ -16,13 +18,23 @@ from PyQt6 import QtWidgets, QtGui
 from PyQt6.QtGui import QPixmap
 from PyQt6.QtCore import Qt, QSettings
 
+import sqlite3
 import sys
+import threading
+import time
 import numpy as np
 import pandas as pd
-from collections import OrderedDict
-
-from scipy.spatial import ConvexHull
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.interpolate import CubicSpline
+from scipy.signal import butter, detrend, find_peaks, sosfiltfilt
+from scipy.spatial import ConvexHull, cKDTree
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 import cv2
 import pytesseract
 from pytesseract import Output
@@ -31,6 +43,9 @@ from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 
 import material3_components as mt3
+import replica
+import storage
+import storage_sqlite
 
 light = {
     'surface': '#B2B2B2',
@@ -283,6 +298,112 @@ def extract(image_file: str) -> dict:
     return signals
 
 
+# ----------------
+# Preprocesamiento
+# ----------------
+@lru_cache(maxsize=32)
+def filterDesign(cutoff: float, fs: float = 10, order: int = 4) -> np.array:
+    """ Butterworth low-pass design in second-order sections
+
+    Parameters
+    ----------
+    cutoff: float
+        Cutoff frequency in Hz
+    fs: float
+        Sampling frequency in Hz
+    order: int
+        Filter order
+
+    Returns
+    -------
+    sos: np.array
+        Second-order sections, shape (n_sections, 6)
+    """
+    return butter(order, cutoff, fs=fs, output='sos')
+
+
+def preprocess(signals: np.array, fs: float = 10, cutoff: float = 2.0, order: int = 4, detrend_type: str = None) -> np.array:
+    """ Zero-phase low-pass filtering and detrending of many channels
+
+    Parameters
+    ----------
+    signals: np.array
+        Signals of equal length, shape (n_channels, n_samples)
+    fs: float
+        Sampling frequency in Hz
+    cutoff: float
+        Cutoff frequency in Hz (no filtering if None)
+    order: int
+        Filter order, doubled by the forward-backward pass
+    detrend_type: str
+        'constant' removes the mean, 'linear' the least squares line and
+        None keeps the signals level
+
+    Returns
+    -------
+    filtered: np.array
+        Filtered signals, shape (n_channels, n_samples)
+    """
+    filtered = np.atleast_2d(np.asarray(signals, dtype=float))
+    if detrend_type is not None:
+        filtered = detrend(filtered, axis=1, type=detrend_type)
+    if cutoff is not None:
+        filtered = sosfiltfilt(filterDesign(cutoff, fs, order), filtered, axis=1)
+    return filtered
+
+
+def preprocessingName(cutoff: float = None, order: int = 4, detrend_type: str = None) -> str:
+    """ Description of the preprocess parameters, stored with the metrics
+        computed from the preprocessed signals
+
+    Returns
+    -------
+    name: str
+        Steps in the order they are applied, e.g. 'detrend=linear;lowpass=2/4'
+        (cutoff in Hz and filter order), '' without preprocessing
+    """
+    steps = []
+    if detrend_type is not None:
+        steps.append(f'detrend={detrend_type}')
+    if cutoff is not None:
+        steps.append(f'lowpass={float(cutoff):g}/{int(order)}')
+    return ';'.join(steps)
+
+
+def preprocessStudy(dfs: list, fs: float = 10, cutoff: float = 2.0, order: int = 4, detrend_type: str = None) -> list:
+    """ Preprocessing of the lateral and antero-posterior channels of many
+        feet or studies, stacked by signal length in single 2-D operations
+
+    Parameters
+    ----------
+    dfs: list
+        Pandas dataframes converted from balance signal data from file
+        (e.g. left, center and right foot of a study)
+    fs, cutoff, order, detrend_type:
+        Parameters of preprocess
+
+    Returns
+    -------
+    filtered_dfs: list
+        Dataframes with the same index and columns and filtered values
+    """
+    filtered_dfs = [None] * len(dfs)
+
+    by_length = {}
+    for i, df in enumerate(dfs):
+        by_length.setdefault(len(df), []).append(i)
+
+    for length, indexes in by_length.items():
+        signals = np.concatenate([dfs[i].iloc[:,:2].to_numpy(dtype=float).T for i in indexes])
+        filtered = preprocess(signals, fs, cutoff, order, detrend_type)
+        for k, i in enumerate(indexes):
+            filtered_dfs[i] = dfs[i].copy()
+            filtered_dfs[i].iloc[:,0] = filtered[2 * k]
+            filtered_dfs[i].iloc[:,1] = filtered[2 * k + 1]
+
+    return filtered_dfs
+
+
 # --------------------
 # Análisis de la Señal
 # --------------------
@@ -406,6 +527,841 @@ def analisis(df: pd.DataFrame) -> dict:
     return results
 
 
+# --------------------------
+# Análisis por Ventana Móvil
+# --------------------------
+def slidingAnalysis(df: pd.DataFrame, window: float, step: float, fs: float = 10) -> dict:
+    """ Sliding window analysis of dataframe from balance signal
+
+    Window sums come from cumulative sums and window extrema from monotonic
+    deques, so the cost is linear in the signal length for any window size.
+    Each window applies the same formulas as analisis.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Pandas dataframe converted from balance signal data from file
+    window: float
+        Window length in seconds
+    step: float
+        Step between consecutive windows in seconds
+    fs: float
+        Sampling frequency in Hz
+
+    Returns
+    -------
+    results: dict
+        Results of the analysis of each window
+        t: np.array
+            Time at the center of each window
+        lat_rango: np.array
+            Lateral signal range
+        ap_rango: np.array
+            Antero-posterior signal range
+        lat_vel: np.array
+            Lateral signal mean velocity
+        ap_vel: np.array
+            Antero-posterior signal mean velocity
+        lat_rms: np.array
+            Lateral signal RMS
+        ap_rms: np.array
+            Antero-posterior signal RMS
+        centro_vel: np.array
+            Center of pressure signal mean velocity
+        centro_path: np.array
+            Center of pressure path length
+    """
+    data_x = df.iloc[:,0].to_numpy(dtype=float)
+    data_y = df.iloc[:,1].to_numpy(dtype=float)
+
+    width = int(round(window * fs))
+    stride = max(int(round(step * fs)), 1)
+    if width < 2 or width > len(data_x):
+        raise ValueError(f'Window of {width} samples does not fit a signal of {len(data_x)} samples')
+
+    starts = np.arange(0, len(data_x) - width + 1, stride)
+    ends = starts + width
+
+    results = {'t': (starts + width / 2) / fs}
+
+    dist = np.sqrt(np.diff(data_x) ** 2 + np.diff(data_y) ** 2)
+    path = _window_sum(dist, starts, ends - 1)
+    results['centro_vel'] = path / (width / fs)
+    results['centro_path'] = path
+
+    for name, data in (('lat', data_x), ('ap', data_y)):
+        x_min, x_max = _sliding_extrema(data, width)
+        results[f'{name}_rango'] = x_max[starts] - x_min[starts]
+
+        results[f'{name}_vel'] = _window_sum(np.abs(np.diff(data)), starts, ends - 1) * fs / (width - 1)
+
+        centered = data - data.mean()
+        sum_x = _window_sum(centered, starts, ends)
+        sum_xx = _window_sum(centered * centered, starts, ends)
+        results[f'{name}_rms'] = np.sqrt(np.maximum(sum_xx - sum_x * sum_x / width, 0) / (width - 1))
+
+    return results
+
+
+def _window_sum(values: np.array, starts: np.array, ends: np.array) -> np.array:
+    """ Sums of values[start:end] for every window from a single cumulative sum """
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    return cumulative[ends] - cumulative[starts]
+
+
+def _sliding_extrema(values: np.array, width: int) -> tuple:
+    """ Minimum and maximum of every window of width samples using monotonic deques
+
+    Returns
+    -------
+    minimum, maximum: tuple
+        Extrema of the window starting at each sample
+    """
+    n_windows = len(values) - width + 1
+    minimum = np.empty(n_windows)
+    maximum = np.empty(n_windows)
+    low, high = deque(), deque()
+    for i, value in enumerate(values):
+        while low and values[low[-1]] >= value:
+            low.pop()
+        while high and values[high[-1]] <= value:
+            high.pop()
+        low.append(i)
+        high.append(i)
+        if low[0] <= i - width:
+            low.popleft()
+        if high[0] <= i - width:
+            high.popleft()
+        if i >= width - 1:
+            minimum[i - width + 1] = values[low[0]]
+            maximum[i - width + 1] = values[high[0]]
+    return minimum, maximum
+
+
+# ------------------
+# Análisis Espectral
+# ------------------
+SPECTRAL_BANDS = {
+    'low': (0.0, 0.5),
+    'medium': (0.5, 2.0),
+    'high': (2.0, 5.0)
+}
+
+
+def spectralAnalysis(signals: np.array, fs: float = 10, nperseg: int = 256, bands: dict = SPECTRAL_BANDS) -> dict:
+    """ Welch spectral analysis of many balance signals in one batched FFT
+
+    Parameters
+    ----------
+    signals: np.array
+        Signals of equal length, shape (n_signals, n_samples)
+    fs: float
+        Sampling frequency in Hz
+    nperseg: int
+        Samples by Welch segment (50 % overlap, Hann window)
+    bands: dict
+        Frequency bands in Hz, {name: (low, high)}
+
+    Returns
+    -------
+    results: dict
+        Results of spectral analysis by signal
+        freqs: np.array
+            Frequencies of the power spectral density
+        psd: np.array
+            Power spectral density, shape (n_signals, n_freqs)
+        power: np.array
+            Total power
+        f50: np.array
+            Median power frequency
+        f95: np.array
+            Frequency below which 95 % of the power lies
+        {band}_ratio: np.array
+            Power of each band relative to total power
+    """
+    signals = np.atleast_2d(np.asarray(signals, dtype=float))
+    nperseg = min(nperseg, signals.shape[1])
+    hop = nperseg - nperseg // 2
+    starts = np.arange(0, signals.shape[1] - nperseg + 1, hop)
+
+    window, scale = _welch_window(nperseg, fs)
+    segments = signals[:, starts[:, None] + np.arange(nperseg)]
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    spectrum = np.fft.rfft(segments * window, axis=-1)
+
+    psd = (spectrum.real ** 2 + spectrum.imag ** 2).mean(axis=1) * scale
+    psd[:, 1:(nperseg + 1) // 2] *= 2
+    freqs = np.fft.rfftfreq(nperseg, 1 / fs)
+    df = freqs[1] - freqs[0]
+
+    cumulative = np.cumsum(psd, axis=1) * df
+    power = cumulative[:, -1]
+
+    results = {
+        'freqs': freqs,
+        'psd': psd,
+        'power': power,
+        'f50': freqs[np.argmax(cumulative >= 0.5 * power[:, None], axis=1)],
+        'f95': freqs[np.argmax(cumulative >= 0.95 * power[:, None], axis=1)]
+    }
+
+    for name, (low, high) in bands.items():
+        mask = (freqs >= low) & (freqs < high)
+        results[f'{name}_ratio'] = psd[:, mask].sum(axis=1) * df / power
+
+    return results
+
+
+@lru_cache(maxsize=8)
+def _welch_window(nperseg: int, fs: float) -> tuple:
+    """ Hann window and density scale factor for a segment length """
+    window = np.hanning(nperseg + 1)[:-1]
+    return window, 1 / (fs * (window * window).sum())
+
+
+def spectralFeatures(dfs: list, fs: float = 10, nperseg: int = 256) -> list:
+    """ Spectral features of the lateral and antero-posterior signals of many
+        feet or studies, ready to be merged with the results of analisis
+
+    Parameters
+    ----------
+    dfs: list
+        Pandas dataframes converted from balance signal data from file
+        (e.g. left, center and right foot of a study)
+    fs: float
+        Sampling frequency in Hz
+    nperseg: int
+        Samples by Welch segment
+
+    Returns
+    -------
+    features: list
+        Dictionary by dataframe with keys lat_f50, lat_f95, lat_power,
+        lat_{band}_ratio and the same for ap
+    """
+    features = [{} for _ in dfs]
+
+    by_length = {}
+    for i, df in enumerate(dfs):
+        by_length.setdefault(len(df), []).append(i)
+
+    for indexes in by_length.values():
+        signals = np.concatenate([dfs[i].iloc[:,:2].to_numpy(dtype=float).T for i in indexes])
+        spectral = spectralAnalysis(signals, fs, nperseg)
+        for k, i in enumerate(indexes):
+            for j, name in enumerate(('lat', 'ap')):
+                row = 2 * k + j
+                features[i][f'{name}_f50'] = spectral['f50'][row]
+                features[i][f'{name}_f95'] = spectral['f95'][row]
+                features[i][f'{name}_power'] = spectral['power'][row]
+                for band in SPECTRAL_BANDS:
+                    features[i][f'{name}_{band}_ratio'] = spectral[f'{band}_ratio'][row]
+
+    return features
+
+
+# -----------------
+# Análisis en Línea
+# -----------------
+class StreamingAnalysis:
+    def __init__(self, fs: float = 10, first_index: int = 0) -> None:
+        """ Incremental analysis of a balance signal received one sample or
+            one chunk at a time in constant memory
+
+        At the end of the stream, results() matches analisis (and the
+        covariance used by ellipsePCA) over the whole recording.
+
+        Parameters
+        ----------
+        fs: float
+            Sampling frequency in Hz
+        first_index: int
+            Index of the first sample, to report times as analisis does
+        """
+        self.fs = fs
+        self.first_index = first_index
+
+        self.n = 0
+        self.last = None
+
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+
+        self.x_max = self.y_max = -np.inf
+        self.x_min = self.y_min = np.inf
+        self.x_t_max = self.x_t_min = self.y_t_max = self.y_t_min = 0
+
+        self.sum_dx = 0.0
+        self.sum_dy = 0.0
+        self.path = 0.0
+        self.dist = 0.0
+
+    def update(self, x, y) -> None:
+        """ Add one sample or a chunk of samples of the lateral (x) and
+            antero-posterior (y) signals """
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        if len(x) == 0:
+            return
+
+        # Extremes and their times
+        i = int(x.argmax())
+        if x[i] > self.x_max: self.x_max, self.x_t_max = x[i], self.n + i
+        i = int(x.argmin())
+        if x[i] < self.x_min: self.x_min, self.x_t_min = x[i], self.n + i
+        i = int(y.argmax())
+        if y[i] > self.y_max: self.y_max, self.y_t_max = y[i], self.n + i
+        i = int(y.argmin())
+        if y[i] < self.y_min: self.y_min, self.y_t_min = y[i], self.n + i
+
+        # Differences, including the step from the previous chunk
+        if self.last is not None:
+            dx = np.diff(x, prepend=self.last[0])
+            dy = np.diff(y, prepend=self.last[1])
+        else:
+            dx = np.diff(x)
+            dy = np.diff(y)
+        self.last = (x[-1], y[-1])
+        self.sum_dx += np.abs(dx).sum()
+        self.sum_dy += np.abs(dy).sum()
+        self.path += np.sqrt(dx * dx + dy * dy).sum()
+        self.dist += np.sqrt(x * x + y * y).sum()
+
+        # Welford / Chan merge of means, second moments and co-moment
+        n_b = len(x)
+        mean_xb = x.mean()
+        mean_yb = y.mean()
+        m2_xb = ((x - mean_xb) ** 2).sum()
+        m2_yb = ((y - mean_yb) ** 2).sum()
+        c_xyb = ((x - mean_xb) * (y - mean_yb)).sum()
+
+        n = self.n + n_b
+        delta_x = mean_xb - self.mean_x
+        delta_y = mean_yb - self.mean_y
+        self.m2_x += m2_xb + delta_x * delta_x * self.n * n_b / n
+        self.m2_y += m2_yb + delta_y * delta_y * self.n * n_b / n
+        self.c_xy += c_xyb + delta_x * delta_y * self.n * n_b / n
+        self.mean_x += delta_x * n_b / n
+        self.mean_y += delta_y * n_b / n
+        self.n = n
+
+    def results(self) -> dict:
+        """ Current results with the keys of analisis (without the signals)
+            plus the covariance behind ellipsePCA
+
+        Returns
+        -------
+        results: dict
+            lat/ap extremes, times, ranges, velocities and RMS, centro_vel,
+            centro_dist, centro_frec, centro_path, cov_xx, cov_xy, cov_yy
+            and rot (orientation of the oriented ellipse)
+        """
+        n = self.n
+        den = (n / self.fs) / n
+        t_analysis = n / self.fs
+
+        results = {
+            'lat_max': self.x_max,
+            'lat_t_max': (self.x_t_max + self.first_index) / self.fs,
+            'lat_min': self.x_min,
+            'lat_t_min': (self.x_t_min + self.first_index) / self.fs,
+            'ap_max': self.y_max,
+            'ap_t_max': (self.y_t_max + self.first_index) / self.fs,
+            'ap_min': self.y_min,
+            'ap_t_min': (self.y_t_min + self.first_index) / self.fs,
+            'lat_rango': self.x_max - self.x_min,
+            'ap_rango': self.y_max - self.y_min,
+            'lat_vel': self.sum_dx / den / (n - 1),
+            'lat_rms': np.sqrt(self.m2_x / (n - 1)),
+            'ap_vel': self.sum_dy / den / (n - 1),
+            'ap_rms': np.sqrt(self.m2_y / (n - 1)),
+            'centro_vel': self.path / t_analysis,
+            'centro_dist': self.dist / t_analysis,
+            'centro_frec': self.path / t_analysis / (2 * np.pi),
+            'centro_path': self.path
+        }
+
+        a = self.m2_x / n
+        b = self.c_xy / n
+        d = self.m2_y / n
+        B = a + d
+        C = a * d - b * b
+        L1 = (B / 2) + np.sqrt(B * B - 4 * C) / 2
+
+        results['cov_xx'] = a
+        results['cov_xy'] = b
+        results['cov_yy'] = d
+        results['rot'] = np.arctan((L1 - d) / b)
+
+        return results
+
+
+# --------
+# Entropía
+# --------
+def sampleEntropy(signal, m: int = 2, r: float = 0.2, tolerance: float = None) -> float:
+    """ Sample entropy of a balance signal
+
+    Template matches are counted with a KD-tree under the Chebyshev
+    distance, so the cost grows as n log n instead of n².
+
+    Parameters
+    ----------
+    signal: np.array
+        Balance signal
+    m: int
+        Template length
+    r: float
+        Tolerance as a fraction of the signal standard deviation
+    tolerance: float
+        Absolute tolerance, overrides r
+
+    Returns
+    -------
+    sampen: float
+        Sample entropy (nan if no template matches)
+    """
+    x = np.asarray(signal, dtype=float)
+    if tolerance is None:
+        tolerance = r * x.std()
+    n_templates = len(x) - m
+    if n_templates < 2:
+        return np.nan
+
+    # Matches are strictly closer than the tolerance
+    radius = np.nextafter(tolerance, 0)
+    matches = []
+    for length in (m, m + 1):
+        templates = sliding_window_view(x, length)[:n_templates]
+        tree = cKDTree(templates)
+        matches.append((tree.count_neighbors(tree, radius, p=np.inf) - n_templates) / 2)
+    B, A = matches
+
+    if A == 0 or B == 0:
+        return np.nan
+    return -np.log(A / B)
+
+
+def multiscaleEntropy(signal, scales: int = 10, m: int = 2, r: float = 0.2) -> dict:
+    """ Multiscale entropy of a balance signal
+
+    Parameters
+    ----------
+    signal: np.array
+        Balance signal
+    scales: int
+        Number of coarse-graining scales (1 to scales)
+    m: int
+        Template length
+    r: float
+        Tolerance as a fraction of the standard deviation of the original signal
+
+    Returns
+    -------
+    results: dict
+        Results of multiscale entropy analysis
+        mse: np.array
+            Sample entropy by scale
+        ci: float
+            Complexity index (sum of sample entropy over scales)
+    """
+    x = np.asarray(signal, dtype=float)
+    tolerance = r * x.std()
+
+    mse = np.empty(scales)
+    for scale in range(1, scales + 1):
+        coarse = x[:len(x) // scale * scale].reshape(-1, scale).mean(axis=1)
+        mse[scale - 1] = sampleEntropy(coarse, m, tolerance=tolerance)
+
+    results = {
+        'mse': mse,
+        'ci': np.nansum(mse)
+    }
+
+    return results
+
+
+def entropyFeatures(dfs: list, scales: int = 10, m: int = 2, r: float = 0.2) -> list:
+    """ Sample and multiscale entropy of the lateral and antero-posterior
+        signals of many feet or studies
+
+    Parameters
+    ----------
+    dfs: list
+        Pandas dataframes converted from balance signal data from file
+        (e.g. left, center and right foot of a study)
+    scales: int
+        Number of coarse-graining scales
+    m: int
+        Template length
+    r: float
+        Tolerance as a fraction of the signal standard deviation
+
+    Returns
+    -------
+    features: list
+        Dictionary by dataframe with keys lat_sampen, lat_mse, lat_ci and
+        the same for ap
+    """
+    features = []
+    for df in dfs:
+        feature = {}
+        for j, name in enumerate(('lat', 'ap')):
+            signal = df.iloc[:,j].to_numpy(dtype=float)
+            multiscale = multiscaleEntropy(signal, scales, m, r)
+            feature[f'{name}_sampen'] = multiscale['mse'][0]
+            feature[f'{name}_mse'] = multiscale['mse']
+            feature[f'{name}_ci'] = multiscale['ci']
+        features.append(feature)
+
+    return features
+
+
+# --------------------------
+# Difusión del Estabilograma
+# --------------------------
+def meanSquaredDisplacement(signals: np.array, max_lag: int) -> np.array:
+    """ Mean squared displacement of many signals for lags 0 to max_lag
+
+    The lagged products come from an FFT autocorrelation, so the cost is
+    n log n for all lags instead of n² for the direct sums.
+
+    Parameters
+    ----------
+    signals: np.array
+        Signals of equal length, shape (n_signals, n_samples)
+    max_lag: int
+        Largest lag in samples
+
+    Returns
+    -------
+    msd: np.array
+        Mean squared displacement, shape (n_signals, max_lag + 1)
+    """
+    x = np.atleast_2d(np.asarray(signals, dtype=float))
+    x = x - x.mean(axis=1, keepdims=True)
+    n = x.shape[1]
+    lags = np.arange(max_lag + 1)
+
+    spectrum = np.fft.rfft(x, n=2 * n, axis=1)
+    autocorrelation = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, n=2 * n, axis=1)[:, :max_lag + 1]
+
+    squares = np.concatenate((np.zeros((x.shape[0], 1)), np.cumsum(x * x, axis=1)), axis=1)
+    tail = squares[:, -1:] - squares[:, lags]
+    head = squares[:, n - lags]
+
+    return (tail + head - 2 * autocorrelation) / (n - lags)
+
+
+def diffusionAnalysis(dfs: list, fs: float = 10, short_term: tuple = (0.0, 1.0), long_term: tuple = (2.5, 10.0)) -> list:
+    """ Stabilogram diffusion analysis of many feet or studies
+
+    Parameters
+    ----------
+    dfs: list
+        Pandas dataframes converted from balance signal data from file
+        (e.g. left, center and right foot of a study)
+    fs: float
+        Sampling frequency in Hz
+    short_term: tuple
+        Time interval (s) of the short-term region
+    long_term: tuple
+        Time interval (s) of the long-term region
+
+    Returns
+    -------
+    features: list
+        Dictionary by dataframe with keys for lat, ap and centro (planar):
+        {name}_ds: float
+            Short-term diffusion coefficient
+        {name}_dl: float
+            Long-term diffusion coefficient
+        {name}_tc: float
+            Critical time interval (intersection of both regions)
+        {name}_msd_c: float
+            Mean squared displacement at the critical point
+    """
+    features = [{} for _ in dfs]
+
+    by_length = {}
+    for i, df in enumerate(dfs):
+        by_length.setdefault(len(df), []).append(i)
+
+    for length, indexes in by_length.items():
+        signals = np.concatenate([dfs[i].iloc[:,:2].to_numpy(dtype=float).T for i in indexes])
+        max_lag = min(int(round(long_term[1] * fs)), length - 1)
+        msd = meanSquaredDisplacement(signals, max_lag)
+        msd = np.concatenate((msd, msd[0::2] + msd[1::2]))
+        t = np.arange(max_lag + 1) / fs
+
+        short = (t > short_term[0]) & (t <= short_term[1])
+        long = (t >= long_term[0]) & (t <= long_term[1])
+        short_slope, short_intercept = _line_fit(t[short], msd[:, short])
+        long_slope, long_intercept = _line_fit(t[long], msd[:, long])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tc = (long_intercept - short_intercept) / (short_slope - long_slope)
+
+        for k, i in enumerate(indexes):
+            for name, row in (('lat', 2 * k), ('ap', 2 * k + 1), ('centro', len(signals) + k)):
+                features[i][f'{name}_ds'] = short_slope[row] / 2
+                features[i][f'{name}_dl'] = long_slope[row] / 2
+                features[i][f'{name}_tc'] = tc[row]
+                features[i][f'{name}_msd_c'] = short_slope[row] * tc[row] + short_intercept[row]
+
+    return features
+
+
+def _line_fit(t: np.array, values: np.array) -> tuple:
+    """ Least squares slope and intercept of each row of values against t """
+    if len(t) < 2:
+        nan = np.full(values.shape[0], np.nan)
+        return nan, nan
+    t_mean = t.mean()
+    values_mean = values.mean(axis=1)
+    slope = ((t - t_mean) * (values - values_mean[:, None])).sum(axis=1) / ((t - t_mean) ** 2).sum()
+    return slope, values_mean - slope * t_mean
+
+
+# ----------------------
+# Densidad de Oscilación
+# ----------------------
+def swayDensity(x: np.array, y: np.array, radius: float = 2.5, fs: float = 10) -> np.array:
+    """ Sway density curve of the center of pressure
+
+    For every sample, the time the center of pressure stays continuously
+    inside a circle of the given radius centered on that sample. The first
+    sample leaving the circle on each side is found by a galloping search over
+    a sparse table of bounding boxes, which skips whole spans of samples that
+    lie inside the circle, so the cost grows with the signal length times the
+    logarithm of the longest stay.
+
+    Parameters
+    ----------
+    x: np.array
+        Lateral signal
+    y: np.array
+        Antero-posterior signal
+    radius: float
+        Circle radius in signal units
+    fs: float
+        Sampling frequency in Hz
+
+    Returns
+    -------
+    density: np.array
+        Stay time in seconds by sample
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    limit = radius * radius
+
+    forward = _circle_exits(x, y, limit)
+    backward = n - 1 - _circle_exits(x[::-1], y[::-1], limit)[::-1]
+
+    return (forward - backward - 1) / fs
+
+
+def _circle_exits(x: np.array, y: np.array, limit: float) -> np.array:
+    """ Index of the first later sample farther than sqrt(limit) from each
+        sample (the signal length if none)
+    """
+    n = len(x)
+    low_x, high_x, low_y, high_y = [x], [x], [y], [y]
+    size = 1
+    while 2 * size <= n:
+        low_x.append(np.minimum(low_x[-1][:-size], low_x[-1][size:]))
+        high_x.append(np.maximum(high_x[-1][:-size], high_x[-1][size:]))
+        low_y.append(np.minimum(low_y[-1][:-size], low_y[-1][size:]))
+        high_y.append(np.maximum(high_y[-1][:-size], high_y[-1][size:]))
+        size *= 2
+    lengths = np.array([len(level) for level in low_x])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    low_x, high_x, low_y, high_y = (np.concatenate(levels) for levels in (low_x, high_x, low_y, high_y))
+    top = len(lengths) - 1
+
+    exits = np.arange(1, n + 1)
+    active = np.flatnonzero(exits < n)
+    position = exits[active]
+    level = np.zeros(len(active), dtype=int)
+    cx = x[active]
+    cy = y[active]
+
+    while len(active):
+        # The 2 ** level samples from position are inside if the farthest corner of their box is
+        fits = position < lengths[level]
+        box = np.where(fits, offsets[level] + position, 0)
+        dx = np.maximum(np.abs(cx - low_x[box]), np.abs(high_x[box] - cx))
+        dy = np.maximum(np.abs(cy - low_y[box]), np.abs(high_y[box] - cy))
+        inside = fits & (dx * dx + dy * dy <= limit)
+
+        position += inside << level
+        level = np.where(inside, np.minimum(level + 1, top), level - 1)
+
+        # A single sample outside the circle is the exit
+        done = (position >= n) | (level < 0)
+        if done.any():
+            exits[active[done]] = position[done]
+            keep = ~done
+            active, position, level, cx, cy = active[keep], position[keep], level[keep], cx[keep], cy[keep]
+
+    return exits
+
+
+def swayDensityFeatures(dfs: list, radius: float = 2.5, fs: float = 10, cutoff: float = 2.5) -> list:
+    """ Sway density analysis of many feet or studies
+
+    Parameters
+    ----------
+    dfs: list
+        Pandas dataframes converted from balance signal data from file
+        (e.g. left, center and right foot of a study)
+    radius: float
+        Circle radius in signal units
+    fs: float
+        Sampling frequency in Hz
+    cutoff: float
+        Low-pass cutoff frequency (Hz) of the sway density curve before
+        peak detection
+
+    Returns
+    -------
+    features: list
+        Dictionary by dataframe with keys:
+        sd_peak: float
+            Mean peak value (s)
+        sd_distance: float
+            Mean distance between consecutive peak positions
+        sd_time: float
+            Mean time between consecutive peaks (s)
+    """
+    sos = filterDesign(cutoff, fs)
+    features = []
+    for df in dfs:
+        x = df.iloc[:,0].to_numpy(dtype=float)
+        y = df.iloc[:,1].to_numpy(dtype=float)
+        density = swayDensity(x, y, radius, fs)
+        if len(density) > 3 * (2 * len(sos) + 1):
+            density = sosfiltfilt(sos, density)
+        peaks, _ = find_peaks(density)
+
+        feature = {'sd_peak': np.nan, 'sd_distance': np.nan, 'sd_time': np.nan}
+        if len(peaks):
+            feature['sd_peak'] = density[peaks].mean()
+        if len(peaks) > 1:
+            feature['sd_distance'] = np.hypot(np.diff(x[peaks]), np.diff(y[peaks])).mean()
+            feature['sd_time'] = np.diff(peaks).mean() / fs
+        features.append(feature)
+
+    return features
+
+
+# --------------------
+# Rambling y Trembling
+# --------------------
+def ramblingTrembling(signal, fs: float = 10, window: float = 1.0) -> dict:
+    """ Rambling and trembling decomposition of a center of pressure signal
+
+    The center of gravity is estimated with a centered moving average. The
+    instant equilibrium points are the crossings of the center of pressure
+    through it, where the horizontal force is zero. Rambling is the cubic
+    spline through those points and trembling the remainder.
+
+    Parameters
+    ----------
+    signal: pd.Series or np.array
+        Lateral or antero-posterior signal
+    fs: float
+        Sampling frequency in Hz
+    window: float
+        Moving average length in seconds for the center of gravity
+
+    Returns
+    -------
+    results: dict
+        rambling: np.array
+            Rambling component
+        trembling: np.array
+            Trembling component
+        iep_t: np.array
+            Time of the instant equilibrium points (s)
+        iep: np.array
+            Signal value at the instant equilibrium points
+    """
+    x = np.asarray(signal, dtype=float)
+    n = len(x)
+    t = np.arange(n) / fs
+
+    half = max(int(round(window * fs / 2)), 1)
+    sums = np.concatenate(([0.0], np.cumsum(x)))
+    starts = np.clip(np.arange(n) - half, 0, n)
+    ends = np.clip(np.arange(n) + half + 1, 0, n)
+    cog = (sums[ends] - sums[starts]) / (ends - starts)
+
+    force = x - cog
+    crossing = np.flatnonzero(np.signbit(force[:-1]) != np.signbit(force[1:]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = force[crossing] / (force[crossing] - force[crossing + 1])
+    fraction = np.nan_to_num(fraction)
+    iep_t = (crossing + fraction) / fs
+    iep = x[crossing] + fraction * (x[crossing + 1] - x[crossing])
+    iep_t, unique = np.unique(iep_t, return_index=True)
+    iep = iep[unique]
+
+    if len(iep_t) >= 2:
+        rambling = CubicSpline(iep_t, iep, extrapolate=True)(t)
+    else:
+        rambling = cog
+
+    results = {
+        'rambling': rambling,
+        'trembling': x - rambling,
+        'iep_t': iep_t,
+        'iep': iep
+    }
+
+    return results
+
+
+def ramblingTremblingFeatures(dfs: list, fs: float = 10, window: float = 1.0) -> list:
+    """ Rambling and trembling analysis of many feet or studies
+
+    Parameters
+    ----------
+    dfs: list
+        Pandas dataframes converted from balance signal data from file
+        (e.g. left, center and right foot of a study)
+    fs: float
+        Sampling frequency in Hz
+    window: float
+        Moving average length in seconds for the center of gravity
+
+    Returns
+    -------
+    features: list
+        Dictionary by dataframe with keys lat_rambling_rms,
+        lat_trembling_rms, lat_iep_rate (instant equilibrium points by
+        second) and the same for ap
+    """
+    features = []
+    for df in dfs:
+        feature = {}
+        for j, name in enumerate(('lat', 'ap')):
+            decomposition = ramblingTrembling(df.iloc[:,j], fs, window)
+            rambling = decomposition['rambling']
+            trembling = decomposition['trembling']
+            feature[f'{name}_rambling_rms'] = np.sqrt(np.mean((rambling - rambling.mean()) ** 2))
+            feature[f'{name}_trembling_rms'] = np.sqrt(np.mean(trembling ** 2))
+            feature[f'{name}_iep_rate'] = len(decomposition['iep_t']) * fs / len(df)
+        features.append(feature)
+
+    return features
+
+
 # ------
 # Elipse
 # ------
@@ -493,6 +1449,160 @@ def convexHull(df: pd.DataFrame) -> dict:
     return results
 
 
+def convexHullBatch(trials: list, vertices: bool = False, chunk_size: int = 1024) -> dict:
+    """ Convex hull analysis of many balance signals in a single call
+
+    Hulls are computed with a monotone chain that advances every trial of
+    a chunk at the same time, so the cost of a cohort is a few thousand
+    numpy operations instead of one qhull call per foot per study.
+
+    Parameters
+    ----------
+    trials: list
+        Pandas dataframes (lateral and antero-posterior columns, as used by
+        convexHull) or arrays of shape (n, 2)
+    vertices: bool
+        Return the hull vertex indices of every trial
+    chunk_size: int
+        Number of trials processed together
+
+    Returns
+    -------
+    results: dict
+        Results of convex hull analysis by trial
+        area: np.array
+            area of convex hull of each trial
+        vertices: list
+            indices of convex hull points of each trial in counter-clockwise
+            order (None if vertices is False)
+    """
+    points = [_trial_points(trial) for trial in trials]
+
+    areas = np.zeros(len(points))
+    hull_vertices = [] if vertices else None
+    for start in range(0, len(points), chunk_size):
+        chunk_areas, chunk_vertices = _monotone_chain(points[start:start + chunk_size])
+        areas[start:start + len(chunk_areas)] = chunk_areas
+        if vertices:
+            hull_vertices.extend(chunk_vertices)
+
+    results = {
+        'area': areas,
+        'vertices': hull_vertices
+    }
+
+    return results
+
+
+def _trial_points(trial) -> np.array:
+    """ Lateral and antero-posterior points of a trial as an (n, 2) array """
+    if isinstance(trial, pd.DataFrame):
+        return trial.to_numpy(dtype=float)[:,:2]
+    return np.asarray(trial, dtype=float)[:,:2]
+
+
+def _monotone_chain(points: list) -> tuple:
+    """ Batched Andrew's monotone chain over trials of different lengths
+
+    Parameters
+    ----------
+    points: list
+        Arrays of shape (n, 2) of each trial
+
+    Returns
+    -------
+    areas, vertices: tuple
+        Hull areas and hull vertex indices by trial
+    """
+    n_trials = len(points)
+    sizes = np.array([len(p) for p in points])
+    x = np.empty((n_trials, sizes.max()))
+    y = np.empty((n_trials, sizes.max()))
+    for i, p in enumerate(points):
+        x[i, :len(p)], y[i, :len(p)] = p[:,0], p[:,1]
+        x[i, len(p):], y[i, len(p):] = p[0,0], p[0,1]
+    index = np.broadcast_to(np.arange(x.shape[1]), x.shape).copy()
+    index[index >= sizes[:, None]] = 0
+
+    # A coarse pass discards most interior points cheaply, a finer one trims the rest
+    x, y, index = _discard_interior(x, y, index, 8)
+    x, y, index = _discard_interior(x, y, index, 32)
+
+    # Lexicographic sort by lateral, then antero-posterior coordinate
+    rows = np.arange(n_trials)[:, None]
+    order = np.lexsort((y, x), axis=-1)
+    x, y, index = x[rows, order], y[rows, order], index[rows, order]
+
+    n_points = x.shape[1]
+    lower, lower_size = _half_hull(x, y, range(n_points))
+    upper, upper_size = _half_hull(x, y, range(n_points - 1, -1, -1))
+
+    areas = 0.5 * np.abs(_chain_cross(x, y, lower, lower_size) + _chain_cross(x, y, upper, upper_size))
+    hull_vertices = [np.concatenate((index[i, lower[i, :lower_size[i]-1]], index[i, upper[i, :upper_size[i]-1]]))
+        for i in range(n_trials)]
+
+    return areas, hull_vertices
+
+
+def _discard_interior(x: np.array, y: np.array, index: np.array, n_directions: int) -> tuple:
+    """ Akl-Toussaint heuristic: points strictly inside the polygon of extreme
+        points along n_directions are never hull vertices and are discarded """
+    rows = np.arange(x.shape[0])[:, None]
+    directions = np.linspace(0, 2 * np.pi, n_directions, endpoint=False)
+    extremes = np.stack([(x * np.cos(phi) + y * np.sin(phi)).argmax(1) for phi in directions], axis=1)
+    corner_x = x[rows, extremes]
+    corner_y = y[rows, extremes]
+
+    inside = np.ones(x.shape, dtype=bool)
+    for a in range(n_directions):
+        b = (a + 1) % n_directions
+        edge_x = corner_x[:, b] - corner_x[:, a]
+        edge_y = corner_y[:, b] - corner_y[:, a]
+        offset = edge_x * corner_y[:, a] - edge_y * corner_x[:, a]
+        degenerate = (edge_x == 0) & (edge_y == 0)
+        inside &= (edge_x[:, None] * y - edge_y[:, None] * x > offset[:, None]) | degenerate[:, None]
+    inside[rows, extremes] = False
+
+    # Compact the survivors to the front and pad with the first survivor
+    order = np.argsort(inside, axis=1, kind='stable')
+    kept = x.shape[1] - inside.sum(1)
+    n_points = kept.max()
+    order = order[:, :n_points]
+    order = np.where(np.arange(n_points) >= kept[:, None], order[:, :1], order)
+
+    return x[rows, order], y[rows, order], index[rows, order]
+
+
+def _half_hull(x: np.array, y: np.array, sweep) -> tuple:
+    """ Lower (or upper, for a reversed sweep) hull chain of every trial """
+    rows = np.arange(x.shape[0])
+    stack = np.zeros(x.shape, dtype=int)
+    size = np.zeros(x.shape[0], dtype=int)
+    for i in sweep:
+        while True:
+            a = stack[rows, np.maximum(size - 2, 0)]
+            b = stack[rows, np.maximum(size - 1, 0)]
+            ax, ay = x[rows, a], y[rows, a]
+            turn = (x[rows, b] - ax) * (y[:, i] - ay) - (y[rows, b] - ay) * (x[:, i] - ax)
+            pop = (size >= 2) & (turn <= 0)
+            if not pop.any():
+                break
+            size[pop] -= 1
+        stack[rows, size] = i
+        size += 1
+    return stack, size
+
+
+def _chain_cross(x: np.array, y: np.array, chain: np.array, size: np.array) -> np.array:
+    """ Shoelace sum over the consecutive edges of hull chains """
+    rows = np.arange(x.shape[0])[:, None]
+    chain_x = x[rows, chain]
+    chain_y = y[rows, chain]
+    terms = chain_x[:, :-1] * chain_y[:, 1:] - chain_x[:, 1:] * chain_y[:, :-1]
+    valid = np.arange(chain.shape[1] - 1) < (size - 1)[:, None]
+    return np.where(valid, terms, 0).sum(1)
+
+
 # ----------------
 # Elipse Orientada
 # ----------------
@@ -574,184 +1684,544 @@ def ellipsePCA(df: pd.DataFrame) -> dict:
 
     return results
 
+# ---------
+# Bootstrap
+# ---------
+# Metrics averaged over the samples. Ranges and the areas built on them
+# (range ellipse, convex hull and the PCA ellipse, sized by the extremes)
+# are left out: a resample only holds a subset of the observed positions, so
+# their replicates fall below the estimate and percentile intervals miss it
+BOOTSTRAP_METRICS = ('lat_vel', 'ap_vel', 'lat_rms', 'ap_rms', 'centro_vel', 'centro_dist', 'centro_frec')
+
+
+def blockBootstrapIndex(n: int, n_boot: int, block: int, rng: np.random.Generator) -> np.array:
+    """ Moving block bootstrap resample indexes
+
+    Parameters
+    ----------
+    n: int
+        Signal length
+    n_boot: int
+        Number of replicates
+    block: int
+        Block length in samples
+    rng: np.random.Generator
+        Random generator
+
+    Returns
+    -------
+    index: np.array
+        Sample indexes of every replicate, shape (n_boot, n)
+    """
+    block = int(min(max(block, 1), n))
+    starts = rng.integers(0, n - block + 1, size=(n_boot, -(-n // block)))
+    index = (starts[:, :, None] + np.arange(block)).reshape(n_boot, -1)
+    return index[:, :n]
+
+
+def bootstrapCI(df: pd.DataFrame, n_boot: int = 1000, block: int = None, alpha: float = 0.05, fs: float = 10,
+                metrics: tuple = BOOTSTRAP_METRICS, seed: int = None) -> dict:
+    """ Block bootstrap confidence intervals of the sample averaged sway metrics
+
+    Only the velocity, RMS, mean distance and mean frequency metrics in
+    BOOTSTRAP_METRICS get intervals. Ranges and the range ellipse, convex
+    hull and PCA ellipse areas are not covered, since they depend on the
+    extreme positions and their percentile intervals miss the estimate.
+
+    Positions are resampled in blocks for the RMS and distance metrics, and
+    the sample to sample differences are resampled in blocks for the
+    velocity metrics, so the serial correlation inside each block is kept.
+    All replicates are evaluated at once on the resampled arrays.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Pandas dataframe converted from balance signal data from file
+    n_boot: int
+        Number of replicates
+    block: int
+        Block length in samples (cube root of the length if None)
+    alpha: float
+        Significance level of the two-sided percentile intervals
+    fs: float
+        Sampling frequency in Hz
+    metrics: tuple
+        Metric names, from BOOTSTRAP_METRICS
+    seed: int
+        Random generator seed
+
+    Returns
+    -------
+    intervals: dict
+        Lower and upper limit by metric name
+    """
+    rng = np.random.default_rng(seed)
+    x = df.iloc[:,0].to_numpy(dtype=float)
+    y = df.iloc[:,1].to_numpy(dtype=float)
+    n = len(x)
+    block = block or int(round(n ** (1 / 3)))
+    duration = n / fs
+
+    position = blockBootstrapIndex(n, n_boot, block, rng)
+    X, Y = x[position], y[position]
+    difference = blockBootstrapIndex(n - 1, n_boot, block, rng)
+    dX = np.abs(np.diff(x))[difference]
+    dY = np.abs(np.diff(y))[difference]
+
+    JX = X - X.mean(axis=1, keepdims=True)
+    JY = Y - Y.mean(axis=1, keepdims=True)
+    centro_vel = np.sqrt(dX * dX + dY * dY).sum(axis=1) / duration
+
+    replicates = {
+        'lat_vel': dX.sum(axis=1) * fs / (n - 1),
+        'ap_vel': dY.sum(axis=1) * fs / (n - 1),
+        'lat_rms': np.sqrt((JX * JX).sum(axis=1) / (n - 1)),
+        'ap_rms': np.sqrt((JY * JY).sum(axis=1) / (n - 1)),
+        'centro_vel': centro_vel,
+        'centro_dist': np.sqrt(X * X + Y * Y).sum(axis=1) / duration,
+        'centro_frec': centro_vel / (2 * np.pi),
+    }
+
+    quantiles = (alpha / 2, 1 - alpha / 2)
+    intervals = {}
+    for name in metrics:
+        low, high = np.quantile(replicates[name], quantiles)
+        intervals[name] = (low, high)
+
+    return intervals
+
+
+# ----------
+# Conexiones
+# ----------
+POOL_SIZE = 8
+CONNECT_TIMEOUT = 10
+# Errors of the database engines, raised by migrate_db when the configured
+# database cannot be reached
+DB_ERRORS = (psycopg2.Error, sqlite3.Error)
+HEALTH_CHECK_IDLE = 30.0
+SQLITE_FILE = 'estabilometria.db'
+
+# Storage engines by db_engine setting: modules with the same functions
+# (migrate, get_patient, add_study, insert_metrics, ...) over a cursor. The
+# replica is a SQLite file synchronized with the PostgreSQL server
+ENGINES = {'postgresql': storage, 'sqlite': storage_sqlite, 'replica': replica}
+
+_engine = None
+_pool = None
+_pool_lock = threading.Lock()
+_last_used = {}
+_sqlite = threading.local()
+# Increased by reset_pool, connections and pools of older settings are discarded
+_generation = 0
+_sync = None
+
+
+def get_engine():
+    """ Storage module of the database engine configured in the settings
+        file (PostgreSQL by default)
+
+    Read without _pool_lock, which is held while the pool connects, so the
+    engine of the interface thread never waits for the server.
+    """
+    global _engine
+    engine, generation = _engine, _generation
+    if engine is None:
+        settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
+        engine = ENGINES[settings.value('db_engine', 'postgresql')]
+        if generation == _generation:
+            _engine = engine
+    return engine
+
+
+def get_pool() -> ThreadedConnectionPool:
+    """ Process-wide connection pool, created on first use from the
+        database configured in the settings file
+
+    The first connection is opened outside _pool_lock and fails after the
+    db_connect_timeout setting (seconds), so a slow or unreachable server
+    only delays the thread that borrows the connection.
+    """
+    global _pool
+    while True:
+        pool, generation = _pool, _generation
+        if pool is not None and not pool.closed:
+            return pool
+        settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
+        pool = ThreadedConnectionPool(1, int(settings.value('db_pool_size', POOL_SIZE)),
+                                      user=settings.value('db_user'),
+                                      password=settings.value('db_password'),
+                                      host=settings.value('db_host'),
+                                      port=settings.value('db_port'),
+                                      database=settings.value('db_name'),
+                                      connect_timeout=int(settings.value('db_connect_timeout', CONNECT_TIMEOUT)))
+        with _pool_lock:
+            # Kept unless another thread created one or the settings were reset meanwhile
+            if generation == _generation and (_pool is None or _pool.closed):
+                _pool = pool
+                _last_used.clear()
+                return pool
+        pool.closeall()
+
+
+def get_sqlite() -> sqlite3.Connection:
+    """ SQLite connection of the current thread to the database file
+        configured in the settings file, opened on first use
+    """
+    connection = getattr(_sqlite, 'connection', None)
+    if connection is None or _sqlite.generation != _generation:
+        if connection is not None:
+            connection.close()
+        settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
+        db_file = Path(settings.value('db_file', SQLITE_FILE))
+        if not db_file.is_absolute():
+            db_file = Path(sys.path[0]) / db_file
+        _sqlite.connection = storage_sqlite.connect(str(db_file))
+        _sqlite.generation = _generation
+    return _sqlite.connection
+
+
+def start_sync() -> replica.Sync:
+    """ Start the background synchronization of the replica with the
+        server, once by process
+    """
+    global _sync
+    with _pool_lock:
+        if _sync is None:
+            settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
+            _sync = replica.Sync(_sqlite_connection, _postgres_connection,
+                                 float(settings.value('db_sync_interval', replica.SYNC_INTERVAL)))
+            _sync.start()
+        return _sync
+
+
+def get_sync() -> replica.Sync:
+    """ Synchronization of the replica, None if it is not running """
+    return _sync
+
+
+def reset_pool() -> None:
+    """ Close every pooled connection, the next borrow connects with the
+        current settings and engine
+    """
+    global _engine, _pool, _generation, _sync
+    # Stopped before taking the lock, which its thread may be waiting for
+    if _sync is not None:
+        _sync.stop()
+        _sync = None
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _engine = None
+        _pool = None
+        _last_used.clear()
+        # SQLite connections of other threads are reopened on their next use
+        _generation += 1
+
+
+def _healthy(connection) -> bool:
+    """ Connection open and, after a long idle time, answering a query """
+    if connection.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(connection), 0.0) < HEALTH_CHECK_IDLE:
+        return True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        connection.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@contextmanager
+def db_connection(write: bool = False):
+    """ Borrow a connection of the configured engine, committed on exit
+
+    The transaction is rolled back if the block raises.
+
+    Parameters
+    ----------
+    write: bool
+        The transaction writes. SQLite then takes the write lock when it
+        begins, so reads made before the first write cannot turn stale
+        (SQLITE_BUSY_SNAPSHOT); ignored by PostgreSQL
+    """
+    if get_engine() is storage:
+        connection_manager = _postgres_connection()
+    else:
+        connection_manager = _sqlite_connection(write)
+    with connection_manager as connection:
+        yield connection
+
+
+@contextmanager
+def _postgres_connection():
+    """ Borrow a pooled connection, committed and returned on exit
+
+    Broken connections are discarded and replaced before use, and a
+    connection lost while in use is closed instead of returned to the pool.
+    """
+    pool = get_pool()
+    connection = pool.getconn()
+    for _ in range(POOL_SIZE):
+        if _healthy(connection):
+            break
+        _last_used.pop(id(connection), None)
+        pool.putconn(connection, close=True)
+        connection = pool.getconn()
+    try:
+        yield connection
+        connection.commit()
+    except BaseException:
+        if not connection.closed:
+            connection.rollback()
+        raise
+    finally:
+        _last_used[id(connection)] = time.monotonic()
+        if connection.closed or pool.closed:
+            _last_used.pop(id(connection), None)
+        if pool.closed:
+            # Pool reset by a new configuration while the connection was in use
+            connection.close()
+        else:
+            pool.putconn(connection, close=bool(connection.closed))
+
+
+@contextmanager
+def _sqlite_connection(write: bool = False):
+    """ Transaction on the SQLite connection of the current thread, BEGIN
+        IMMEDIATE if it writes
+
+    A write to the replica wakes its synchronization to push it.
+    """
+    connection = get_sqlite()
+    changes = connection.total_changes
+    connection.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+    try:
+        yield connection
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    sync = _sync
+    if sync is not None and connection.total_changes != changes and threading.current_thread() is not sync.thread:
+        sync.wake()
+
+
 # ---------
 # Funciones
 # ---------
-def create_db(db_table: str) -> list:
-    """ Creates database tables if they don't exist and returns table data
+def migrate_db() -> None:
+    """ Migrate the database schema to the latest version, once after the
+        database is configured. Table rows are read by pages with get_page
+
+    Raises
+    ------
+    psycopg2.Error or sqlite3.Error (DB_ERRORS)
+        Server unreachable, database file not writable or failed migration
+    """
+    engine = get_engine()
+    with db_connection(write=True) as connection:
+        engine.migrate(connection.cursor())
+    # The replica opens without the server, reached in the background
+    if engine is replica:
+        start_sync()
+
+
+def add_db(db_table: str, data: dict) -> tuple:
+    """ Adds data to database table and returns the inserted row
     
     Parameters
     ----------
     db_table: str
         Database table name
+    data: dict
+        Data from patient or study file. Study data may include metrics
+        (tuples foot, metric, value, version, preprocessing) and signals
+        (unfiltered dataframe by foot) stored with the study
     
     Returns
     -------
-    table_data: list
-        Data of table if exists (empty if table don't exist)
-    """
-    settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
-    db_host = settings.value('db_host')
-    db_port = settings.value('db_port')
-    db_name = settings.value('db_name')
-    db_user = settings.value('db_user')
-    db_password = settings.value('db_password')
-    try:
-        connection = psycopg2.connect(user=db_user, 
-                                  password=db_password, 
-                                  host=db_host, 
-                                  port=db_port, 
-                                  database=db_name)
-    except psycopg2.OperationalError as err:
-        return err
-
-    cursor = connection.cursor()
-
-    if db_table == 'pacientes':
-        cursor.execute("""CREATE TABLE IF NOT EXISTS pacientes (
-                        id serial PRIMARY KEY,
-                        last_name VARCHAR(128) NOT NULL,
-                        first_name VARCHAR(128) NOT NULL,
-                        id_type CHAR(2) NOT NULL,
-                        id_number BIGINT UNIQUE NOT NULL,
-                        birth_date VARCHAR(128) NOT NULL,
-                        sex CHAR(1) NOT NULL,
-                        weight NUMERIC(5,2) NOT NULL,
-                        weight_unit CHAR(2) NOT NULL,
-                        height NUMERIC(3,2) NOT NULL,
-                        height_unit VARCHAR(7) NOT NULL,
-                        bmi NUMERIC(4,2) NOT NULL
-                        )""")
-    elif db_table == 'estudios':
-        cursor.execute("""CREATE TABLE IF NOT EXISTS estudios (
-                        id serial PRIMARY KEY,
-                        id_number BIGINT NOT NULL,
-                        file_name VARCHAR(128) UNIQUE NOT NULL,
-                        file_path VARCHAR(128) UNIQUE NOT NULL
-                        )""")
-
-    connection.commit()
-
-    table_data = None
-    if db_table == 'pacientes':
-        cursor.execute('SELECT * FROM pacientes ORDER BY id ASC')
-        table_data = cursor.fetchall()
-    
-    connection.close()
+    row: storage.Paciente or storage.Estudio
+        Inserted row
+    """
+    engine = get_engine()
+    with db_connection(write=True) as connection:
+        cursor = connection.cursor()
 
-    return table_data
+        row = None
+        if db_table == 'pacientes':
+            row = engine.add_patient(cursor, data)
+        elif db_table == 'estudios':
+            row = engine.add_study(cursor, data['id_number'], data['file_name'], data['file_path'])
+            # Metrics and signals are written in the same transaction as the study
+            if data.get('metrics'):
+                engine.insert_metrics(cursor, [(data['file_name'], *row) for row in data['metrics']])
+            if data.get('signals'):
+                engine.insert_signals(cursor, _signal_rows({data['file_name']: data['signals']}))
+
+    return row
+
+
+def add_studies(records: list, chunk: int = 500) -> list:
+    """ Register many studies with their metrics and signals, one
+        transaction and multi-row insert by chunk
+
+    Parameters
+    ----------
+    records: list
+        Study data dicts as in add_db (id_number, file_name, file_path,
+        optional metrics and signals) with an optional study_date
+    chunk: int
+        Records by transaction
+
+    Returns
+    -------
+    report: list
+        Tuples (file_name, inserted row or None, conflict message or None)
+        in the order of the records
+    """
+    engine = get_engine()
+    report = []
+    for start in range(0, len(records), chunk):
+        batch = records[start:start + chunk]
+        with db_connection(write=True) as connection:
+            cursor = connection.cursor()
+            patients = engine.registered_patients(cursor, [int(data['id_number']) for data in batch])
+            rows = [(int(data['id_number']), data['file_name'], data['file_path'], data.get('study_date'))
+                    for data in batch if int(data['id_number']) in patients]
+            inserted = {(row.file_name, row.file_path): row for row in engine.add_studies(cursor, rows)}
+            names, paths = engine.registered_studies(cursor, [data['file_name'] for data in batch],
+                                                     [data['file_path'] for data in batch])
+
+            metric_rows, signals = [], {}
+            for data in batch:
+                row = inserted.pop((data['file_name'], data['file_path']), None)
+                if row is not None:
+                    metric_rows.extend((data['file_name'], *values) for values in data.get('metrics') or [])
+                    if data.get('signals'):
+                        signals[data['file_name']] = data['signals']
+                    message = None
+                elif int(data['id_number']) not in patients:
+                    message = f'patient {data["id_number"]} is not registered'
+                elif data['file_name'] in names:
+                    message = f'file_name {data["file_name"]} is already registered'
+                elif data['file_path'] in paths:
+                    message = f'file_path {data["file_path"]} is already registered'
+                else:
+                    message = 'conflict with a study registered concurrently'
+                report.append((data['file_name'], row, message))
+
+            if metric_rows:
+                engine.insert_metrics(cursor, metric_rows)
+            if signals:
+                engine.copy_signals(cursor, _signal_rows(signals))
+
+    return report
+
+
+def copy_patients(rows: list, update: bool = True) -> tuple:
+    """ Bulk load of patients in a single transaction
+
+    Parameters
+    ----------
+    rows: list
+        Tuples with the storage.PACIENTE_VALUES fields, birth_date as a date
+    update: bool
+        Existing id numbers are updated if True, left untouched if False
+
+    Returns
+    -------
+    inserted, updated, conflicts: tuple
+        Lists of id numbers inserted, updated and not loaded because they
+        already existed
+    """
+    with db_connection(write=True) as connection:
+        return get_engine().copy_patients(connection.cursor(), rows, update)
 
 
-def add_db(db_table: str, data: dict) -> list:
-    """ Adds data to database table and returns table data updated
+def get_db(db_table: str, data_id: str) -> list:
+    """ Get data from database table
     
     Parameters
     ----------
     db_table: str
         Database table name
-    data: dict
-        Data from patient or study file
+    data_id: str
+        Patient id number
     
     Returns
     -------
     table_data: list
-        Data of table updated
-    """
-    if db_table == 'pacientes':
-        last_name_value = data['last_name']
-        first_name_value = data['first_name']
-        id_type_value = data['id_type']
-        id_value = data['id']
-        birth_date_value = data['birth_date']
-        sex_value = data['sex']
-        weight_value = data['weight']
-        weight_unit = data['weight_unit']
-        height_value = data['height']
-        height_unit = data['height_unit']
-        bmi_value = data['bmi']
-    elif db_table == 'estudios':
-        id_value = data['id_number']
-        file_name_value = data['file_name']
-        file_path_value = data['file_path']
-
-    settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
-    db_host = settings.value('db_host')
-    db_port = settings.value('db_port')
-    db_name = settings.value('db_name')
-    db_user = settings.value('db_user')
-    db_password = settings.value('db_password')
-    connection = psycopg2.connect(user=db_user, 
-                                  password=db_password, 
-                                  host=db_host, 
-                                  port=db_port, 
-                                  database=db_name)
-    cursor = connection.cursor()
-
-    insert_query = None
-    if db_table == 'pacientes':
-        insert_query = f"""INSERT INTO pacientes (last_name, first_name, id_type, id_number, birth_date, sex, weight, weight_unit, height, height_unit, bmi) 
-                    VALUES ('{last_name_value}', '{first_name_value}', '{id_type_value}', '{id_value}', '{birth_date_value}', '{sex_value}', '{weight_value}', '{weight_unit}', '{height_value}', '{height_unit}', '{bmi_value}')"""
-    elif db_table == 'estudios':
-        insert_query = f"""INSERT INTO estudios (id_number, file_name, file_path) 
-                    VALUES ('{id_value}', '{file_name_value}', '{file_path_value}')"""
-
-    cursor.execute(insert_query)
-    connection.commit()
-
-    table_data = None
-    if db_table == 'pacientes':
-        cursor.execute('SELECT * FROM pacientes ORDER BY id ASC')
-        table_data = cursor.fetchall()
-    elif db_table == 'estudios':
-        cursor.execute(f"SELECT * FROM estudios WHERE id_number='{id_value}' ORDER BY id ASC")
-        table_data = cursor.fetchall()
+        Data of table
+    """
+    engine = get_engine()
+    with db_connection() as connection:
+        cursor = connection.cursor()
+
+        table_data = None
+        if db_table == 'pacientes':
+            table_data = engine.get_patient(cursor, data_id)
+        elif db_table == 'estudios':
+            table_data = engine.get_studies(cursor, data_id)
     
-    connection.close()
-
     return table_data
 
 
-def get_db(db_table: str, data_id: str) -> list:
-    """ Get data from database table
+def get_page(db_table: str, after: int, limit: int, data_id: str = None) -> list:
+    """ Get a page of rows from database table, in insertion order
     
     Parameters
     ----------
     db_table: str
         Database table name
+    after: int
+        Database id of the last row of the previous page (0 for the first)
+    limit: int
+        Maximum number of rows
     data_id: str
-        Patient id number
+        Patient id number of the studies
     
     Returns
     -------
     table_data: list
-        Data of table
+        Rows following after
     """
-    settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
-    db_host = settings.value('db_host')
-    db_port = settings.value('db_port')
-    db_name = settings.value('db_name')
-    db_user = settings.value('db_user')
-    db_password = settings.value('db_password')
-    connection = psycopg2.connect(user=db_user, 
-                                  password=db_password, 
-                                  host=db_host, 
-                                  port=db_port, 
-                                  database=db_name)
-    cursor = connection.cursor()
-
-    table_data = None
-    if db_table == 'pacientes':
-        cursor.execute(f"SELECT * FROM pacientes WHERE id_number='{data_id}'")
-    elif db_table == 'estudios':
-        cursor.execute(f"SELECT * FROM estudios WHERE id_number='{data_id}'")
-    table_data = cursor.fetchall()
-    connection.close()
+    engine = get_engine()
+    with db_connection() as connection:
+        cursor = connection.cursor()
+
+        table_data = None
+        if db_table == 'pacientes':
+            table_data = engine.patients_page(cursor, after, limit)
+        elif db_table == 'estudios':
+            table_data = engine.studies_page(cursor, data_id, after, limit)
     
     return table_data
 
 
-def edit_db(db_table: str, id_db: int, data: dict) -> list:
-    """ Edit data of a database table and returns table data updated
+def search_patients(text: str, limit: int = 10) -> list:
+    """ Patients matching a search text
+    
+    Parameters
+    ----------
+    text: str
+        Words of the id number, last or first name
+    limit: int
+        Maximum number of patients
+    
+    Returns
+    -------
+    patients: list
+        Matching patients in name order
+    """
+    with db_connection() as connection:
+        return get_engine().search_patients(connection.cursor(), text, limit)
+
+
+def edit_db(db_table: str, id_db: int, data: dict) -> tuple:
+    """ Edit data of a database table and returns the updated row
     
     Parameters
     ----------
@@ -764,69 +2234,24 @@ def edit_db(db_table: str, id_db: int, data: dict) -> list:
     
     Returns
     -------
-    table_data: list
-        Data of table updated
-    """
-    if db_table == 'pacientes':
-        last_name_value = data['last_name']
-        first_name_value = data['first_name']
-        id_type_value = data['id_type']
-        id_value = data['id']
-        birth_date_value = data['birth_date']
-        sex_value = data['sex']
-        weight_value = data['weight']
-        weight_unit = data['weight_unit']
-        height_value = data['height']
-        height_unit = data['height_unit']
-        bmi_value = data['bmi']
-    elif db_table == 'estudios':
-        id_value = data['id']
-        file_name_value = data['file_name']
-        file_path_value = data['file_path']
-
-    settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
-    db_host = settings.value('db_host')
-    db_port = settings.value('db_port')
-    db_name = settings.value('db_name')
-    db_user = settings.value('db_user')
-    db_password = settings.value('db_password')
-    connection = psycopg2.connect(user=db_user, 
-                                  password=db_password, 
-                                  host=db_host, 
-                                  port=db_port, 
-                                  database=db_name)
-    cursor = connection.cursor()    
-    
-    update_query = None
-    if db_table == 'pacientes':
-        update_query = f"""UPDATE pacientes 
-                    SET (last_name, first_name, id_type, id_number, birth_date, sex, weight, weight_unit, height, height_unit, bmi)
-                    = ('{last_name_value}', '{first_name_value}', '{id_type_value}', '{id_value}', '{birth_date_value}', '{sex_value}', '{weight_value}', '{weight_unit}', '{height_value}', '{height_unit}', '{bmi_value}') 
-                    WHERE id = '{id_db}' """
-    elif db_table == 'estudios':
-        update_query = f"""UPDATE estudios 
-                    SET (id_number, file_name, file_path)
-                    = ('{id_value}', '{file_name_value}', '{file_path_value}') 
-                    WHERE id = '{id_db}' """
-    
-    cursor.execute(update_query)
-    connection.commit()
-
-    table_data = None
-    if db_table == 'pacientes':
-        cursor.execute('SELECT * FROM pacientes ORDER BY id ASC')
-        table_data = cursor.fetchall()
-    elif db_table == 'estudios':
-        cursor.execute('SELECT * FROM estudios')
-        table_data = cursor.fetchall()
-    
-    connection.close()
+    row: storage.Paciente or storage.Estudio
+        Updated row (None if the id does not exist)
+    """
+    engine = get_engine()
+    with db_connection(write=True) as connection:
+        cursor = connection.cursor()
 
-    return table_data
+        row = None
+        if db_table == 'pacientes':
+            row = engine.edit_patient(cursor, id_db, data)
+        elif db_table == 'estudios':
+            row = engine.edit_study(cursor, id_db, data['id'], data['file_name'], data['file_path'])
+
+    return row
 
 
-def delete_db(db_table: str, data: str) -> list:
-    """ Delete data from database table and returns table data updated
+def delete_db(db_table: str, data: str) -> tuple:
+    """ Delete data from database table and returns the deleted row
     
     Parameters
     ----------
@@ -838,41 +2263,226 @@ def delete_db(db_table: str, data: str) -> list:
     
     Returns
     -------
-    table_data: list
-        Data of table updated
-    """
-    settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
-    db_host = settings.value('db_host')
-    db_port = settings.value('db_port')
-    db_name = settings.value('db_name')
-    db_user = settings.value('db_user')
-    db_password = settings.value('db_password')
-    connection = psycopg2.connect(user=db_user, 
-                                  password=db_password, 
-                                  host=db_host, 
-                                  port=db_port, 
-                                  database=db_name)
-    cursor = connection.cursor()
-
-    delete_query = None
-    if db_table == 'pacientes':
-        delete_query = f"DELETE FROM pacientes WHERE id_number='{data}'"
-    elif db_table == 'estudios':
-        delete_query = f"DELETE FROM estudios WHERE file_name='{data}'"
-    cursor.execute(delete_query)
-    connection.commit()
-
-    table_data = None
-    if db_table == 'pacientes':
-        cursor.execute('SELECT * FROM pacientes ORDER BY id ASC')
-        table_data = cursor.fetchall()
-    elif db_table == 'estudios':
-        cursor.execute('SELECT * FROM estudios')
-        table_data = cursor.fetchall()
-    
-    connection.close()
+    row: storage.Paciente or storage.Estudio
+        Deleted row (None if it does not exist)
+    """
+    engine = get_engine()
+    with db_connection(write=True) as connection:
+        cursor = connection.cursor()
 
-    return table_data
+        row = None
+        if db_table == 'pacientes':
+            row = engine.delete_patient(cursor, data)
+        elif db_table == 'estudios':
+            row = engine.delete_study(cursor, data)
+
+    return row
+
+
+# ------------------
+# Funciones Métricas
+# ------------------
+def save_metrics(rows: list) -> None:
+    """ Insert or update metric values in bulk
+
+    Parameters
+    ----------
+    rows: list
+        Tuples (file_name, foot, metric, value, version, preprocessing)
+    """
+    with db_connection(write=True) as connection:
+        get_engine().insert_metrics(connection.cursor(), rows)
+
+
+def save_signals(signals: dict) -> None:
+    """ Insert or update study signals in bulk
+
+    Parameters
+    ----------
+    signals: dict
+        Dataframe by foot (left, center, right) by study file name
+    """
+    with db_connection(write=True) as connection:
+        get_engine().insert_signals(connection.cursor(), _signal_rows(signals))
+
+
+def _signal_rows(signals: dict) -> list:
+    """ Rows (file_name, foot, first_index, lateral, ap) of dataframes by
+        foot by study file name, signals as float64 little-endian bytes
+    """
+    rows = []
+    for file_name, dfs in signals.items():
+        for foot, df in dfs.items():
+            samples = df.to_numpy(dtype='<f8')
+            rows.append((file_name, foot, int(df.index[0]), samples[:,0].tobytes(), samples[:,1].tobytes()))
+    return rows
+
+
+def get_signals(file_names: list) -> dict:
+    """ Persisted signals of many studies
+
+    Parameters
+    ----------
+    file_names: list
+        Study file names
+
+    Returns
+    -------
+    signals: dict
+        Dataframe by foot by study file name (studies without persisted
+        signals are missing)
+    """
+    with db_connection() as connection:
+        rows = get_engine().get_signals(connection.cursor(), file_names)
+
+    signals = {}
+    for file_name, foot, first_index, lateral, ap in rows:
+        lateral = np.frombuffer(lateral, dtype='<f8')
+        ap = np.frombuffer(ap, dtype='<f8')
+        index = pd.RangeIndex(first_index, first_index + len(lateral))
+        signals.setdefault(file_name, {})[foot] = pd.DataFrame({'lateral': lateral, 'ap': ap}, index=index)
+
+    return signals
+
+
+def stale_metrics(versions: dict, feet: tuple = ('left', 'center', 'right')) -> list:
+    """ Studies with metrics missing or computed with another version
+
+    Parameters
+    ----------
+    versions: dict
+        Current version by metric name
+    feet: tuple
+        Feet expected for every study
+
+    Returns
+    -------
+    studies: list
+        Tuples (file_name, file_path, stale metric names)
+    """
+    with db_connection() as connection:
+        studies = get_engine().stale_metrics(connection.cursor(), versions, feet)
+
+    return studies
+
+
+def patient_metrics(id_number: str, metric_names: list) -> list:
+    """ Stored metrics of all studies of a patient in date order
+
+    Parameters
+    ----------
+    id_number: str
+        Patient id number
+    metric_names: list
+        Metric names
+
+    Returns
+    -------
+    rows: list
+        Tuples (study_date, file_name, foot, metric, value)
+    """
+    with db_connection() as connection:
+        rows = get_engine().patient_metrics(connection.cursor(), id_number, metric_names)
+
+    return rows
+
+
+def cohort_stats(metric: str, foot: str = 'center', sex: str = None, age: tuple = None, bmi: tuple = None,
+                 dates: tuple = None) -> dict:
+    """ Aggregate statistics of a stored metric over a patient cohort, from
+        the metrics of unfiltered signals with the default parameters
+
+    Parameters
+    ----------
+    metric: str
+        Metric name
+    foot: str
+        left, center or right
+    sex: str
+        Patient sex (all if None)
+    age: tuple
+        Minimum and maximum age in years at the study date (all if None)
+    bmi: tuple
+        Minimum and maximum body mass index (all if None)
+    dates: tuple
+        First and last study date (all if None)
+
+    Returns
+    -------
+    stats: dict
+        n, mean, std, min, p05, p25, median, p75, p95 and max of the metric
+    """
+    with db_connection() as connection:
+        n, mean, std, minimum, quantiles, maximum = get_engine().cohort_stats(
+            connection.cursor(), metric, foot, sex, age, bmi, dates)
+
+    quantiles = quantiles or [None] * 5
+    stats = {
+        'n': n,
+        'mean': mean,
+        'std': std,
+        'min': minimum,
+        'p05': quantiles[0],
+        'p25': quantiles[1],
+        'median': quantiles[2],
+        'p75': quantiles[3],
+        'p95': quantiles[4],
+        'max': maximum
+    }
+
+    return stats
+
+
+def cohort_values(versions: dict) -> list:
+    """ Stored metric values grouped by patient demographics, only those
+        of unfiltered signals with the default parameters
+
+    Parameters
+    ----------
+    versions: dict
+        Current version by metric name, values of other versions are left
+        out
+
+    Returns
+    -------
+    rows: list
+        Tuples (sex, age at study date, bmi, foot, metric, values)
+    """
+    with db_connection() as connection:
+        rows = get_engine().cohort_values(connection.cursor(), versions)
+
+    return rows
+
+
+def get_cohort() -> list:
+    """ Stored cohort sketches as tuples (bin, foot, metric, sketch) """
+    with db_connection() as connection:
+        rows = get_engine().get_cohort(connection.cursor())
+
+    return rows
+
+
+def merge_cohort(sketches: dict, merge) -> None:
+    """ Merge sketches into the stored ones in a single transaction
+
+    Parameters
+    ----------
+    sketches: dict
+        Serialized sketch by (bin, foot, metric)
+    merge: callable
+        Function of the stored and new serialized sketches returning the
+        merged one
+    """
+    if not sketches:
+        return
+    with db_connection(write=True) as connection:
+        get_engine().merge_cohort(connection.cursor(), sketches, merge)
+
+
+def replace_cohort(sketches: dict) -> None:
+    """ Replace all stored sketches (serialized sketch by (bin, foot, metric)) """
+    with db_connection(write=True) as connection:
+        get_engine().replace_cohort(connection.cursor(), sketches)
 
 
 # ----------------
@@ -0,0 +1,222 @@
+"""
+Batch
+
+This file contains the batch analysis command line interface. Studies are
+read from their image files and the results are exported as CSV with one
+row by study and foot. The backfill mode updates the metrics stored in the
+database whose version is older than the current one.
+
+Usage:
+    python batch.py examples/M01.png examples/M02.png --output results.csv
+    python batch.py examples/*.png --analyses standard density rambling
+    python batch.py examples/*.png --analyses area --metrics lat_rms ap_rms
+    python batch.py examples/*.png --filter 2 --detrend linear
+    python batch.py examples/*.png --cache .cache
+    python batch.py examples/*.png --analyses standard --bootstrap 1000
+    python batch.py --backfill --workers 4
+    python batch.py --backfill --filter 2 --detrend linear
+    python batch.py --rebuild-cohort
+"""
+
+import argparse
+import sys
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+import backend
+import cohort
+import metrics
+
+FEET = ('left', 'center', 'right')
+
+
+def study_signals(image_file: str) -> dict:
+    """ Balance signal dataframes by foot of a study image
+
+    Parameters
+    ----------
+    image_file: str
+        Study image file path
+
+    Returns
+    -------
+    dfs: dict
+        Dataframe with lateral and antero-posterior signals by foot
+    """
+    signals = backend.extract(image_file)
+    dfs = {}
+    for foot in FEET:
+        dfs[foot] = pd.merge(signals[f'{foot}_lateral_signal'], signals[f'{foot}_ap_signal'],
+            right_index = True, left_index = True)
+    return dfs
+
+
+def metric_names(args) -> list:
+    """ Metrics of the selected groups followed by the individual ones """
+    groups = args.analyses or ([] if args.metrics else metrics.GROUPS.keys())
+    names = [name for group in groups for name in metrics.GROUPS[group]]
+    names += [name for name in args.metrics or [] if name not in names]
+    return names
+
+
+def run(args) -> pd.DataFrame:
+    """ Analysis of every study file
+
+    Returns
+    -------
+    results: pd.DataFrame
+        Row by study and foot with the selected metrics
+    """
+    names = metric_names(args)
+    rows = []
+    for image_file in args.files:
+        try:
+            dfs = study_signals(image_file)
+        except Exception as err:
+            print(f'{image_file}: {err}', file=sys.stderr)
+            continue
+
+        study_dfs = list(dfs.values())
+        if args.filter is not None or args.detrend is not None:
+            study_dfs = backend.preprocessStudy(study_dfs, args.fs, args.filter, args.filter_order, args.detrend)
+
+        results = metrics.evaluateMany(study_dfs, names, fs=args.fs, radius=args.radius, cog_window=args.cog_window)
+        for foot, df, result in zip(FEET, study_dfs, results):
+            row = {'file': image_file, 'foot': foot, **result}
+            if args.bootstrap:
+                intervals = backend.bootstrapCI(df, args.bootstrap, args.block, fs=args.fs, seed=args.seed)
+                for name, (low, high) in intervals.items():
+                    row[f'{name}_low'], row[f'{name}_high'] = low, high
+            rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def backfill_settings(args) -> str:
+    """ Settings of the backfilled metrics (metrics.settingsName) """
+    return metrics.settingsName(backend.preprocessingName(args.filter, args.filter_order, args.detrend),
+                                fs=args.fs, radius=args.radius, cog_window=args.cog_window)
+
+
+def backfill_study(task: tuple) -> tuple:
+    """ Stale metrics of a study from its persisted signals, or from its
+        image when no signals are persisted
+
+    Parameters
+    ----------
+    task: tuple
+        file_name, file_path, stale metric names, unfiltered dataframes by
+        foot (None if not persisted) and parsed command line arguments
+
+    Returns
+    -------
+    file_name, rows, extracted, error: tuple
+        Metric rows (file_name, foot, metric, value, version, preprocessing),
+        unfiltered dataframes by foot if they were extracted from the image,
+        and error message
+    """
+    file_name, file_path, names, dfs, args = task
+    extracted = None
+    try:
+        if dfs is None:
+            dfs = extracted = study_signals(file_path)
+        study_dfs = [dfs[foot] for foot in FEET]
+        if args.filter is not None or args.detrend is not None:
+            study_dfs = backend.preprocessStudy(study_dfs, args.fs, args.filter, args.filter_order, args.detrend)
+        results = metrics.evaluateMany(study_dfs, names, fs=args.fs, radius=args.radius, cog_window=args.cog_window)
+    except Exception as err:
+        return file_name, [], None, str(err)
+
+    settings = backfill_settings(args)
+    rows = [(file_name, foot, name, result[name], metrics.metricVersion(name, settings), settings)
+            for foot, result in zip(FEET, results) for name in names]
+    return file_name, rows, extracted, None
+
+
+def backfill(args) -> None:
+    """ Recompute metrics stored with an outdated version (or missing) for
+        every registered study and write them back in bulk. The filter
+        settings and analysis parameters are part of the version, so metrics
+        computed with other values of --filter, --filter-order, --detrend,
+        --fs, --radius or --cog-window are stale too. The schema is
+        migrated by the caller (backend.migrate_db)
+    """
+    settings = backfill_settings(args)
+    versions = {name: metrics.metricVersion(name, settings) for name in metrics.PERSISTED}
+    studies = backend.stale_metrics(versions, FEET)
+    print(f'{len(studies)} studies with stale metrics', file=sys.stderr)
+
+    done = 0
+    with ProcessPoolExecutor(args.workers) as pool:
+        for start in range(0, len(studies), args.chunk):
+            chunk = studies[start:start + args.chunk]
+            signals = backend.get_signals([file_name for file_name, _, _ in chunk])
+            tasks = [(file_name, file_path, names, signals.get(file_name), args)
+                for file_name, file_path, names in chunk]
+
+            rows, extracted = [], {}
+            for file_name, study_rows, dfs, error in pool.map(backfill_study, tasks):
+                if error:
+                    print(f'{file_name}: {error}', file=sys.stderr)
+                    continue
+                rows.extend(study_rows)
+                if dfs is not None:
+                    extracted[file_name] = dfs
+                done += 1
+
+            if extracted:
+                backend.save_signals(extracted)
+            if rows:
+                backend.save_metrics(rows)
+            print(f'{done}/{len(studies)} studies updated', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Batch analysis of balance study images')
+    parser.add_argument('files', nargs='*', help='Study image files')
+    parser.add_argument('--output', default='-', help='CSV output file (standard output by default)')
+    parser.add_argument('--analyses', nargs='+', choices=metrics.GROUPS.keys(),
+        help='Metric groups (all groups if no metrics are selected)')
+    parser.add_argument('--metrics', nargs='+', metavar='METRIC',
+        choices=[name for group in metrics.GROUPS.values() for name in group],
+        help='Individual metrics, added to the groups')
+    parser.add_argument('--fs', type=float, default=10, help='Sampling frequency in Hz')
+    parser.add_argument('--radius', type=float, default=2.5, help='Sway density radius')
+    parser.add_argument('--cog-window', type=float, default=1.0,
+        help='Center of gravity moving average length in seconds for rambling and trembling')
+    parser.add_argument('--filter', type=float, default=None, metavar='CUTOFF',
+        help='Zero-phase low-pass cutoff frequency in Hz before analysis')
+    parser.add_argument('--filter-order', type=int, default=4)
+    parser.add_argument('--detrend', choices=['constant', 'linear'], default=None)
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='REPLICATES',
+        help='Block bootstrap 95%% confidence intervals of the velocity, RMS, mean distance and mean frequency metrics')
+    parser.add_argument('--block', type=int, default=None,
+        help='Bootstrap block length in samples (cube root of the signal length by default)')
+    parser.add_argument('--seed', type=int, default=None, help='Bootstrap random seed')
+    parser.add_argument('--cache', default=None, metavar='DIRECTORY',
+        help='Directory of stored results reused between runs')
+    parser.add_argument('--backfill', action='store_true',
+        help='Recompute stale metrics of the studies in the database instead of analyzing files')
+    parser.add_argument('--rebuild-cohort', action='store_true',
+        help='Rebuild the normative cohort sketches from the stored metrics')
+    parser.add_argument('--workers', type=int, default=None, help='Backfill worker processes')
+    parser.add_argument('--chunk', type=int, default=200, help='Studies by backfill database round trip')
+    args = parser.parse_args()
+
+    if args.cache:
+        metrics.CACHE = metrics.ResultCache(directory=args.cache)
+
+    if args.backfill or args.rebuild_cohort:
+        try:
+            backend.migrate_db()
+        except backend.DB_ERRORS as err:
+            parser.exit(1, f'database: {err}\n')
+        if args.backfill:
+            backfill(args)
+        if args.rebuild_cohort:
+            print(f'{cohort.rebuild(metrics.PERSISTED)} cohort sketches stored', file=sys.stderr)
+    elif args.files:
+        results = run(args)
+        results.to_csv(sys.stdout if args.output == '-' else args.output, index=False)
+    else:
+        parser.error('study image files, --backfill or --rebuild-cohort are required')
@@ -0,0 +1,137 @@
+"""
+Benchmark
+
+This file contains scaling benchmarks of the analysis methods.
+
+Usage:
+    python benchmark.py entropy --lengths 1000 2000 4000 8000 16000
+    python benchmark.py bootstrap --replicates 100 1000 --naive-limit 100
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+import backend
+
+
+def timed(function, *args, repeat: int = 3) -> float:
+    """ Best wall time in seconds of repeated calls """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def naive_sample_entropy(signal: np.array, m: int = 2, r: float = 0.2) -> float:
+    """ Reference sample entropy comparing every template with every other """
+    tolerance = r * signal.std()
+    n_templates = len(signal) - m
+    matches = []
+    for length in (m, m + 1):
+        templates = backend.sliding_window_view(signal, length)[:n_templates]
+        count = 0
+        for i in range(n_templates - 1):
+            distance = np.abs(templates[i + 1:] - templates[i]).max(axis=1)
+            count += (distance < tolerance).sum()
+        matches.append(count)
+    B, A = matches
+    return -np.log(A / B)
+
+
+def bench_entropy(args) -> None:
+    """ Sample entropy and multiscale entropy against signal length """
+    rng = np.random.default_rng(0)
+    print(f'{"n":>8} {"sampen (s)":>12} {"mse (s)":>12} {"naive (s)":>12}')
+    for n in args.lengths:
+        signal = np.cumsum(rng.normal(size=n))
+        sampen = timed(backend.sampleEntropy, signal)
+        mse = timed(backend.multiscaleEntropy, signal, args.scales)
+        naive = timed(naive_sample_entropy, signal, repeat=1) if n <= args.naive_limit else np.nan
+        print(f'{n:>8} {sampen:>12.4f} {mse:>12.4f} {naive:>12.4f}')
+
+
+def naive_msd(signals: np.array, max_lag: int) -> np.array:
+    """ Reference mean squared displacement with one direct sum by lag """
+    return np.array([[np.mean((x[lag:] - x[:len(x) - lag]) ** 2) for lag in range(max_lag + 1)]
+        for x in signals])
+
+
+def bench_diffusion(args) -> None:
+    """ FFT mean squared displacement against signal length """
+    rng = np.random.default_rng(0)
+    print(f'{"n":>8} {"fft (s)":>12} {"naive (s)":>12}')
+    for n in args.lengths:
+        signals = np.cumsum(rng.normal(size=(6, n)), axis=1)
+        max_lag = n // 2
+        fft = timed(backend.meanSquaredDisplacement, signals, max_lag)
+        naive = timed(naive_msd, signals, max_lag, repeat=1) if n <= args.naive_limit else np.nan
+        print(f'{n:>8} {fft:>12.4f} {naive:>12.4f}')
+
+
+def naive_sway_density(x: np.array, y: np.array, radius: float = 2.5, fs: float = 10) -> np.array:
+    """ Reference sway density checking every sample against every other """
+    n = len(x)
+    distance = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :]) <= radius
+    count = np.ones(n)
+    for i in range(n):
+        outside = np.flatnonzero(~distance[i, i:])
+        count[i] += (outside[0] if len(outside) else n - i) - 1
+        outside = np.flatnonzero(~distance[i, i::-1])
+        count[i] += (outside[0] if len(outside) else i + 1) - 1
+    return count / fs
+
+
+def bench_density(args) -> None:
+    """ Sway density and rambling/trembling against signal length """
+    rng = np.random.default_rng(0)
+    print(f'{"n":>8} {"density (s)":>12} {"rambling (s)":>12} {"naive (s)":>12}')
+    for n in args.lengths:
+        x, y = np.cumsum(rng.normal(0, 0.5, size=(2, n)), axis=1)
+        density = timed(backend.swayDensity, x, y)
+        rambling = timed(backend.ramblingTrembling, x)
+        naive = timed(naive_sway_density, x, y, repeat=1) if n <= args.naive_limit else np.nan
+        print(f'{n:>8} {density:>12.4f} {rambling:>12.4f} {naive:>12.4f}')
+
+
+def naive_bootstrap(df, n_boot: int, block: int) -> list:
+    """ Reference bootstrap running the full analysis on every replicate """
+    rng = np.random.default_rng(0)
+    index = backend.blockBootstrapIndex(len(df), n_boot, block, rng)
+    return [backend.analisis(df.iloc[row].reset_index(drop=True)) for row in index]
+
+
+def bench_bootstrap(args) -> None:
+    """ Vectorized block bootstrap intervals against number of replicates """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(np.cumsum(rng.normal(size=(1200, 2)), axis=0))
+    block = int(round(len(df) ** (1 / 3)))
+    print(f'{"replicates":>10} {"vector (s)":>12} {"naive (s)":>12}')
+    for n_boot in args.replicates:
+        vector = timed(backend.bootstrapCI, df, n_boot)
+        naive = timed(naive_bootstrap, df, n_boot, block, repeat=1) if n_boot <= args.naive_limit else np.nan
+        print(f'{n_boot:>10} {vector:>12.4f} {naive:>12.4f}')
+
+
+BENCHMARKS = {
+    'entropy': bench_entropy,
+    'diffusion': bench_diffusion,
+    'density': bench_density,
+    'bootstrap': bench_bootstrap
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scaling benchmarks of the analysis methods')
+    parser.add_argument('benchmark', choices=BENCHMARKS.keys())
+    parser.add_argument('--lengths', type=int, nargs='+', default=[1000, 2000, 4000, 8000, 16000])
+    parser.add_argument('--scales', type=int, default=10)
+    parser.add_argument('--replicates', type=int, nargs='+', default=[100, 500, 1000, 2000])
+    parser.add_argument('--naive-limit', type=int, default=8000,
+        help='Longest signal for the quadratic reference implementation')
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
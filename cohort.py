@@ -0,0 +1,295 @@
+"""
+Cohort
+
+This file contains the normative cohort index: mergeable quantile sketches
+of every stored metric by demographic bin (sex, age and body mass index)
+used to express a patient's metrics as percentiles and z-scores against
+matched peers.
+
+Only metrics of unfiltered signals analyzed with the default parameters at
+their current version are added, so every patient value is compared with
+values computed the same way.
+
+Sketches are merging digests: weighted centroids whose size is bounded by
+the arcsine scale function, so tails keep single values while the center
+is summarized. Two sketches merge by compressing their centroids together,
+which lets the index grow study by study without scanning the archive.
+
+Usage:
+    index = cohort.CohortIndex.load()
+    percentile, z, n = index.lookup('hull_area', 'center', 1520.3, cohort.patientBin(patient, date))
+"""
+
+import datetime
+import numpy as np
+
+import backend
+import metrics
+import storage
+
+AGE_BINS = (0, 20, 30, 40, 50, 60, 70, 80)
+BMI_BINS = (18.5, 25, 30)
+BMI_CLASSES = ('bajo', 'normal', 'sobrepeso', 'obesidad')
+
+
+# -------------------
+# Sketch de Cuantiles
+# -------------------
+class QuantileSketch:
+    def __init__(self, compression: float = 200) -> None:
+        """ Mergeable quantile sketch of a metric distribution
+
+        Parameters
+        ----------
+        compression: float
+            Scale of the arcsine function, about twice the number of
+            centroids kept
+        """
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.buffer_means = []
+        self.buffer_weights = []
+        # Running mean and sum of squared deviations (Chan et al. update)
+        self.count = 0.0
+        self.average = 0.0
+        self.m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.positions = None
+        self.values = None
+
+    def add(self, values) -> None:
+        """ Add finite values with unit weight """
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.buffer_means.append(values)
+        self.buffer_weights.append(np.ones(len(values)))
+        # Equal values keep their exact mean and no spread
+        average = values.mean() if values.min() < values.max() else values[0]
+        self._moments(len(values), average, ((values - average) ** 2).sum())
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+        self.positions = None
+        if sum(len(buffer) for buffer in self.buffer_means) > 5 * self.compression:
+            self.compress()
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """ Add the distribution summarized by another sketch """
+        other.compress()
+        if other.count == 0:
+            return
+        self.buffer_means.append(other.means)
+        self.buffer_weights.append(other.weights)
+        self._moments(other.count, other.average, other.m2)
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.positions = None
+        self.compress()
+
+    def _moments(self, count: float, average: float, m2: float) -> None:
+        """ Combine the running moments with those of another sample """
+        total = self.count + count
+        delta = average - self.average
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.average += delta * count / total
+        self.count = total
+
+    def compress(self) -> None:
+        """ Merge buffered values and centroids into bounded centroids """
+        if not self.buffer_means:
+            return
+        means = np.concatenate([self.means, *self.buffer_means])
+        weights = np.concatenate([self.weights, *self.buffer_weights])
+        self.buffer_means, self.buffer_weights = [], []
+
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+        starts = np.flatnonzero(np.diff(k, prepend=np.nan) != 0)
+
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def _prepare(self) -> None:
+        self.compress()
+        cumulative = np.cumsum(self.weights)
+        self.positions = np.concatenate(([0.0], cumulative - self.weights / 2, [self.count]))
+        self.values = np.concatenate(([self.minimum], self.means, [self.maximum]))
+
+    def cdf(self, value: float) -> float:
+        """ Fraction of the distribution below value """
+        if self.count == 0:
+            return np.nan
+        if self.positions is None:
+            self._prepare()
+        return float(np.interp(value, self.values, self.positions)) / self.count
+
+    def quantile(self, q: float) -> float:
+        """ Value below a fraction q of the distribution """
+        if self.count == 0:
+            return np.nan
+        if self.positions is None:
+            self._prepare()
+        return float(np.interp(q * self.count, self.positions, self.values))
+
+    def mean(self) -> float:
+        return self.average if self.count else np.nan
+
+    def std(self) -> float:
+        """ Sample standard deviation """
+        if self.count < 2:
+            return np.nan
+        return float(np.sqrt(max(self.m2, 0.0) / (self.count - 1)))
+
+    def to_bytes(self) -> bytes:
+        self.compress()
+        header = np.array([self.compression, self.count, self.average, self.m2, self.minimum, self.maximum])
+        return np.concatenate((header, self.means, self.weights)).astype('<f8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'QuantileSketch':
+        values = np.frombuffer(data, dtype='<f8')
+        sketch = cls(values[0])
+        sketch.count, sketch.average, sketch.m2, sketch.minimum, sketch.maximum = values[1:6]
+        size = (len(values) - 6) // 2
+        sketch.means = values[6:6 + size].copy()
+        sketch.weights = values[6 + size:].copy()
+        return sketch
+
+
+# ---------------
+# Bin Demográfico
+# ---------------
+def demographicBin(sex: str, age: float, bmi: float) -> str:
+    """ Demographic bin name, e.g. F|40-49|normal """
+    i = np.searchsorted(AGE_BINS, age, side='right') - 1
+    age_bin = f'{AGE_BINS[i]}+' if i == len(AGE_BINS) - 1 else f'{AGE_BINS[i]}-{AGE_BINS[i + 1] - 1}'
+    bmi_bin = BMI_CLASSES[np.searchsorted(BMI_BINS, bmi, side='right')]
+    return f'{sex}|{age_bin}|{bmi_bin}'
+
+
+def patientBin(patient: storage.Paciente, study_date: datetime.date = None) -> str:
+    """ Demographic bin of a patient row at the study date (today if None) """
+    study_date = study_date or datetime.date.today()
+    birth_date = patient.birth_date
+    age = study_date.year - birth_date.year - ((study_date.month, study_date.day) < (birth_date.month, birth_date.day))
+    return demographicBin(patient.sex, age, float(patient.bmi))
+
+
+# --------------
+# Índice Cohorte
+# --------------
+class CohortIndex:
+    def __init__(self, min_count: int = 20) -> None:
+        """ Quantile sketches by demographic bin, foot and metric
+
+        Parameters
+        ----------
+        min_count: int
+            Minimum number of studies in a bin to answer lookups
+        """
+        self.min_count = min_count
+        self.sketches = {}
+
+    @classmethod
+    def load(cls, min_count: int = 20) -> 'CohortIndex':
+        """ Index with the sketches stored in the database """
+        index = cls(min_count)
+        for bin_name, foot, metric, data in backend.get_cohort():
+            index.sketches[(bin_name, foot, metric)] = QuantileSketch.from_bytes(bytes(data))
+        return index
+
+    def lookup(self, metric: str, foot: str, value: float, bin_name: str) -> tuple:
+        """ Percentile and z-score of a value against its demographic bin
+
+        Returns
+        -------
+        percentile, z, n: tuple
+            Percentile (0-100), z-score (None if the bin values are all
+            equal) and studies in the bin (None if the bin has fewer than
+            min_count studies)
+        """
+        sketch = self.sketches.get((bin_name, foot, metric))
+        if sketch is None or sketch.count < self.min_count:
+            return None
+        std = sketch.std()
+        z = (value - sketch.mean()) / std if std > 0 else None
+        return 100 * sketch.cdf(value), z, int(sketch.count)
+
+    def addStudy(self, bin_name: str, results: dict) -> None:
+        """ Add the metrics of a study and merge them into the database
+
+        Parameters
+        ----------
+        bin_name: str
+            Demographic bin of the patient at the study date
+        results: dict
+            Metric values by metric name by foot, of unfiltered signals
+            with the default parameters
+        """
+        updates = {}
+        for foot, values in results.items():
+            for metric, value in values.items():
+                sketch = QuantileSketch()
+                sketch.add(value)
+                if sketch.count:
+                    updates[(bin_name, foot, metric)] = sketch
+        for key, sketch in updates.items():
+            self.sketches.setdefault(key, QuantileSketch()).merge(sketch)
+        backend.merge_cohort({key: sketch.to_bytes() for key, sketch in updates.items()}, mergeSketches)
+
+
+def mergeSketches(stored: bytes, update: bytes) -> bytes:
+    """ Serialized merge of two serialized sketches """
+    sketch = QuantileSketch.from_bytes(stored)
+    sketch.merge(QuantileSketch.from_bytes(update))
+    return sketch.to_bytes()
+
+
+def addStudies(studies: list) -> int:
+    """ Merge the metrics of many registered studies into the stored
+        sketches in a single transaction, as addStudy does for one study
+
+    Parameters
+    ----------
+    studies: list
+        Tuples (bin, metric rows (foot, metric, value, version,
+        preprocessing)) with the demographic bin of the patient at each
+        study date. Rows of other settings than the defaults or of older
+        versions are left out
+
+    Returns
+    -------
+    n: int
+        Number of sketches merged
+    """
+    sketches = {}
+    for bin_name, rows in studies:
+        for foot, metric, value, version, preprocessing in rows:
+            if preprocessing == '' and version == metrics.metricVersion(metric):
+                sketches.setdefault((bin_name, foot, metric), QuantileSketch()).add(value)
+    updates = {key: sketch.to_bytes() for key, sketch in sketches.items() if sketch.count}
+    backend.merge_cohort(updates, mergeSketches)
+    return len(updates)
+
+
+def rebuild(metric_names: list) -> int:
+    """ Replace the stored sketches with sketches of all stored metrics
+
+    Returns
+    -------
+    n: int
+        Number of sketches stored
+    """
+    sketches = {}
+    versions = {name: metrics.metricVersion(name) for name in metric_names}
+    for sex, age, bmi, foot, metric, values in backend.cohort_values(versions):
+        sketch = sketches.setdefault((demographicBin(sex, age, float(bmi)), foot, metric), QuantileSketch())
+        sketch.add(values)
+    backend.replace_cohort({key: sketch.to_bytes() for key, sketch in sketches.items()})
+    return len(sketches)
@@ -3,13 +3,23 @@ Database
 
 This file contains class Database Dialog.
 
-To configure the database access, it requires:
-
-Host: Host IP address or 'localhost'
-Port: Port number
-Name: Database name previously created
-Username: Database access username
-Password: Database access password
+To configure the database access, it requires the engine and:
+
+PostgreSQL:
+    Host: Host IP address or 'localhost'
+    Port: Port number
+    Name: Database name previously created
+    Username: Database access username
+    Password: Database access password
+
+SQLite:
+    File: Database file, created if it does not exist (relative to the
+    application folder)
+
+Replica:
+    File: Local replica file, read and written by the application
+    Host, Port, Name, Username and Password: PostgreSQL server synchronized
+    with the replica in the background
 """
 
 from PyQt6 import QtWidgets
@@ -19,6 +29,7 @@ from PyQt6.QtGui import QRegularExpressionValidator
 import sys
 
 import material3_components as mt3
+import backend
 
 
 class Database(QtWidgets.QDialog):
@@ -40,7 +51,7 @@ class Database(QtWidgets.QDialog):
         # Generación de UI
         # ----------------
         width = 304
-        height = 412
+        height = 520
         screen_x = int(self.screen().availableGeometry().width() / 2 - (width / 2))
         screen_y = int(self.screen().availableGeometry().height() / 2 - (height / 2))
 
@@ -64,6 +75,26 @@ class Database(QtWidgets.QDialog):
             self.theme_value, self.language_value)
         
         y, w = 48, width - 32
+        self.postgres_button = mt3.SegmentedButton(self.database_card, 'postgres_button',
+            (8, y, w // 3), ('PostgreSQL', 'PostgreSQL'), ('done.png','none.png'), 'left', 
+            False, self.theme_value, self.language_value)
+        self.postgres_button.clicked.connect(self.on_postgres_button_clicked)
+
+        self.sqlite_button = mt3.SegmentedButton(self.database_card, 'sqlite_button',
+            (8 + w // 3, y, w // 3), ('SQLite', 'SQLite'), ('done.png','none.png'), 'center', 
+            False, self.theme_value, self.language_value)
+        self.sqlite_button.clicked.connect(self.on_sqlite_button_clicked)
+
+        self.replica_button = mt3.SegmentedButton(self.database_card, 'replica_button',
+            (8 + 2 * (w // 3), y, w // 3), ('Réplica', 'Replica'), ('done.png','none.png'), 'right', 
+            False, self.theme_value, self.language_value)
+        self.replica_button.clicked.connect(self.on_replica_button_clicked)
+
+        y += 48
+        self.file_text = mt3.TextField(self.database_card,
+            (8, y, w), ('Archivo', 'File'), self.theme_value, self.language_value)
+        self.file_text.text_field.setText(self.settings.value('db_file', backend.SQLITE_FILE))
+
         self.host_text = mt3.TextField(self.database_card,
             (8, y, w), ('Host', 'Host'), self.theme_value, self.language_value)
 
@@ -84,7 +115,8 @@ class Database(QtWidgets.QDialog):
         self.password_text = mt3.TextField(self.database_card,
             (8, y, w), ('Contraseña', 'Password'), self.theme_value, self.language_value)
         
-        y += 68
+        # Below the replica file and the server fields
+        y = height - 56
         self.aceptar_button = mt3.TextButton(self.database_card, 'aceptar_button',
             (w-200, y, 100), ('Aceptar', 'Ok'), 'done.png', self.theme_value, self.language_value)
         self.aceptar_button.clicked.connect(self.on_aceptar_button_clicked)
@@ -93,33 +125,94 @@ class Database(QtWidgets.QDialog):
             (w-92, y, 100), ('Cancelar', 'Cancel'), 'close.png', self.theme_value, self.language_value)
         self.cancelar_button.clicked.connect(self.on_cancelar_button_clicked)
 
+        if self.settings.value('db_engine', 'postgresql') == 'sqlite':
+            self.on_sqlite_button_clicked()
+        elif self.settings.value('db_engine', 'postgresql') == 'replica':
+            self.on_replica_button_clicked()
+        else:
+            self.on_postgres_button_clicked()
+
     # ---------
     # Funciones
     # ---------
+    def on_postgres_button_clicked(self) -> None:
+        """ Engine option for segmented buttons, PostgreSQL server fields """
+        self.postgres_button.set_state(True)
+        self.sqlite_button.set_state(False)
+        self.replica_button.set_state(False)
+        self.set_engine_fields(False, True)
+
+
+    def on_sqlite_button_clicked(self) -> None:
+        """ Engine option for segmented buttons, SQLite file field """
+        self.sqlite_button.set_state(True)
+        self.postgres_button.set_state(False)
+        self.replica_button.set_state(False)
+        self.set_engine_fields(True, False)
+
+
+    def on_replica_button_clicked(self) -> None:
+        """ Engine option for segmented buttons, replica file and
+            PostgreSQL server fields
+        """
+        self.replica_button.set_state(True)
+        self.postgres_button.set_state(False)
+        self.sqlite_button.set_state(False)
+        self.set_engine_fields(True, True)
+
+
+    def set_engine_fields(self, file: bool, server: bool) -> None:
+        """ Show the file and server fields of the selected engine, one
+            below the other
+        """
+        y = 96
+        self.file_text.setVisible(file)
+        if file:
+            self.file_text.move(8, y)
+            y += 60
+        for field in (self.host_text, self.port_text, self.name_text, self.user_text, self.password_text):
+            field.setVisible(server)
+            if server:
+                field.move(8, y)
+                y += 60
+
+
     def on_aceptar_button_clicked(self):
         """ Save database information in settings file """
-        if (self.host_text.text_field.text() == '' or self.port_text.text_field.text() == '' or 
-                self.name_text.text_field.text() == '' or self.user_text.text_field.text() == '' or 
-                self.password_text.text_field.text() == ''):
-                
+        file = not self.postgres_button.isChecked()
+        server = not self.sqlite_button.isChecked()
+        server_fields = (self.host_text, self.port_text, self.name_text, self.user_text, self.password_text)
+
+        if file and self.file_text.text_field.text() == '':
+            if self.language_value == 0:
+                QtWidgets.QMessageBox.critical(self, 'Error en el Formulario', 'Hace falta el archivo de la base de datos')
+            elif self.language_value == 1:
+                QtWidgets.QMessageBox.critical(self, 'Form Error', 'Database file is missing')
+        elif server and any(field.text_field.text() == '' for field in server_fields):
             if self.language_value == 0:
                 QtWidgets.QMessageBox.critical(self, 'Error en el Formulario', 'Hace falta información de la base de datos')
             elif self.language_value == 1:
                 QtWidgets.QMessageBox.critical(self, 'Form Error', 'Database information is missing')
         else:
-            self.database_data = {
-                'db_host': self.host_text.text_field.text(),
-                'db_port': self.port_text.text_field.text(),
-                'db_name': self.name_text.text_field.text(),
-                'db_user': self.user_text.text_field.text(),
-                'db_password': self.password_text.text_field.text()
-            }
-
-            self.settings.setValue('db_host', self.host_text.text_field.text())
-            self.settings.setValue('db_port', self.port_text.text_field.text())
-            self.settings.setValue('db_name', self.name_text.text_field.text())
-            self.settings.setValue('db_user', self.user_text.text_field.text())
-            self.settings.setValue('db_password', self.password_text.text_field.text())
+            if not server:
+                self.database_data = {'db_engine': 'sqlite'}
+            elif not file:
+                self.database_data = {'db_engine': 'postgresql'}
+            else:
+                self.database_data = {'db_engine': 'replica'}
+            if file:
+                self.database_data['db_file'] = self.file_text.text_field.text()
+            if server:
+                self.database_data.update({
+                    'db_host': self.host_text.text_field.text(),
+                    'db_port': self.port_text.text_field.text(),
+                    'db_name': self.name_text.text_field.text(),
+                    'db_user': self.user_text.text_field.text(),
+                    'db_password': self.password_text.text_field.text()
+                })
+
+            for key, value in self.database_data.items():
+                self.settings.setValue(key, value)
 
             self.settings.sync()
 
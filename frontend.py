@@ -15,8 +15,17 @@ from pathlib import Path
 
 import material3_components as mt3
 import backend
+import metrics
+import cohort
 import patient
 import database
+import live
+import advanced
+import models
+
+SEARCH_DELAY = 250
+SEARCH_MIN_LENGTH = 3
+SEARCH_LIMIT = 10
 
 
 class App(QWidget):
@@ -30,6 +39,8 @@ class App(QWidget):
         self.language_value = int(self.settings.value('language'))
         self.theme_value = eval(self.settings.value('theme'))
         self.default_path = self.settings.value('default_path')
+        if self.settings.value('cache_directory'):
+            metrics.CACHE = metrics.ResultCache(directory=self.settings.value('cache_directory'))
 
         self.idioma_dict = {0: ('ESP', 'SPA'), 1: ('ING', 'ENG')}
     
@@ -54,6 +65,10 @@ class App(QWidget):
         self.center_analysis = None
         self.right_analysis = None
 
+        self.patient_data = None
+        self.study_bin = None
+        self.cohort_index = None
+
         self.left_data_elipse = None
         self.center_data_elipse = None
         self.right_data_elipse = None
@@ -86,6 +101,10 @@ class App(QWidget):
         self.center_pca_plot = None
         self.right_pca_plot = None
 
+        self.acquisition = None
+        self.live_lateral_plot = None
+        self.live_ap_plot = None
+
         # ----------------
         # Generación de UI
         # ----------------
@@ -149,12 +168,27 @@ class App(QWidget):
         # Card Paciente
         # -------------
         self.paciente_card = mt3.Card(self, 'paciente_card',
-            (8, 64, 180, 128), ('Paciente', 'Patient'), 
+            (8, 64, 180, 168), ('Paciente', 'Patient'), 
             self.theme_value, self.language_value)
         
         y_1 = 48
+        self.paciente_search = mt3.SearchField(self.paciente_card, 'paciente_search',
+            (8, y_1, 164), ('Buscar paciente', 'Search patient'), self.theme_value, self.language_value)
+        self.paciente_search.textEdited.connect(self.on_paciente_search_textEdited)
+        self.paciente_search.search_completer.activated[str].connect(self.on_paciente_search_activated)
+        self.search_results = {}
+
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.on_search_timer_timeout)
+
+        y_1 += 40
         self.pacientes_menu = mt3.Menu(self.paciente_card, 'pacientes_menu',
             (8, y_1, 164), 10, 10, {}, self.theme_value, self.language_value)
+        self.patients_model = models.PatientModel(self)
+        self.pacientes_menu.setModel(self.patients_model)
+        self.pacientes_menu.view().setUniformItemSizes(True)
         self.pacientes_menu.textActivated.connect(self.on_pacientes_menu_textActivated)
 
         y_1 += 40
@@ -174,12 +208,15 @@ class App(QWidget):
         # Card Análisis
         # -------------
         self.analisis_card = mt3.Card(self, 'analisis_card',
-            (8, 200, 180, 128), ('Análsis', 'Analysis'), 
+            (8, 240, 180, 128), ('Análsis', 'Analysis'), 
             self.theme_value, self.language_value)
 
         y_2 = 48
         self.analisis_menu = mt3.Menu(self.analisis_card, 'analisis_menu',
             (8, y_2, 164), 10, 10, {}, self.theme_value, self.language_value)
+        self.studies_model = models.StudyModel(self)
+        self.analisis_menu.setModel(self.studies_model)
+        self.analisis_menu.view().setUniformItemSizes(True)
         self.analisis_menu.setEnabled(False)
         self.analisis_menu.textActivated.connect(self.on_analisis_menu_textActivated)
 
@@ -194,11 +231,24 @@ class App(QWidget):
         self.analisis_del_button.setEnabled(False)
         self.analisis_del_button.clicked.connect(self.on_analisis_del_button_clicked)
 
+        self.live_button = mt3.IconButton(self.analisis_card, 'live_button',
+            (60, y_2), 'live.png', self.theme_value)
+        self.live_button.clicked.connect(self.on_live_button_clicked)
+
+        self.advanced_button = mt3.IconButton(self.analisis_card, 'advanced_button',
+            (20, y_2), 'advanced.png', self.theme_value)
+        self.advanced_button.setEnabled(False)
+        self.advanced_button.clicked.connect(self.on_advanced_button_clicked)
+
+        self.live_timer = QtCore.QTimer(self)
+        self.live_timer.setInterval(50)
+        self.live_timer.timeout.connect(self.on_live_timer_timeout)
+
         # ----------------
         # Card Información
         # ----------------
         self.info_card = mt3.Card(self, 'info_card',
-            (8, 336, 180, 312), ('Información', 'Information'), 
+            (8, 376, 180, 312), ('Información', 'Information'), 
             self.theme_value, self.language_value)
         
         y_3 = 48
@@ -541,6 +591,22 @@ class App(QWidget):
         self.right_pca_value.setStyleSheet(f'QLabel#{self.right_pca_value.name} {{'
             f'border: 2px solid #0000FF; border-radius: 16 }}')
 
+        # Value labels of the left foot, center of pressure and right foot by metric
+        self.metric_labels = {
+            'lat_rango': (self.left_lat_rango_value, self.center_lat_rango_value, self.right_lat_rango_value),
+            'lat_vel': (self.left_lat_vel_value, self.center_lat_vel_value, self.right_lat_vel_value),
+            'lat_rms': (self.left_lat_rms_value, self.center_lat_rms_value, self.right_lat_rms_value),
+            'ap_rango': (self.left_ap_rango_value, self.center_ap_rango_value, self.right_ap_rango_value),
+            'ap_vel': (self.left_ap_vel_value, self.center_ap_vel_value, self.right_ap_vel_value),
+            'ap_rms': (self.left_ap_rms_value, self.center_ap_rms_value, self.right_ap_rms_value),
+            'centro_vel': (self.left_cop_vel_value, self.center_cop_vel_value, self.right_cop_vel_value),
+            'centro_dist': (self.left_distancia_value, self.center_distancia_value, self.right_distancia_value),
+            'centro_frec': (self.left_frecuencia_value, self.center_frecuencia_value, self.right_frecuencia_value),
+            'elipse_area': (self.left_elipse_value, self.center_elipse_value, self.right_elipse_value),
+            'hull_area': (self.left_hull_value, self.center_hull_value, self.right_hull_value),
+            'pca_area': (self.left_pca_value, self.center_pca_value, self.right_pca_value)
+        }
+
         # -------------
         # Card Opciones
         # -------------
@@ -592,17 +658,13 @@ class App(QWidget):
         # Base de Datos
         # -------------
         try:
-            self.patientes_list = backend.create_db('pacientes')
-            self.estudios_list = backend.create_db('estudios')
+            backend.migrate_db()
+            self.cohort_index = cohort.CohortIndex.load()
 
-            for data in self.patientes_list:
-                self.pacientes_menu.addItem(str(data[4]))
+            self.patients_model.reset()
             self.pacientes_menu.setCurrentIndex(-1)
         except:
-            self.pacientes_menu.setEnabled(False)
-            self.paciente_add_button.setEnabled(False)
-            self.paciente_edit_button.setEnabled(False)
-            self.paciente_del_button.setEnabled(False)
+            self.set_database_enabled(False)
             
             if self.language_value == 0:
                 QtWidgets.QMessageBox.critical(self, 'Error de Base de Datos', 'La base de datos no está configurada')
@@ -627,6 +689,7 @@ class App(QWidget):
         self.idioma_menu.language_text(index)
         
         self.paciente_card.language_text(index)
+        self.paciente_search.language_text(index)
         self.analisis_card.language_text(index)
         self.info_card.language_text(index)
 
@@ -698,11 +761,14 @@ class App(QWidget):
         self.paciente_add_button.apply_styleSheet(state)
         self.paciente_edit_button.apply_styleSheet(state)
         self.paciente_del_button.apply_styleSheet(state)
+        self.paciente_search.apply_styleSheet(state)
         self.pacientes_menu.apply_styleSheet(state)
 
         self.analisis_card.apply_styleSheet(state)
         self.analisis_add_button.apply_styleSheet(state)
         self.analisis_del_button.apply_styleSheet(state)
+        self.live_button.apply_styleSheet(state)
+        self.advanced_button.apply_styleSheet(state)
         self.analisis_menu.apply_styleSheet(state)
 
         self.info_card.apply_styleSheet(state)
@@ -933,17 +999,23 @@ class App(QWidget):
         self.db_info.exec()
         
         if self.db_info.database_data:
-            self.patientes_list = backend.create_db('pacientes')
-            self.estudios_list = backend.create_db('estudios')
-
-            for data in self.patientes_list:
-                self.pacientes_menu.addItem(str(data[4]))
+            backend.reset_pool()
+            self.studies_model.set_patient(None)
+            try:
+                backend.migrate_db()
+                self.cohort_index = cohort.CohortIndex.load()
+                self.patients_model.reset()
+            except backend.DB_ERRORS as err:
+                self.cohort_index = None
+                self.patients_model.reset(False)
+                self.set_database_enabled(False)
+                if self.language_value == 0:
+                    QtWidgets.QMessageBox.critical(self, 'Error de Base de Datos', f'No se pudo conectar con la base de datos\n{err}')
+                elif self.language_value == 1:
+                    QtWidgets.QMessageBox.critical(self, 'Database Error', f'Could not connect to the database\n{err}')
+                return
             self.pacientes_menu.setCurrentIndex(-1)
-
-            self.pacientes_menu.setEnabled(True)
-            self.paciente_add_button.setEnabled(True)
-            self.paciente_edit_button.setEnabled(True)
-            self.paciente_del_button.setEnabled(True)
+            self.set_database_enabled(True)
 
             if self.language_value == 0:
                 QtWidgets.QMessageBox.information(self, 'Datos Guardados', 'Base de datos configurada')
@@ -956,6 +1028,15 @@ class App(QWidget):
                 QtWidgets.QMessageBox.critical(self, 'Data Error', 'No information on the database was given')
 
 
+    def set_database_enabled(self, enabled: bool) -> None:
+        """ Enable the patient controls, disabled without a database """
+        self.paciente_search.setEnabled(enabled)
+        self.pacientes_menu.setEnabled(enabled)
+        self.paciente_add_button.setEnabled(enabled)
+        self.paciente_edit_button.setEnabled(enabled)
+        self.paciente_del_button.setEnabled(enabled)
+
+
     def on_manual_button_clicked(self) -> None:
         """ Manual button to open manual window """
         return 0
@@ -1040,12 +1121,11 @@ class App(QWidget):
             # -------------
             # Base de datos
             # -------------
-            self.patientes_list = backend.add_db('pacientes', self.patient_window.patient_data)
-            
-            self.pacientes_menu.clear()
-            for data in self.patientes_list:
-                self.pacientes_menu.addItem(str(data[4]))
-            self.pacientes_menu.setCurrentIndex(len(self.patientes_list)-1)
+            new_patient = backend.add_db('pacientes', self.patient_window.patient_data)
+            self.pacientes_menu.setCurrentIndex(self.patients_model.append_row(new_patient))
+            self.patient_data = new_patient
+            self.studies_model.set_patient(new_patient.id_number)
+            self.analisis_menu.setCurrentIndex(-1)
 
             self.analisis_add_button.setEnabled(True)
             self.analisis_del_button.setEnabled(True)
@@ -1067,42 +1147,41 @@ class App(QWidget):
         patient_id = self.pacientes_menu.currentText()
 
         if patient_id != '':
-            patient_data = backend.get_db('pacientes', patient_id)
+            patient_data = backend.get_db('pacientes', patient_id)[0]
 
-            id_db = patient_data[0][0]
+            id_db = patient_data.id
             self.patient_window = patient.Patient()
-            self.patient_window.apellido_text.text_field.setText(patient_data[0][1])
-            self.patient_window.nombre_text.text_field.setText(patient_data[0][2])
-            if patient_data[0][3] == 'CC':
+            self.patient_window.apellido_text.text_field.setText(patient_data.last_name)
+            self.patient_window.nombre_text.text_field.setText(patient_data.first_name)
+            if patient_data.id_type == 'CC':
                 self.patient_window.cc_button.set_state(True)
-            elif patient_data[0][3] == 'TI':
+            elif patient_data.id_type == 'TI':
                 self.patient_window.ti_button.set_state(True)
-            self.patient_window.id_text.text_field.setText(str(patient_data[0][4]))
-            self.patient_window.fecha_date.text_field.setDate(QtCore.QDate.fromString(patient_data[0][5], 'dd/MM/yyyy'))
-            if patient_data[0][6] == 'F':
+            self.patient_window.id_text.text_field.setText(str(patient_data.id_number))
+            self.patient_window.fecha_date.text_field.setDate(QtCore.QDate(patient_data.birth_date))
+            if patient_data.sex == 'F':
                 self.patient_window.f_button.set_state(True)
-            elif patient_data[0][6] == 'M':
+            elif patient_data.sex == 'M':
                 self.patient_window.m_button.set_state(True)
-            self.patient_window.peso_text.text_field.setText(str(patient_data[0][7]))
-            if patient_data[0][8] == 'Kg':
+            self.patient_window.peso_text.text_field.setText(str(patient_data.weight))
+            if patient_data.weight_unit == 'Kg':
                 self.patient_window.kg_button.set_state(True)
-            elif patient_data[0][8] == 'Lb':
+            elif patient_data.weight_unit == 'Lb':
                 self.patient_window.lb_button.set_state(True)
-            self.patient_window.altura_text.text_field.setText(str(patient_data[0][9]))
-            if patient_data[0][10] == 'm':
+            self.patient_window.altura_text.text_field.setText(str(patient_data.height))
+            if patient_data.height_unit == 'm':
                 self.patient_window.mt_button.set_state(True)
-            elif patient_data[0][10] == 'ft - in':
+            elif patient_data.height_unit == 'ft - in':
                 self.patient_window.fi_button.set_state(True)
-            self.patient_window.bmi_value_label.setText(str(patient_data[0][11]))
+            self.patient_window.bmi_value_label.setText(str(patient_data.bmi))
 
             self.patient_window.exec()
 
             if self.patient_window.patient_data:
-                self.patientes_list = backend.edit_db('pacientes', id_db, self.patient_window.patient_data)
-
-                self.pacientes_menu.clear()
-                for data in self.patientes_list:
-                    self.pacientes_menu.addItem(str(data[4]))
+                edited_patient = backend.edit_db('pacientes', id_db, self.patient_window.patient_data)
+                index = self.pacientes_menu.currentIndex()
+                if edited_patient is not None:
+                    self.patients_model.replace_row(index, edited_patient)
                 self.pacientes_menu.setCurrentIndex(-1)
 
                 self.analisis_add_button.setEnabled(False)
@@ -1140,11 +1219,10 @@ class App(QWidget):
         patient_id = self.pacientes_menu.currentText()
 
         if patient_id != '':
-            self.patientes_list = backend.delete_db('pacientes', patient_id)
-
-            self.pacientes_menu.clear()
-            for data in self.patientes_list:
-                self.pacientes_menu.addItem(str(data[4]))
+            deleted_patient = backend.delete_db('pacientes', patient_id)
+            index = self.pacientes_menu.currentIndex()
+            if deleted_patient is not None:
+                self.patients_model.remove_row(index)
             self.pacientes_menu.setCurrentIndex(-1)
 
             self.analisis_add_button.setEnabled(False)
@@ -1172,6 +1250,46 @@ class App(QWidget):
                 QtWidgets.QMessageBox.critical(self, 'Patient Error', 'No patient selected')
 
 
+    def on_paciente_search_textEdited(self, text: str) -> None:
+        """ Restart the search delay while the user types """
+        self.search_timer.start()
+
+
+    def on_search_timer_timeout(self) -> None:
+        """ Query the patients matching the search text and suggest them """
+        text = self.paciente_search.text().strip()
+        self.search_results = {}
+        if len(text) >= SEARCH_MIN_LENGTH:
+            for data in backend.search_patients(text, SEARCH_LIMIT):
+                self.search_results[f'{data.id_number} - {data.last_name} {data.first_name}'] = data
+        self.paciente_search.set_suggestions(list(self.search_results))
+
+
+    def on_paciente_search_activated(self, text: str) -> None:
+        """ Select the suggested patient as in the patients menu
+        
+        Parameters
+        ----------
+        text: str
+            Suggestion text
+        
+        Returns
+        -------
+        None
+        """
+        patient_data = self.search_results.get(text)
+        if patient_data is None:
+            return
+        self.search_timer.stop()
+        QtCore.QTimer.singleShot(0, self.paciente_search.clear)
+
+        index = self.patients_model.find(str(patient_data.id_number))
+        if index == -1:
+            index = self.patients_model.append_row(patient_data)
+        self.pacientes_menu.setCurrentIndex(index)
+        self.on_pacientes_menu_textActivated(str(patient_data.id_number))
+
+
     def on_pacientes_menu_textActivated(self, current_pacient: str) -> None:
         """ Change active patient and present previously saved studies and information
         
@@ -1184,30 +1302,28 @@ class App(QWidget):
         -------
         None
         """
-        patient_data = backend.get_db('pacientes', current_pacient)
+        patient_data = backend.get_db('pacientes', current_pacient)[0]
+        self.patient_data = patient_data
 
-        if patient_data[0][6] == 'F':
+        if patient_data.sex == 'F':
             self.sex_label.set_icon('woman', self.theme_value)
-        elif patient_data[0][6] == 'M':
+        elif patient_data.sex == 'M':
             self.sex_label.set_icon('man', self.theme_value)
 
-        self.apellido_value.setText(patient_data[0][1])
-        self.nombre_value.setText(patient_data[0][2])
-        self.id_value.setText(f'{patient_data[0][3]} {patient_data[0][4]}')
-        self.fecha_value.setText(patient_data[0][5])
-        self.sex_value.setText(patient_data[0][6])
-        self.peso_value.setText(f'{patient_data[0][7]} {patient_data[0][8]}')
-        self.altura_value.setText(f'{patient_data[0][9]} {patient_data[0][10]}')
-        self.bmi_value.setText(str(patient_data[0][11]))
+        self.apellido_value.setText(patient_data.last_name)
+        self.nombre_value.setText(patient_data.first_name)
+        self.id_value.setText(f'{patient_data.id_type} {patient_data.id_number}')
+        self.fecha_value.setText(patient_data.birth_date_text())
+        self.sex_value.setText(patient_data.sex)
+        self.peso_value.setText(f'{patient_data.weight} {patient_data.weight_unit}')
+        self.altura_value.setText(f'{patient_data.height} {patient_data.height_unit}')
+        self.bmi_value.setText(str(patient_data.bmi))
 
         self.analisis_add_button.setEnabled(True)
         self.analisis_del_button.setEnabled(True)
         self.analisis_menu.setEnabled(True)
 
-        self.estudios_list = backend.get_db('estudios', current_pacient)
-        self.analisis_menu.clear()
-        for data in self.estudios_list:
-            self.analisis_menu.addItem(str(data[2]))
+        self.studies_model.set_patient(patient_data.id_number)
         self.analisis_menu.setCurrentIndex(-1)
 
         self.lateral_plot.axes.cla()
@@ -1221,50 +1337,76 @@ class App(QWidget):
         self.right_foot_plot.axes.cla()
         self.right_foot_plot.draw()
 
-        self.left_lat_rango_value.setText('')
-        self.center_lat_rango_value.setText('')
-        self.right_lat_rango_value.setText('')
-        self.left_lat_vel_value.setText('')
-        self.center_lat_vel_value.setText('')
-        self.right_lat_vel_value.setText('')
-        self.left_lat_rms_value.setText('')
-        self.center_lat_rms_value.setText('')
-        self.right_lat_rms_value.setText('')
-
-        self.left_ap_rango_value.setText('')
-        self.center_ap_rango_value.setText('')
-        self.right_ap_rango_value.setText('')
-        self.left_ap_vel_value.setText('')
-        self.center_ap_vel_value.setText('')
-        self.right_ap_vel_value.setText('')
-        self.left_ap_rms_value.setText('')
-        self.center_ap_rms_value.setText('')
-        self.right_ap_rms_value.setText('')
-
-        self.left_cop_vel_value.setText('')
-        self.center_cop_vel_value.setText('')
-        self.right_cop_vel_value.setText('')
-        self.left_distancia_value.setText('')
-        self.center_distancia_value.setText('')
-        self.right_distancia_value.setText('')
-        self.left_frecuencia_value.setText('')
-        self.center_frecuencia_value.setText('')
-        self.right_frecuencia_value.setText('')
-
-        self.left_elipse_value.setText('')
-        self.center_elipse_value.setText('')
-        self.right_elipse_value.setText('')
-        self.left_hull_value.setText('')
-        self.center_hull_value.setText('')
-        self.right_hull_value.setText('')
-        self.left_pca_value.setText('')
-        self.center_pca_value.setText('')
-        self.right_pca_value.setText('')
+        self.clear_results()
 
     
     # ------------------
     # Funciones Análisis
     # ------------------
+    def show_results(self) -> None:
+        """ Show the analysis results in the value labels of each foot """
+        analyses = (self.left_analysis, self.center_analysis, self.right_analysis)
+        for name, labels in self.metric_labels.items():
+            for label, analysis, foot in zip(labels, analyses, ('left', 'center', 'right')):
+                label.setText(f'{analysis[name]:.2f}')
+                label.setToolTip(self.percentile_text(name, foot, analysis[name]))
+        self.advanced_button.setEnabled(True)
+
+    def clear_results(self) -> None:
+        """ Clear the value labels of each foot """
+        for labels in self.metric_labels.values():
+            for label in labels:
+                label.setText('')
+                label.setToolTip('')
+        self.advanced_button.setEnabled(False)
+
+    def on_advanced_button_clicked(self) -> None:
+        """ Show the spectral, entropy and diffusion metrics of the study """
+        self.advanced_window = advanced.Advanced((self.left_analysis, self.center_analysis, self.right_analysis))
+        self.advanced_window.exec()
+
+    def set_study_bin(self, study_date=None) -> None:
+        """ Demographic bin of the current patient at the study date """
+        try:
+            self.study_bin = cohort.patientBin(self.patient_data, study_date)
+        except (AttributeError, TypeError, ValueError):
+            self.study_bin = None
+
+    def percentile_text(self, name: str, foot: str, value: float) -> str:
+        """ Percentile and z-score of a metric against matched peers, none
+            for filtered signals (the cohort holds unfiltered metrics)
+        """
+        if self.cohort_index is None or self.study_bin is None or backend.preprocessingName(*self.filter_settings()):
+            return ''
+        lookup = self.cohort_index.lookup(name, foot, value, self.study_bin)
+        if lookup is None:
+            return ''
+        percentile, z, n = lookup
+        z_text = f' · z = {z:.2f}' if z is not None else ''
+        if self.language_value == 0:
+            return f'Percentil {percentile:.0f}{z_text} (n = {n}, {self.study_bin})'
+        elif self.language_value == 1:
+            return f'Percentile {percentile:.0f}{z_text} (n = {n}, {self.study_bin})'
+
+    def filter_settings(self) -> tuple:
+        """ Preprocess parameters (cutoff, order, detrend_type) from the settings
+
+        Settings keys: filter_cutoff (Hz, disabled if missing or 0),
+        filter_order and filter_detrend (constant or linear, applied with or
+        without filtering)
+        """
+        cutoff = float(self.settings.value('filter_cutoff', 0) or 0)
+        order = int(self.settings.value('filter_order', 4))
+        detrend_type = self.settings.value('filter_detrend', '') or None
+        return (cutoff if cutoff > 0 else None), order, detrend_type
+
+    def preprocess_study(self, dfs: list) -> list:
+        """ Optional zero-phase filtering of the study signals before analysis """
+        cutoff, order, detrend_type = self.filter_settings()
+        if cutoff is None and detrend_type is None:
+            return dfs
+        return backend.preprocessStudy(dfs, 10, cutoff, order, detrend_type)
+
     def on_analisis_add_button_clicked(self) -> None:
         """ Add analysis button to the database """
         selected_file = QtWidgets.QFileDialog.getOpenFileName(None,
@@ -1275,6 +1417,7 @@ class App(QWidget):
             self.default_path = self.settings.setValue('default_path', str(Path(selected_file).parent))
 
             extracted_signals = backend.extract(selected_file)
+            self.set_study_bin()
             self.data_l_lat = extracted_signals['left_lateral_signal']
             self.data_t_l_lat = extracted_signals['left_lateral_time']
             self.data_c_lat = extracted_signals['center_lateral_signal']
@@ -1295,22 +1438,23 @@ class App(QWidget):
             left_data = pd.merge(self.data_l_lat, self.data_l_ap, right_index = True, left_index = True)
             center_data = pd.merge(self.data_c_lat, self.data_c_ap, right_index = True, left_index = True)
             right_data = pd.merge(self.data_r_lat, self.data_r_ap, right_index = True, left_index = True)
+            raw_data = (left_data, center_data, right_data)
+            left_data, center_data, right_data = self.preprocess_study([left_data, center_data, right_data])
 
-            self.left_analysis = backend.analisis(left_data)
-            self.center_analysis = backend.analisis(center_data)
-            self.right_analysis = backend.analisis(right_data)
+            self.left_analysis, self.center_analysis, self.right_analysis = metrics.evaluateMany(
+                [left_data, center_data, right_data], list(self.metric_labels) + advanced.METRICS + ['elipse', 'hull', 'pca'])
 
-            self.left_data_elipse = backend.ellipseStandard(left_data)
-            self.center_data_elipse = backend.ellipseStandard(center_data)
-            self.right_data_elipse = backend.ellipseStandard(right_data)
+            self.left_data_elipse = self.left_analysis['elipse']
+            self.center_data_elipse = self.center_analysis['elipse']
+            self.right_data_elipse = self.right_analysis['elipse']
 
-            self.left_data_convex = backend.convexHull(left_data)
-            self.center_data_convex = backend.convexHull(center_data)
-            self.right_data_convex = backend.convexHull(right_data)
+            self.left_data_convex = self.left_analysis['hull']
+            self.center_data_convex = self.center_analysis['hull']
+            self.right_data_convex = self.right_analysis['hull']
 
-            self.left_data_pca = backend.ellipsePCA(left_data)
-            self.center_data_pca = backend.ellipsePCA(center_data)
-            self.right_data_pca = backend.ellipsePCA(right_data)
+            self.left_data_pca = self.left_analysis['pca']
+            self.center_data_pca = self.center_analysis['pca']
+            self.right_data_pca = self.right_analysis['pca']
 
             # ----------------
             # Gráficas Señales
@@ -1357,60 +1501,29 @@ class App(QWidget):
             # --------------------------
             # Presentación de resultados
             # --------------------------
-            self.left_lat_rango_value.setText(f'{self.left_analysis["lat_rango"]:.2f}')
-            self.center_lat_rango_value.setText(f'{self.center_analysis["lat_rango"]:.2f}')
-            self.right_lat_rango_value.setText(f'{self.right_analysis["lat_rango"]:.2f}')
-            self.left_lat_vel_value.setText(f'{self.left_analysis["lat_vel"]:.2f}')
-            self.center_lat_vel_value.setText(f'{self.center_analysis["lat_vel"]:.2f}')
-            self.right_lat_vel_value.setText(f'{self.right_analysis["lat_vel"]:.2f}')
-            self.left_lat_rms_value.setText(f'{self.left_analysis["lat_rms"]:.2f}')
-            self.center_lat_rms_value.setText(f'{self.center_analysis["lat_rms"]:.2f}')
-            self.right_lat_rms_value.setText(f'{self.right_analysis["lat_rms"]:.2f}')
-
-            self.left_ap_rango_value.setText(f'{self.left_analysis["ap_rango"]:.2f}')
-            self.center_ap_rango_value.setText(f'{self.center_analysis["ap_rango"]:.2f}')
-            self.right_ap_rango_value.setText(f'{self.right_analysis["ap_rango"]:.2f}')
-            self.left_ap_vel_value.setText(f'{self.left_analysis["ap_vel"]:.2f}')
-            self.center_ap_vel_value.setText(f'{self.center_analysis["ap_vel"]:.2f}')
-            self.right_ap_vel_value.setText(f'{self.right_analysis["ap_vel"]:.2f}')
-            self.left_ap_rms_value.setText(f'{self.left_analysis["ap_rms"]:.2f}')
-            self.center_ap_rms_value.setText(f'{self.center_analysis["ap_rms"]:.2f}')
-            self.right_ap_rms_value.setText(f'{self.right_analysis["ap_rms"]:.2f}')
-
-            self.left_cop_vel_value.setText(f'{self.left_analysis["centro_vel"]:.2f}')
-            self.center_cop_vel_value.setText(f'{self.center_analysis["centro_vel"]:.2f}')
-            self.right_cop_vel_value.setText(f'{self.right_analysis["centro_vel"]:.2f}')
-            self.left_distancia_value.setText(f'{self.left_analysis["centro_dist"]:.2f}')
-            self.center_distancia_value.setText(f'{self.center_analysis["centro_dist"]:.2f}')
-            self.right_distancia_value.setText(f'{self.right_analysis["centro_dist"]:.2f}')
-            self.left_frecuencia_value.setText(f'{self.left_analysis["centro_frec"]:.2f}')
-            self.center_frecuencia_value.setText(f'{self.center_analysis["centro_frec"]:.2f}')
-            self.right_frecuencia_value.setText(f'{self.right_analysis["centro_frec"]:.2f}')
-
-            self.left_elipse_value.setText(f'{self.left_data_elipse["area"]:.2f}')
-            self.center_elipse_value.setText(f'{self.center_data_elipse["area"]:.2f}')
-            self.right_elipse_value.setText(f'{self.right_data_elipse["area"]:.2f}')
-            self.left_hull_value.setText(f'{self.left_data_convex["area"]:.2f}')
-            self.center_hull_value.setText(f'{self.center_data_convex["area"]:.2f}')
-            self.right_hull_value.setText(f'{self.right_data_convex["area"]:.2f}')
-            self.left_pca_value.setText(f'{self.left_data_pca["area"]:.2f}')
-            self.center_pca_value.setText(f'{self.center_data_pca["area"]:.2f}')
-            self.right_pca_value.setText(f'{self.right_data_pca["area"]:.2f}')
+            self.show_results()
 
             # -------------
             # Base de datos
             # -------------
+            # Signals are stored unfiltered and metrics with the filter settings they were computed with
+            feet = ('left', 'center', 'right')
+            stored_results = metrics.evaluateMany([left_data, center_data, right_data], metrics.PERSISTED)
+            preprocessing = metrics.settingsName(backend.preprocessingName(*self.filter_settings()))
             study_data = {
                 'id_number': self.pacientes_menu.currentText(),
                 'file_name': Path(selected_file).name,
-                'file_path': selected_file
+                'file_path': selected_file,
+                'metrics': [(foot, name, result[name], metrics.metricVersion(name, preprocessing), preprocessing)
+                    for foot, result in zip(feet, stored_results) for name in metrics.PERSISTED],
+                'signals': dict(zip(feet, raw_data))
                 }
-            self.estudios_list = backend.add_db('estudios', study_data)
+            new_study = backend.add_db('estudios', study_data)
+            # The cohort only holds metrics of unfiltered signals
+            if self.cohort_index is not None and self.study_bin is not None and not preprocessing:
+                self.cohort_index.addStudy(self.study_bin, dict(zip(feet, stored_results)))
             
-            self.analisis_menu.clear()
-            for data in self.estudios_list:
-                self.analisis_menu.addItem(str(data[2]))
-            self.analisis_menu.setCurrentIndex(len(self.patientes_list)-1)
+            self.analisis_menu.setCurrentIndex(self.studies_model.append_row(new_study))
 
             if self.language_value == 0:
                 QtWidgets.QMessageBox.information(self, 'Datos Guardados', 'Estudio agregado a la base de datos')
@@ -1428,11 +1541,10 @@ class App(QWidget):
         current_study = self.analisis_menu.currentText()
 
         if current_study != '':
-            self.estudios_list = backend.delete_db('estudios', current_study)
-            
-            self.analisis_menu.clear()
-            for data in self.estudios_list:
-                self.analisis_menu.addItem(str(data[2]))
+            deleted_study = backend.delete_db('estudios', current_study)
+            index = self.analisis_menu.currentIndex()
+            if deleted_study is not None:
+                self.studies_model.remove_row(index)
             self.analisis_menu.setCurrentIndex(-1)
 
             self.lateral_plot.axes.cla()
@@ -1446,45 +1558,7 @@ class App(QWidget):
             self.right_foot_plot.axes.cla()
             self.right_foot_plot.draw()
 
-            self.left_lat_rango_value.setText('')
-            self.center_lat_rango_value.setText('')
-            self.right_lat_rango_value.setText('')
-            self.left_lat_vel_value.setText('')
-            self.center_lat_vel_value.setText('')
-            self.right_lat_vel_value.setText('')
-            self.left_lat_rms_value.setText('')
-            self.center_lat_rms_value.setText('')
-            self.right_lat_rms_value.setText('')
-
-            self.left_ap_rango_value.setText('')
-            self.center_ap_rango_value.setText('')
-            self.right_ap_rango_value.setText('')
-            self.left_ap_vel_value.setText('')
-            self.center_ap_vel_value.setText('')
-            self.right_ap_vel_value.setText('')
-            self.left_ap_rms_value.setText('')
-            self.center_ap_rms_value.setText('')
-            self.right_ap_rms_value.setText('')
-
-            self.left_cop_vel_value.setText('')
-            self.center_cop_vel_value.setText('')
-            self.right_cop_vel_value.setText('')
-            self.left_distancia_value.setText('')
-            self.center_distancia_value.setText('')
-            self.right_distancia_value.setText('')
-            self.left_frecuencia_value.setText('')
-            self.center_frecuencia_value.setText('')
-            self.right_frecuencia_value.setText('')
-
-            self.left_elipse_value.setText('')
-            self.center_elipse_value.setText('')
-            self.right_elipse_value.setText('')
-            self.left_hull_value.setText('')
-            self.center_hull_value.setText('')
-            self.right_hull_value.setText('')
-            self.left_pca_value.setText('')
-            self.center_pca_value.setText('')
-            self.right_pca_value.setText('')
+            self.clear_results()
 
             if self.language_value == 0:
                 QtWidgets.QMessageBox.information(self, 'Datos Guardados', 'Análisis eliminado de la base de datos')
@@ -1509,8 +1583,12 @@ class App(QWidget):
         -------
         None
         """
-        analisis_data = backend.get_db('estudios', self.pacientes_menu.currentText())
-        study_path = [item for item in analisis_data if item[2] == current_study][0][3]
+        study_data = self.studies_model.row(self.studies_model.find(current_study))
+        study_path = study_data.file_path
+        # Studies registered before dates were recorded have no bin
+        self.study_bin = None
+        if study_data.study_date is not None:
+            self.set_study_bin(study_data.study_date)
 
         extracted_signals = backend.extract(study_path)
         self.data_l_lat = extracted_signals['left_lateral_signal']
@@ -1533,22 +1611,22 @@ class App(QWidget):
         left_data = pd.merge(self.data_l_lat, self.data_l_ap, right_index = True, left_index = True)
         center_data = pd.merge(self.data_c_lat, self.data_c_ap, right_index = True, left_index = True)
         right_data = pd.merge(self.data_r_lat, self.data_r_ap, right_index = True, left_index = True)
+        left_data, center_data, right_data = self.preprocess_study([left_data, center_data, right_data])
 
-        self.left_analysis = backend.analisis(left_data)
-        self.center_analysis = backend.analisis(center_data)
-        self.right_analysis = backend.analisis(right_data)
+        self.left_analysis, self.center_analysis, self.right_analysis = metrics.evaluateMany(
+            [left_data, center_data, right_data], list(self.metric_labels) + advanced.METRICS + ['elipse', 'hull', 'pca'])
 
-        self.left_data_elipse = backend.ellipseStandard(left_data)
-        self.center_data_elipse = backend.ellipseStandard(center_data)
-        self.right_data_elipse = backend.ellipseStandard(right_data)
+        self.left_data_elipse = self.left_analysis['elipse']
+        self.center_data_elipse = self.center_analysis['elipse']
+        self.right_data_elipse = self.right_analysis['elipse']
 
-        self.left_data_convex = backend.convexHull(left_data)
-        self.center_data_convex = backend.convexHull(center_data)
-        self.right_data_convex = backend.convexHull(right_data)
+        self.left_data_convex = self.left_analysis['hull']
+        self.center_data_convex = self.center_analysis['hull']
+        self.right_data_convex = self.right_analysis['hull']
 
-        self.left_data_pca = backend.ellipsePCA(left_data)
-        self.center_data_pca = backend.ellipsePCA(center_data)
-        self.right_data_pca = backend.ellipsePCA(right_data)
+        self.left_data_pca = self.left_analysis['pca']
+        self.center_data_pca = self.center_analysis['pca']
+        self.right_data_pca = self.right_analysis['pca']
 
         # ----------------
         # Gráficas Señales
@@ -1595,45 +1673,79 @@ class App(QWidget):
         # --------------------------
         # Presentación de resultados
         # --------------------------
-        self.left_lat_rango_value.setText(f'{self.left_analysis["lat_rango"]:.2f}')
-        self.center_lat_rango_value.setText(f'{self.center_analysis["lat_rango"]:.2f}')
-        self.right_lat_rango_value.setText(f'{self.right_analysis["lat_rango"]:.2f}')
-        self.left_lat_vel_value.setText(f'{self.left_analysis["lat_vel"]:.2f}')
-        self.center_lat_vel_value.setText(f'{self.center_analysis["lat_vel"]:.2f}')
-        self.right_lat_vel_value.setText(f'{self.right_analysis["lat_vel"]:.2f}')
-        self.left_lat_rms_value.setText(f'{self.left_analysis["lat_rms"]:.2f}')
-        self.center_lat_rms_value.setText(f'{self.center_analysis["lat_rms"]:.2f}')
-        self.right_lat_rms_value.setText(f'{self.right_analysis["lat_rms"]:.2f}')
-
-        self.left_ap_rango_value.setText(f'{self.left_analysis["ap_rango"]:.2f}')
-        self.center_ap_rango_value.setText(f'{self.center_analysis["ap_rango"]:.2f}')
-        self.right_ap_rango_value.setText(f'{self.right_analysis["ap_rango"]:.2f}')
-        self.left_ap_vel_value.setText(f'{self.left_analysis["ap_vel"]:.2f}')
-        self.center_ap_vel_value.setText(f'{self.center_analysis["ap_vel"]:.2f}')
-        self.right_ap_vel_value.setText(f'{self.right_analysis["ap_vel"]:.2f}')
-        self.left_ap_rms_value.setText(f'{self.left_analysis["ap_rms"]:.2f}')
-        self.center_ap_rms_value.setText(f'{self.center_analysis["ap_rms"]:.2f}')
-        self.right_ap_rms_value.setText(f'{self.right_analysis["ap_rms"]:.2f}')
-
-        self.left_cop_vel_value.setText(f'{self.left_analysis["centro_vel"]:.2f}')
-        self.center_cop_vel_value.setText(f'{self.center_analysis["centro_vel"]:.2f}')
-        self.right_cop_vel_value.setText(f'{self.right_analysis["centro_vel"]:.2f}')
-        self.left_distancia_value.setText(f'{self.left_analysis["centro_dist"]:.2f}')
-        self.center_distancia_value.setText(f'{self.center_analysis["centro_dist"]:.2f}')
-        self.right_distancia_value.setText(f'{self.right_analysis["centro_dist"]:.2f}')
-        self.left_frecuencia_value.setText(f'{self.left_analysis["centro_frec"]:.2f}')
-        self.center_frecuencia_value.setText(f'{self.center_analysis["centro_frec"]:.2f}')
-        self.right_frecuencia_value.setText(f'{self.right_analysis["centro_frec"]:.2f}')
-
-        self.left_elipse_value.setText(f'{self.left_data_elipse["area"]:.2f}')
-        self.center_elipse_value.setText(f'{self.center_data_elipse["area"]:.2f}')
-        self.right_elipse_value.setText(f'{self.right_data_elipse["area"]:.2f}')
-        self.left_hull_value.setText(f'{self.left_data_convex["area"]:.2f}')
-        self.center_hull_value.setText(f'{self.center_data_convex["area"]:.2f}')
-        self.right_hull_value.setText(f'{self.right_data_convex["area"]:.2f}')
-        self.left_pca_value.setText(f'{self.left_data_pca["area"]:.2f}')
-        self.center_pca_value.setText(f'{self.center_data_pca["area"]:.2f}')
-        self.right_pca_value.setText(f'{self.right_data_pca["area"]:.2f}')
+        self.show_results()
+
+
+    # -----------------------
+    # Funciones Señal en Vivo
+    # -----------------------
+    def on_live_button_clicked(self) -> None:
+        """ Start or stop live acquisition from the configured source """
+        if self.acquisition and self.acquisition.is_running():
+            self.acquisition.stop()
+            self.live_timer.stop()
+            self.on_live_timer_timeout()
+            return
+
+        self.live_window = live.Live()
+        self.live_window.exec()
+
+        if self.live_window.live_data:
+            try:
+                # Addresses are parsed by the sources, e.g. a baud rate or port that is not a number
+                source = live.create_source(self.live_window.live_data['source'],
+                    self.live_window.live_data['address'], self.live_window.live_data['fs'])
+                self.acquisition = live.Acquisition(source, self.live_window.live_data['fs'])
+                self.acquisition.start()
+            except Exception as err:
+                self.acquisition = None
+                if self.language_value == 0:
+                    QtWidgets.QMessageBox.critical(self, 'Error de Adquisición', f'No se pudo abrir la fuente de datos\n{err}')
+                elif self.language_value == 1:
+                    QtWidgets.QMessageBox.critical(self, 'Acquisition Error', f'Data source could not be opened\n{err}')
+                return
+
+            # Lines are created once and only their data is updated on each frame
+            self.lateral_plot.axes.cla()
+            self.lateral_plot.fig.subplots_adjust(left=0.05, bottom=0.15, right=1, top=0.95, wspace=0, hspace=0)
+            self.live_lateral_plot, = self.lateral_plot.axes.plot([], [], '#00FF00')
+            self.lateral_plot.draw()
+
+            self.antePost_plot.axes.cla()
+            self.antePost_plot.fig.subplots_adjust(left=0.05, bottom=0.15, right=1, top=0.95, wspace=0, hspace=0)
+            self.live_ap_plot, = self.antePost_plot.axes.plot([], [], '#00FF00')
+            self.antePost_plot.draw()
+
+            self.live_timer.start()
+
+
+    def on_live_timer_timeout(self) -> None:
+        """ Refresh live plots and results at the timer frame rate """
+        t, samples, results = self.acquisition.snapshot()
+
+        if len(t) > 1:
+            self.live_lateral_plot.set_data(t, samples[:,0])
+            self.lateral_plot.axes.set_xlim(t[0], t[-1])
+            self.lateral_plot.axes.set_ylim(samples[:,0].min() - 1, samples[:,0].max() + 1)
+            self.lateral_plot.draw_idle()
+
+            self.live_ap_plot.set_data(t, samples[:,1])
+            self.antePost_plot.axes.set_xlim(t[0], t[-1])
+            self.antePost_plot.axes.set_ylim(samples[:,1].min() - 1, samples[:,1].max() + 1)
+            self.antePost_plot.draw_idle()
+
+        if results:
+            for name, labels in self.metric_labels.items():
+                if name in results:
+                    labels[1].setText(f'{results[name]:.2f}')
+
+        if not self.acquisition.is_running():
+            self.live_timer.stop()
+            if self.acquisition.error:
+                if self.language_value == 0:
+                    QtWidgets.QMessageBox.critical(self, 'Error de Adquisición', f'{self.acquisition.error}')
+                elif self.language_value == 1:
+                    QtWidgets.QMessageBox.critical(self, 'Acquisition Error', f'{self.acquisition.error}')
 
 
     # ------------------
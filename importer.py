@@ -0,0 +1,319 @@
+"""
+Importer
+
+This file contains the bulk import of patient demographics and studies.
+
+Patients are read from CSV or XLSX files. Rows are validated, their body
+mass index is computed as in the patient dialog, and the valid ones are
+loaded with COPY in one transaction. Id numbers already in the database are
+updated or reported, invalid rows are reported with their line number, and
+neither aborts the import.
+
+Patient columns (header names, in any order):
+    last_name, first_name, id_type (CC, TI), id_number,
+    birth_date (dd/mm/yyyy or yyyy-mm-dd), sex (F, M),
+    weight, weight_unit (Kg, Lb), height, height_unit (m, ft - in)
+
+Studies are read from a manifest (CSV or XLSX) listing the study images
+of registered patients. Signals are extracted and the stored metrics are
+computed in worker processes, and the studies are registered in chunks
+with multi-row inserts. Files already registered are reported. The metrics
+of each committed chunk are merged into the normative cohort sketches.
+
+Study columns:
+    id_number, file_path, study_date (optional, dd/mm/yyyy or yyyy-mm-dd)
+
+Usage:
+    python importer.py patients patients.csv
+    python importer.py patients patients.xlsx --on-conflict report
+    python importer.py studies manifest.csv --workers 4
+"""
+
+import argparse
+import datetime
+import math
+import sys
+from pathlib import Path
+
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+import backend
+import batch
+import cohort
+import metrics
+import patient
+
+COLUMNS = ('last_name', 'first_name', 'id_type', 'id_number', 'birth_date', 'sex',
+           'weight', 'weight_unit', 'height', 'height_unit')
+STUDY_COLUMNS = ('id_number', 'file_path')
+DATE_FORMATS = ('%d/%m/%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S')
+# Column limits of pacientes: names VARCHAR(128), weight NUMERIC(5,2) and
+# height NUMERIC(3,2), checked after rounding to two decimals
+NAME_LENGTH = 128
+WEIGHT_LIMIT = 1000
+HEIGHT_LIMIT = 10
+
+
+def read_table(file_path: str) -> pd.DataFrame:
+    """ Table of a CSV or XLSX file, every value as text """
+    if Path(file_path).suffix.lower() in ('.xlsx', '.xls'):
+        table = pd.read_excel(file_path, dtype=str)
+    else:
+        table = pd.read_csv(file_path, dtype=str, sep=None, engine='python')
+    table.columns = [str(column).strip().lower() for column in table.columns]
+    return table
+
+
+def parse_date(value: str) -> datetime.date:
+    """ Date from a dd/mm/yyyy or yyyy-mm-dd text """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f'date {value!r} is not dd/mm/yyyy')
+
+
+def validate_patient(record: dict) -> tuple:
+    """ Patient row from a table record
+
+    Parameters
+    ----------
+    record: dict
+        Text value by column name
+
+    Returns
+    -------
+    row: tuple
+        Values in storage.PACIENTE_VALUES order with the body mass index
+
+    Raises
+    ------
+    ValueError
+        Missing or invalid values
+    """
+    values = {column: str(record.get(column) or '').strip() for column in COLUMNS}
+    missing = [column for column in COLUMNS if values[column] in ('', 'nan')]
+    if missing:
+        raise ValueError(f'missing {", ".join(missing)}')
+
+    id_type = values['id_type'].upper()
+    if id_type not in ('CC', 'TI'):
+        raise ValueError(f'id_type {values["id_type"]!r} is not CC or TI')
+    if not values['id_number'].isdigit() or len(values['id_number']) > 18:
+        raise ValueError(f'id_number {values["id_number"]!r} is not a number')
+    sex = values['sex'].upper()
+    if sex not in ('F', 'M'):
+        raise ValueError(f'sex {values["sex"]!r} is not F or M')
+    units = {unit.lower(): unit for unit in patient.WEIGHT_UNITS}
+    weight_unit = units.get(values['weight_unit'].lower())
+    if weight_unit is None:
+        raise ValueError(f'weight_unit {values["weight_unit"]!r} is not Kg or Lb')
+    units = {unit.replace(' ', '').lower(): unit for unit in patient.HEIGHT_UNITS}
+    height_unit = units.get(values['height_unit'].replace(' ', '').lower())
+    if height_unit is None:
+        raise ValueError(f'height_unit {values["height_unit"]!r} is not m or ft - in')
+
+    for column in ('last_name', 'first_name'):
+        if len(values[column]) > NAME_LENGTH:
+            raise ValueError(f'{column} is longer than {NAME_LENGTH} characters')
+
+    weight, height = round(float(values['weight']), 2), round(float(values['height']), 2)
+    if not 0 < weight < WEIGHT_LIMIT:
+        raise ValueError(f'weight {values["weight"]} out of range')
+    if not 0 < height < HEIGHT_LIMIT:
+        raise ValueError(f'height {values["height"]} out of range')
+    if height_unit == 'ft - in' and round((height - math.floor(height)) * 100, 6) >= 12:
+        raise ValueError(f'height {height} has more than 11 inches')
+    bmi = round(patient.body_mass_index(weight, weight_unit, height, height_unit), 1)
+    if not 0 < bmi < 100:
+        raise ValueError(f'body mass index {bmi} out of range')
+
+    return (values['last_name'], values['first_name'], id_type, int(values['id_number']),
+            parse_date(values['birth_date']), sex, weight, weight_unit, height, height_unit, bmi)
+
+
+def import_patients(file_path: str, update: bool = True) -> dict:
+    """ Validate and load the patients of a CSV or XLSX file
+
+    Parameters
+    ----------
+    file_path: str
+        Patient table file path
+    update: bool
+        Existing id numbers are updated if True, reported if False
+
+    Returns
+    -------
+    report: dict
+        inserted, updated and conflicts: id numbers
+        errors: tuples (line, message) of the rows not loaded
+    """
+    table = read_table(file_path)
+    absent = [column for column in COLUMNS if column not in table.columns]
+    if absent:
+        raise ValueError(f'{file_path}: missing columns {", ".join(absent)}')
+
+    rows, errors, lines = [], [], {}
+    for line, record in enumerate(table.to_dict('records'), start=2):
+        try:
+            row = validate_patient(record)
+        except ValueError as err:
+            errors.append((line, str(err)))
+            continue
+        if row[3] in lines:
+            errors.append((line, f'id_number {row[3]} repeated from line {lines[row[3]]}'))
+            continue
+        lines[row[3]] = line
+        rows.append(row)
+
+    inserted, updated, conflicts = [], [], []
+    if rows:
+        backend.migrate_db()
+        inserted, updated, conflicts = backend.copy_patients(rows, update)
+
+    return {'inserted': inserted, 'updated': updated, 'conflicts': conflicts, 'errors': errors}
+
+
+def study_record(task: tuple) -> tuple:
+    """ Study data with signals and stored metrics of a manifest row
+
+    Parameters
+    ----------
+    task: tuple
+        Line, id number, file path and study date (None if not given)
+
+    Returns
+    -------
+    line, data, error: tuple
+        Study data for backend.add_studies (None on error) and error message
+    """
+    line, id_number, file_path, study_date = task
+    try:
+        dfs = batch.study_signals(file_path)
+        results = metrics.evaluateMany([dfs[foot] for foot in batch.FEET], metrics.PERSISTED)
+    except Exception as err:
+        return line, None, str(err)
+
+    data = {
+        'id_number': id_number,
+        'file_name': Path(file_path).name,
+        'file_path': file_path,
+        'study_date': study_date,
+        'metrics': [(foot, name, result[name], metrics.metricVersion(name), '')
+            for foot, result in zip(batch.FEET, results) for name in metrics.PERSISTED],
+        'signals': dfs
+    }
+    return line, data, None
+
+
+def merge_cohort(studies: list) -> None:
+    """ Merge the metrics of registered studies into the cohort sketches
+
+    Parameters
+    ----------
+    studies: list
+        Tuples (inserted study row, metric rows as in study_record)
+    """
+    patients = {}
+    for row, _ in studies:
+        if row.id_number not in patients:
+            patients[row.id_number] = backend.get_db('pacientes', row.id_number)[0]
+    cohort.addStudies([(cohort.patientBin(patients[row.id_number], row.study_date), rows)
+        for row, rows in studies])
+
+
+def import_studies(file_path: str, workers: int = None, chunk: int = 200) -> dict:
+    """ Extract, analyze and register the studies of a manifest
+
+    Parameters
+    ----------
+    file_path: str
+        Manifest file path
+    workers: int
+        Extraction and analysis worker processes
+    chunk: int
+        Studies by registration transaction
+
+    Returns
+    -------
+    report: dict
+        inserted: registered file names
+        errors: tuples (line, message) of the studies not registered
+    """
+    table = read_table(file_path)
+    absent = [column for column in STUDY_COLUMNS if column not in table.columns]
+    if absent:
+        raise ValueError(f'{file_path}: missing columns {", ".join(absent)}')
+
+    tasks, errors = [], []
+    for line, record in enumerate(table.to_dict('records'), start=2):
+        id_number = str(record.get('id_number') or '').strip()
+        study_file = str(record.get('file_path') or '').strip()
+        study_date = str(record.get('study_date') or '').strip()
+        try:
+            if not id_number.isdigit() or study_file in ('', 'nan'):
+                raise ValueError('id_number and file_path are required')
+            study_date = parse_date(study_date) if study_date not in ('', 'nan') else None
+        except ValueError as err:
+            errors.append((line, str(err)))
+            continue
+        tasks.append((line, int(id_number), study_file, study_date))
+
+    backend.migrate_db()
+    inserted = []
+    with ProcessPoolExecutor(workers) as pool:
+        for start in range(0, len(tasks), chunk):
+            records, lines = [], []
+            for line, data, error in pool.map(study_record, tasks[start:start + chunk]):
+                if error:
+                    errors.append((line, error))
+                else:
+                    records.append(data)
+                    lines.append(line)
+            studies = []
+            for line, data, (file_name, row, message) in zip(lines, records, backend.add_studies(records, chunk)):
+                if row is None:
+                    errors.append((line, message))
+                else:
+                    inserted.append(file_name)
+                    studies.append((row, data['metrics']))
+            merge_cohort(studies)
+
+    errors.sort()
+    return {'inserted': inserted, 'errors': errors}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bulk import of patients and studies')
+    subparsers = parser.add_subparsers(dest='table', required=True)
+    patients_parser = subparsers.add_parser('patients', help='Patient demographics table')
+    patients_parser.add_argument('file', help='CSV or XLSX patient table')
+    patients_parser.add_argument('--on-conflict', choices=['update', 'report'], default='update',
+        help='Update existing id numbers or report them without changes')
+    studies_parser = subparsers.add_parser('studies', help='Manifest of study images')
+    studies_parser.add_argument('file', help='CSV or XLSX manifest')
+    studies_parser.add_argument('--workers', type=int, default=None, help='Extraction worker processes')
+    studies_parser.add_argument('--chunk', type=int, default=200, help='Studies by transaction')
+    args = parser.parse_args()
+
+    try:
+        if args.table == 'patients':
+            report = import_patients(args.file, args.on_conflict == 'update')
+        else:
+            report = import_studies(args.file, args.workers, args.chunk)
+    except backend.DB_ERRORS as err:
+        parser.exit(1, f'database: {err}\n')
+
+    if args.table == 'patients':
+        for id_number in report['conflicts']:
+            print(f'{args.file}: id_number {id_number} already exists', file=sys.stderr)
+        summary = (f'{len(report["inserted"])} inserted, {len(report["updated"])} updated, '
+                   f'{len(report["conflicts"])} conflicts')
+    else:
+        summary = f'{len(report["inserted"])} studies registered'
+
+    for line, message in report['errors']:
+        print(f'{args.file}:{line}: {message}', file=sys.stderr)
+    print(f'{summary}, {len(report["errors"])} errors', file=sys.stderr)
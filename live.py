@@ -0,0 +1,387 @@
+"""
+Live
+
+This file contains class Live Dialog and the live acquisition classes.
+
+Center of pressure samples are read from a source as text lines with the
+lateral and antero-posterior values separated by a comma:
+
+    lat,ap
+
+Sources:
+    Serial: serial port name and optional baud rate, e.g. COM3,115200
+    UDP: local address and port to listen, e.g. 0.0.0.0:5005
+    File: CSV file with two columns replayed at the sampling frequency
+"""
+
+from PyQt6 import QtWidgets
+from PyQt6.QtCore import QSettings, QRegularExpression
+from PyQt6.QtGui import QRegularExpressionValidator
+
+import math
+import sys
+import time
+import socket
+import threading
+import numpy as np
+
+import material3_components as mt3
+import backend
+
+
+# -----------
+# Ring Buffer
+# -----------
+class RingBuffer:
+    def __init__(self, capacity: int) -> None:
+        """ Fixed size buffer of lateral and antero-posterior samples
+
+        Parameters
+        ----------
+        capacity: int
+            Maximum number of samples kept
+        """
+        self.capacity = capacity
+        self.data = np.zeros((capacity, 2))
+        self.head = 0
+        self.count = 0
+        self.total = 0
+
+    def extend(self, samples: np.array) -> None:
+        """ Add samples of shape (n, 2), overwriting the oldest ones """
+        samples = samples[-self.capacity:]
+        n = len(samples)
+        end = self.head + n
+        if end <= self.capacity:
+            self.data[self.head:end] = samples
+        else:
+            split = self.capacity - self.head
+            self.data[self.head:] = samples[:split]
+            self.data[:n - split] = samples[split:]
+        self.head = end % self.capacity
+        self.count = min(self.count + n, self.capacity)
+        self.total += n
+
+    def snapshot(self) -> tuple:
+        """ Samples in chronological order
+
+        Returns
+        -------
+        index, samples: tuple
+            Sample numbers since the start and samples of shape (n, 2)
+        """
+        start = (self.head - self.count) % self.capacity
+        order = (start + np.arange(self.count)) % self.capacity
+        index = np.arange(self.total - self.count, self.total)
+        return index, self.data[order]
+
+
+# -------
+# Fuentes
+# -------
+def _parse_lines(buffer: bytes) -> tuple:
+    """ Parse complete 'lat,ap' lines
+
+    Returns
+    -------
+    samples, remainder: tuple
+        Samples of shape (n, 2) and incomplete trailing bytes
+    """
+    *lines, remainder = buffer.split(b'\n')
+    samples = []
+    for line in lines:
+        try:
+            lat, ap = line.decode('ascii').strip().split(',')[:2]
+            samples.append((float(lat), float(ap)))
+        except ValueError:
+            continue
+    return np.array(samples, dtype=float).reshape(-1, 2), remainder
+
+
+class SerialSource:
+    def __init__(self, address: str) -> None:
+        """ Samples from a serial port (requires pyserial)
+
+        Parameters
+        ----------
+        address: str
+            Port name and optional baud rate, e.g. COM3,115200
+        """
+        port, _, baudrate = address.partition(',')
+        self.port = port.strip()
+        self.baudrate = int(baudrate) if baudrate else 115200
+        self.serial = None
+        self.buffer = b''
+
+    def open(self) -> None:
+        import serial
+        self.serial = serial.Serial(self.port, self.baudrate, timeout=0.05)
+
+    def read(self) -> np.array:
+        self.buffer += self.serial.read(self.serial.in_waiting or 1)
+        samples, self.buffer = _parse_lines(self.buffer)
+        return samples
+
+    def close(self) -> None:
+        if self.serial:
+            self.serial.close()
+
+
+class UDPSource:
+    def __init__(self, address: str) -> None:
+        """ Samples from UDP datagrams
+
+        Parameters
+        ----------
+        address: str
+            Local address and port to listen, e.g. 0.0.0.0:5005
+        """
+        host, _, port = address.rpartition(':')
+        self.host = host or '0.0.0.0'
+        self.port = int(port)
+        self.socket = None
+        self.buffer = b''
+
+    def open(self) -> None:
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((self.host, self.port))
+        self.socket.settimeout(0.05)
+
+    def read(self) -> np.array:
+        try:
+            datagram = self.socket.recv(65535)
+        except socket.timeout:
+            return np.empty((0, 2))
+        if not datagram.endswith(b'\n'):
+            datagram += b'\n'
+        samples, self.buffer = _parse_lines(self.buffer + datagram)
+        return samples
+
+    def close(self) -> None:
+        if self.socket:
+            self.socket.close()
+
+
+class FileReplaySource:
+    def __init__(self, address: str, fs: float) -> None:
+        """ Samples replayed from a CSV file in real time
+
+        Parameters
+        ----------
+        address: str
+            CSV file path with lateral and antero-posterior columns
+        fs: float
+            Sampling frequency in Hz
+        """
+        self.path = address
+        self.fs = fs
+        self.samples = None
+        self.sent = 0
+        self.start = 0.0
+
+    def open(self) -> None:
+        self.samples = np.loadtxt(self.path, delimiter=',', usecols=(0, 1), ndmin=2)
+        self.sent = 0
+        self.start = time.perf_counter()
+
+    def read(self) -> np.array:
+        if self.sent >= len(self.samples):
+            return None
+        time.sleep(0.01)
+        due = min(int((time.perf_counter() - self.start) * self.fs), len(self.samples))
+        samples = self.samples[self.sent:due]
+        self.sent = due
+        return samples
+
+    def close(self) -> None:
+        self.samples = None
+
+
+SOURCES = {
+    0: SerialSource,
+    1: UDPSource,
+    2: FileReplaySource
+}
+
+
+def create_source(source: int, address: str, fs: float):
+    """ Source instance from the dialog selection """
+    if source == 2:
+        return FileReplaySource(address, fs)
+    return SOURCES[source](address)
+
+
+# -----------
+# Adquisición
+# -----------
+class Acquisition:
+    def __init__(self, source, fs: float, seconds: float = 60) -> None:
+        """ Background reading of a source into a ring buffer with
+            incremental analysis of all received samples
+
+        Parameters
+        ----------
+        source: SerialSource, UDPSource or FileReplaySource
+            Samples source
+        fs: float
+            Sampling frequency in Hz
+        seconds: float
+            Length of the signal kept for plotting
+        """
+        self.source = source
+        self.fs = fs
+        self.buffer = RingBuffer(int(seconds * fs))
+        self.analysis = backend.StreamingAnalysis(fs)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def start(self) -> None:
+        self.source.open()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        try:
+            while not self.stop_event.is_set():
+                samples = self.source.read()
+                if samples is None:
+                    break
+                if len(samples):
+                    with self.lock:
+                        self.buffer.extend(samples)
+                        self.analysis.update(samples[:,0], samples[:,1])
+        except Exception as err:
+            self.error = err
+        finally:
+            self.source.close()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=1)
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def snapshot(self) -> tuple:
+        """ Buffered signal and current results
+
+        Returns
+        -------
+        t, samples, results: tuple
+            Time in seconds, samples of shape (n, 2) and streaming results
+            (None until two samples have been received)
+        """
+        with self.lock:
+            index, samples = self.buffer.snapshot()
+            results = self.analysis.results() if self.analysis.n > 1 else None
+        return index / self.fs, samples, results
+
+
+# -----------
+# Live Dialog
+# -----------
+class Live(QtWidgets.QDialog):
+    def __init__(self):
+        """ UI Live acquisition dialog class """
+        super().__init__()
+        # --------
+        # Settings
+        # --------
+        self.settings = QSettings(f'{sys.path[0]}/settings.ini', QSettings.Format.IniFormat)
+        self.language_value = int(self.settings.value('language'))
+        self.theme_value = eval(self.settings.value('theme'))
+
+        self.regExp1 = QRegularExpressionValidator(QRegularExpression('[0-9]{1,5}(\\.[0-9]{0,3})?'), self)
+
+        self.source_dict = {0: ('Puerto Serial', 'Serial Port'), 1: ('UDP', 'UDP'), 2: ('Archivo', 'File')}
+
+        self.live_data = None
+
+        # ----------------
+        # Generación de UI
+        # ----------------
+        width = 304
+        height = 292
+        screen_x = int(self.screen().availableGeometry().width() / 2 - (width / 2))
+        screen_y = int(self.screen().availableGeometry().height() / 2 - (height / 2))
+
+        if self.language_value == 0: self.setWindowTitle('Adquisición en Vivo')
+        elif self.language_value == 1: self.setWindowTitle('Live Acquisition')
+        self.setGeometry(screen_x, screen_y, width, height)
+        self.setMinimumSize(width, height)
+        self.setMaximumSize(width, height)
+        self.setModal(True)
+        self.setObjectName('object_live')
+        if self.theme_value:
+            self.setStyleSheet(f'QWidget#object_live {{ background-color: #E5E9F0;'
+                f'color: #000000 }}')
+        else:
+            self.setStyleSheet(f'QWidget#object_live {{ background-color: #3B4253;'
+                f'color: #E5E9F0 }}')
+
+
+        self.live_card = mt3.Card(self, 'live_card', (8, 8, width-16, height-16),
+            ('Fuente de Datos', 'Data Source'), self.theme_value, self.language_value)
+
+        y, w = 48, width - 32
+        self.source_menu = mt3.Menu(self.live_card, 'source_menu',
+            (8, y, w), 3, 3, self.source_dict, self.theme_value, self.language_value)
+        self.source_menu.setCurrentIndex(int(self.settings.value('live_source', 2)))
+
+        y += 48
+        self.address_text = mt3.TextField(self.live_card,
+            (8, y, w), ('Dirección', 'Address'), self.theme_value, self.language_value)
+        self.address_text.text_field.setText(self.settings.value('live_address', ''))
+
+        y += 60
+        self.fs_text = mt3.TextField(self.live_card,
+            (8, y, w), ('Frecuencia de Muestreo (Hz)', 'Sampling Frequency (Hz)'), self.theme_value, self.language_value)
+        self.fs_text.text_field.setValidator(self.regExp1)
+        self.fs_text.text_field.setText(self.settings.value('live_fs', '100'))
+
+        y += 68
+        self.aceptar_button = mt3.TextButton(self.live_card, 'aceptar_button',
+            (w-200, y, 100), ('Aceptar', 'Ok'), 'done.png', self.theme_value, self.language_value)
+        self.aceptar_button.clicked.connect(self.on_aceptar_button_clicked)
+
+        self.cancelar_button = mt3.TextButton(self.live_card, 'cancelar_button',
+            (w-92, y, 100), ('Cancelar', 'Cancel'), 'close.png', self.theme_value, self.language_value)
+        self.cancelar_button.clicked.connect(self.on_cancelar_button_clicked)
+
+    # ---------
+    # Funciones
+    # ---------
+    def on_aceptar_button_clicked(self):
+        """ Save live source information in settings file """
+        try:
+            fs = float(self.fs_text.text_field.text())
+        except ValueError:
+            fs = 0
+
+        if self.source_menu.currentIndex() < 0 or self.address_text.text_field.text() == '' or not (math.isfinite(fs) and fs > 0):
+
+            if self.language_value == 0:
+                QtWidgets.QMessageBox.critical(self, 'Error en el Formulario', 'Hace falta información de la fuente de datos')
+            elif self.language_value == 1:
+                QtWidgets.QMessageBox.critical(self, 'Form Error', 'Data source information is missing')
+        else:
+            self.live_data = {
+                'source': self.source_menu.currentIndex(),
+                'address': self.address_text.text_field.text(),
+                'fs': fs
+            }
+
+            self.settings.setValue('live_source', str(self.live_data['source']))
+            self.settings.setValue('live_address', self.live_data['address'])
+            self.settings.setValue('live_fs', self.fs_text.text_field.text())
+
+            self.settings.sync()
+
+            self.close()
+
+    def on_cancelar_button_clicked(self):
+        """ Close dialog window without saving """
+        self.close()
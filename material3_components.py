@@ -997,6 +997,81 @@ class Menu(QtWidgets.QComboBox):
             if language == 0:   self.setItemText(key, value[0])
             elif language == 1: self.setItemText(key, value[1])
 
+# ------------
+# Search Field
+# ------------
+class SearchField(QtWidgets.QLineEdit):
+    def __init__(self, parent, name: str, geometry: tuple, labels: tuple, theme: bool, language: int) -> None:
+        """ Material Design 3 Component: Search Field
+
+        Line edit with a popup of suggestions, set with set_suggestions
+
+        Parameters
+        ----------
+        name: str
+            Widget name
+        geometry: tuple
+            Search Field position and width
+            (x, y, w) -> x, y: upper left corner, w: width
+        labels: tuple
+            Search Field placeholder text
+            (label_es, label_en) -> label_es: label in spanish, label_en: label in english
+        theme: bool
+            App theme
+            True: Light theme, False: Dark theme
+        language: int
+            App language
+            0: Spanish, 1: English
+        
+        Returns
+        -------
+        None
+        """
+        super(SearchField, self).__init__(parent)
+
+        self.name = name
+        self.label_es, self.label_en = labels
+        x, y, w = geometry
+
+        self.setObjectName(self.name)
+        self.setGeometry(x, y, w, 32)
+        self.setClearButtonEnabled(True)
+
+        self.suggestions = QtCore.QStringListModel(self)
+        self.search_completer = QtWidgets.QCompleter(self.suggestions, self)
+        self.search_completer.setCompletionMode(QtWidgets.QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self.search_completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.setCompleter(self.search_completer)
+
+        self.apply_styleSheet(theme)
+        self.language_text(language)
+
+    def set_suggestions(self, suggestions: list) -> None:
+        """ Show the suggestions popup, hidden if there are none """
+        self.suggestions.setStringList(suggestions)
+        if suggestions and self.hasFocus():
+            self.search_completer.complete()
+        else:
+            self.search_completer.popup().hide()
+
+    def apply_styleSheet(self, theme: bool) -> None:
+        """ Apply theme style sheet to component """
+        if theme:
+            background_color = light["surface"]
+            color = light["on_surface"]
+        else:
+            background_color = dark["surface"]
+            color = dark["on_surface"]
+        self.setStyleSheet(f'QLineEdit#{self.name} {{ border: 1px solid {color}; border-radius: 4;'
+                f'padding: 0 8 0 8; background-color: {background_color}; color: {color} }}')
+        self.search_completer.popup().setStyleSheet(f'QListView {{ border: 1px solid {color};'
+                f'border-radius: 4; background-color: {background_color}; color: {color} }}')
+
+    def language_text(self, language: int) -> None:
+        """ Change language of placeholder text """
+        if language == 0:   self.setPlaceholderText(self.label_es)
+        elif language == 1: self.setPlaceholderText(self.label_en)
+
 # ------
 # Slider
 # ------
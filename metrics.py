@@ -0,0 +1,579 @@
+"""
+Metrics
+
+This file contains the registry of balance metrics and the engine that
+evaluates them.
+
+Every metric declares the names of its inputs (signals, means,
+differences, hull and other intermediates, which are registered the same
+way) and the engine computes only the nodes needed by the requested
+metrics, sharing intermediates between them. Nodes marked as batched
+receive the inputs of all dataframes at once, so analyses such as the
+spectral or convex hull ones keep running as a single call for all feet
+and studies. Results are memoized by signal content hash, metric versions
+and parameters in CACHE.
+
+Usage:
+    results = metrics.evaluate(df, ['lat_rms', 'hull_area'])
+    left, center, right = metrics.evaluateMany([left_df, center_df, right_df], metrics.GROUPS['standard'])
+"""
+
+import os
+import pickle
+import zlib
+import numpy as np
+from collections import OrderedDict
+from hashlib import blake2b
+from operator import itemgetter
+from pathlib import Path
+
+import backend
+
+# Root inputs, given by the caller or taken from these defaults
+PARAMETERS = {
+    'fs': 10,
+    'radius': 2.5,
+    'cog_window': 1.0,
+    'scales': 10
+}
+
+
+class Metric:
+    def __init__(self, name: str, inputs: tuple, function, version: int = 1, batched: bool = False) -> None:
+        """ Node of the metrics dependency graph
+
+        Parameters
+        ----------
+        name: str
+            Metric or intermediate name
+        inputs: tuple
+            Names of the nodes or parameters passed to function
+        function: callable
+            Computation from the input values
+        version: int
+            Algorithm version, increased when the formula changes
+        batched: bool
+            Function receives lists of input values of all dataframes
+            (parameters stay scalar) and returns a list of values
+        """
+        self.name = name
+        self.inputs = inputs
+        self.function = function
+        self.version = version
+        self.batched = batched
+
+
+REGISTRY = {}
+
+
+def register(name: str, inputs: tuple, version: int = 1, batched: bool = False):
+    """ Decorator adding a function to the registry """
+    def decorator(function):
+        REGISTRY[name] = Metric(name, tuple(inputs), function, version, batched)
+        return function
+    return decorator
+
+
+def register_keys(source: str, keys: tuple, version: int = 1) -> None:
+    """ Register each key of a dictionary node as a metric """
+    for key in keys:
+        REGISTRY[key] = Metric(key, (source,), itemgetter(key), version)
+
+
+# -----
+# Motor
+# -----
+def dependencies(names: list) -> list:
+    """ Nodes needed by the requested names in evaluation order
+
+    Parameters
+    ----------
+    names: list
+        Requested metric names
+
+    Returns
+    -------
+    order: list
+        Node names, each one after all of its inputs
+    """
+    order = []
+    visited = set()
+
+    def visit(name: str, path: tuple) -> None:
+        if name in visited or name in PARAMETERS or name == 'df':
+            return
+        if name in path:
+            raise ValueError(f'Circular metric dependency: {" -> ".join(path + (name,))}')
+        if name not in REGISTRY:
+            raise KeyError(f'Unknown metric: {name}')
+        for input_name in REGISTRY[name].inputs:
+            visit(input_name, path + (name,))
+        visited.add(name)
+        order.append(name)
+
+    for name in names:
+        visit(name, ())
+
+    return order
+
+
+def settingsName(preprocessing: str = '', **parameters) -> str:
+    """ Description of the settings stored with the metrics: the
+        preprocess (backend.preprocessingName) followed by the values of
+        PARAMETERS different from the defaults
+
+    Returns
+    -------
+    name: str
+        e.g. 'lowpass=2/4;radius=5', '' for unfiltered signals analyzed
+        with the defaults
+    """
+    steps = [preprocessing] if preprocessing else []
+    steps += [f'{name}={float(value):g}' for name, value in sorted(parameters.items())
+              if float(value) != float(PARAMETERS[name])]
+    return ';'.join(steps)
+
+
+def metricVersion(name: str, preprocessing: str = '') -> int:
+    """ Version of a metric including its dependencies, so it increases
+        when the formula of any node it depends on changes
+
+    Parameters
+    ----------
+    name: str
+        Metric name
+    preprocessing: str
+        Settings of the results (settingsName). Results of filtered signals
+        or other parameters get a version offset by a checksum of the
+        settings, so rows computed with other settings are stale; '' keeps
+        the plain version
+
+    Returns
+    -------
+    version: int
+        Version below 2**31 (INTEGER column)
+    """
+    version = sum(REGISTRY[node].version for node in dependencies([name]))
+    if preprocessing:
+        version += 1024 * (zlib.crc32(preprocessing.encode()) % 2**20 + 1)
+    return version
+
+
+def _evaluate(dfs: list, names: list, parameters: dict) -> list:
+    """ Evaluation of the dependency graph without cache """
+    contexts = [{'df': df} for df in dfs]
+
+    for name in dependencies(names):
+        metric = REGISTRY[name]
+        if metric.batched:
+            args = [parameters[i] if i in parameters else [context[i] for context in contexts]
+                for i in metric.inputs]
+            for context, value in zip(contexts, metric.function(*args)):
+                context[name] = value
+        else:
+            for context in contexts:
+                context[name] = metric.function(*[parameters[i] if i in parameters else context[i]
+                    for i in metric.inputs])
+
+    return [{name: context[name] for name in names} for context in contexts]
+
+
+def evaluateMany(dfs: list, names: list, use_cache: bool = True, **parameters) -> list:
+    """ Evaluation of the requested metrics of many dataframes
+
+    Results found in CACHE for the same signals, metric versions and
+    parameters are not computed again.
+
+    Parameters
+    ----------
+    dfs: list
+        Pandas dataframes converted from balance signal data from file
+        (e.g. left, center and right foot of a study)
+    names: list
+        Requested metric names
+    use_cache: bool
+        Look up and store results in CACHE (if it is not None)
+    parameters:
+        Values of PARAMETERS different from the defaults
+
+    Returns
+    -------
+    results: list
+        Dictionary by dataframe with the requested metrics
+    """
+    parameters = {**PARAMETERS, **parameters}
+    cache = CACHE if use_cache else None
+    if cache is None:
+        return _evaluate(dfs, names, parameters)
+
+    fingerprints = {name: fingerprint(name, parameters) for name in names}
+    digests = [signalHash(df) for df in dfs]
+    results = [{} for _ in dfs]
+    for result, digest in zip(results, digests):
+        for name in names:
+            value = cache.get(f'{digest}-{fingerprints[name]}', _MISSING)
+            if value is not _MISSING:
+                result[name] = value
+
+    pending = [i for i, result in enumerate(results) if len(result) < len(names)]
+    if pending:
+        missing = [name for name in names if any(name not in results[i] for i in pending)]
+        computed = _evaluate([dfs[i] for i in pending], missing, parameters)
+        for i, values in zip(pending, computed):
+            for name, value in values.items():
+                if name not in results[i]:
+                    results[i][name] = value
+                    cache.set(f'{digests[i]}-{fingerprints[name]}', value)
+
+    return [{name: result[name] for name in names} for result in results]
+
+
+def evaluate(df, names: list, use_cache: bool = True, **parameters) -> dict:
+    """ Evaluation of the requested metrics of a dataframe """
+    return evaluateMany([df], names, use_cache, **parameters)[0]
+
+
+# -----
+# Caché
+# -----
+_MISSING = object()
+
+
+class ResultCache:
+    def __init__(self, maxsize: int = 4096, directory: str = None) -> None:
+        """ Metric results by key with a least recently used memory tier
+            and an optional directory tier that persists between sessions
+
+        Parameters
+        ----------
+        maxsize: int
+            Maximum number of results kept in memory
+        directory: str
+            Directory of the disk tier (memory only if None)
+        """
+        self.maxsize = maxsize
+        self.directory = Path(directory) if directory else None
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / f'{key}.pkl'
+
+    def get(self, key: str, default=None):
+        """ Result of key from memory, then from disk """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        if self.directory is not None:
+            try:
+                with open(self.path(key), 'rb') as file:
+                    value = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+            else:
+                self.hits += 1
+                self._remember(key, value)
+                return value
+        self.misses += 1
+        return default
+
+    def set(self, key: str, value) -> None:
+        """ Store result in memory and, if configured, on disk """
+        self._remember(key, value)
+        if self.directory is not None:
+            path = self.path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                temporary = path.with_suffix(f'.{os.getpid()}.tmp')
+                with open(temporary, 'wb') as file:
+                    pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temporary, path)
+            except OSError:
+                pass
+
+    def _remember(self, key: str, value) -> None:
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def clear(self) -> None:
+        """ Empty the memory tier (the disk tier is kept) """
+        self.memory.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.memory), 'maxsize': self.maxsize,
+            'directory': str(self.directory) if self.directory else None}
+
+
+CACHE = ResultCache()
+
+
+def signalHash(df) -> str:
+    """ Content hash of the lateral and antero-posterior signals and index """
+    values = np.ascontiguousarray(df.iloc[:,:2].to_numpy(dtype=float))
+    digest = blake2b(digest_size=16)
+    digest.update(np.asarray(values.shape, dtype=np.int64).tobytes())
+    digest.update(values.tobytes())
+    digest.update(np.ascontiguousarray(df.index.to_numpy(dtype=float)).tobytes())
+    return digest.hexdigest()
+
+
+def fingerprint(name: str, parameters: dict) -> str:
+    """ Hash of the versions of a metric and its dependencies and of the
+        parameters it uses, so results are invalidated when any of them
+        changes
+    """
+    nodes = dependencies([name])
+    used = sorted({i for node in nodes for i in REGISTRY[node].inputs if i in parameters})
+    text = (';'.join(f'{node}@{REGISTRY[node].version}' for node in nodes) + '|' +
+        ';'.join(f'{i}={float(parameters[i])!r}' for i in used))
+    return blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+# -----------
+# Intermedios
+# -----------
+@register('x', ('df',))
+def _x(df):
+    return df.iloc[:,0]
+
+
+@register('y', ('df',))
+def _y(df):
+    return df.iloc[:,1]
+
+
+@register('n', ('df',))
+def _n(df):
+    return len(df)
+
+
+@register('duration', ('n', 'fs'))
+def _duration(n, fs):
+    return n / fs
+
+
+@register('mean_x', ('x', 'n'))
+def _mean_x(x, n):
+    return x.sum() / n
+
+
+@register('mean_y', ('y', 'n'))
+def _mean_y(y, n):
+    return y.sum() / n
+
+
+@register('dx', ('x',))
+def _dx(x):
+    return np.abs(np.diff(x.to_numpy(dtype=float)))
+
+
+@register('dy', ('y',))
+def _dy(y):
+    return np.abs(np.diff(y.to_numpy(dtype=float)))
+
+
+@register('step', ('dx', 'dy'))
+def _step(dx, dy):
+    return np.sqrt(dx * dx + dy * dy)
+
+
+# -----------------
+# Métricas Estándar
+# -----------------
+@register('lat_max', ('x',))
+def _lat_max(x):
+    return x.max()
+
+
+@register('lat_min', ('x',))
+def _lat_min(x):
+    return x.min()
+
+
+@register('lat_t_max', ('x', 'fs'))
+def _lat_t_max(x, fs):
+    return x.idxmax() / fs
+
+
+@register('lat_t_min', ('x', 'fs'))
+def _lat_t_min(x, fs):
+    return x.idxmin() / fs
+
+
+@register('ap_max', ('y',))
+def _ap_max(y):
+    return y.max()
+
+
+@register('ap_min', ('y',))
+def _ap_min(y):
+    return y.min()
+
+
+@register('ap_t_max', ('y', 'fs'))
+def _ap_t_max(y, fs):
+    return y.idxmax() / fs
+
+
+@register('ap_t_min', ('y', 'fs'))
+def _ap_t_min(y, fs):
+    return y.idxmin() / fs
+
+
+@register('lat_rango', ('lat_max', 'lat_min'))
+def _lat_rango(lat_max, lat_min):
+    return lat_max - lat_min
+
+
+@register('ap_rango', ('ap_max', 'ap_min'))
+def _ap_rango(ap_max, ap_min):
+    return ap_max - ap_min
+
+
+@register('lat_vel', ('dx', 'n', 'fs'))
+def _lat_vel(dx, n, fs):
+    return dx.sum() * fs / (n - 1)
+
+
+@register('ap_vel', ('dy', 'n', 'fs'))
+def _ap_vel(dy, n, fs):
+    return dy.sum() * fs / (n - 1)
+
+
+@register('lat_rms', ('x', 'mean_x', 'n'))
+def _lat_rms(x, mean_x, n):
+    return np.sqrt(((x - mean_x) * (x - mean_x)).sum() / (n - 1))
+
+
+@register('ap_rms', ('y', 'mean_y', 'n'))
+def _ap_rms(y, mean_y, n):
+    return np.sqrt(((y - mean_y) * (y - mean_y)).sum() / (n - 1))
+
+
+@register('centro_vel', ('step', 'duration'))
+def _centro_vel(step, duration):
+    return step.sum() / duration
+
+
+@register('centro_dist', ('x', 'y', 'duration'))
+def _centro_dist(x, y, duration):
+    return np.sqrt(x * x + y * y).sum() / duration
+
+
+@register('centro_frec', ('centro_vel',))
+def _centro_frec(centro_vel):
+    return centro_vel / (2 * np.pi)
+
+
+# -----
+# Áreas
+# -----
+@register('elipse', ('df',))
+def _elipse(df):
+    return backend.ellipseStandard(df)
+
+
+@register('hull', ('df',), batched=True)
+def _hull(dfs):
+    hulls = backend.convexHullBatch(dfs, vertices=True)
+    results = []
+    for df, area, vertices in zip(dfs, hulls['area'], hulls['vertices']):
+        points = df.iloc[:,:2].to_numpy(dtype=float)[vertices]
+        results.append({'x': points[:,0], 'y': points[:,1], 'area': area})
+    return results
+
+
+@register('pca', ('df',))
+def _pca(df):
+    return backend.ellipsePCA(df)
+
+
+@register('elipse_area', ('elipse',))
+def _elipse_area(elipse):
+    return elipse['area']
+
+
+@register('hull_area', ('hull',))
+def _hull_area(hull):
+    return hull['area']
+
+
+@register('pca_area', ('pca',))
+def _pca_area(pca):
+    return pca['area']
+
+
+# ------------------
+# Análisis Avanzados
+# ------------------
+@register('spectral', ('df', 'fs'), batched=True)
+def _spectral(dfs, fs):
+    return backend.spectralFeatures(dfs, fs)
+
+
+register_keys('spectral', [f'{axis}_{key}' for axis in ('lat', 'ap')
+    for key in ('f50', 'f95', 'power', *(f'{band}_ratio' for band in backend.SPECTRAL_BANDS))])
+
+
+def _multiscale_entropy(signal, scales):
+    return backend.multiscaleEntropy(signal.to_numpy(dtype=float), scales)
+
+
+def _sample_entropy(signal):
+    return backend.sampleEntropy(signal.to_numpy(dtype=float))
+
+
+for _axis, _signal in (('lat', 'x'), ('ap', 'y')):
+    register(f'{_axis}_mse', (_signal, 'scales'))(_multiscale_entropy)
+    register(f'{_axis}_sampen', (_signal,))(_sample_entropy)
+    REGISTRY[f'{_axis}_ci'] = Metric(f'{_axis}_ci', (f'{_axis}_mse',), itemgetter('ci'))
+
+
+@register('diffusion', ('df', 'fs'), batched=True)
+def _diffusion(dfs, fs):
+    return backend.diffusionAnalysis(dfs, fs)
+
+
+register_keys('diffusion', [f'{axis}_{key}' for axis in ('lat', 'ap', 'centro')
+    for key in ('ds', 'dl', 'tc', 'msd_c')])
+
+
+@register('density', ('df', 'radius', 'fs'), batched=True)
+def _density(dfs, radius, fs):
+    return backend.swayDensityFeatures(dfs, radius, fs)
+
+
+register_keys('density', ('sd_peak', 'sd_distance', 'sd_time'))
+
+
+@register('rambling', ('df', 'fs', 'cog_window'), batched=True)
+def _rambling(dfs, fs, cog_window):
+    return backend.ramblingTremblingFeatures(dfs, fs, cog_window)
+
+
+register_keys('rambling', [f'{axis}_{key}' for axis in ('lat', 'ap')
+    for key in ('rambling_rms', 'trembling_rms', 'iep_rate')])
+
+
+# ------
+# Grupos
+# ------
+GROUPS = {
+    'standard': ['lat_max', 'lat_t_max', 'lat_min', 'lat_t_min', 'ap_max', 'ap_t_max', 'ap_min', 'ap_t_min',
+        'lat_rango', 'ap_rango', 'lat_vel', 'lat_rms', 'ap_vel', 'ap_rms', 'centro_vel', 'centro_dist', 'centro_frec'],
+    'area': ['elipse_area', 'hull_area', 'pca_area'],
+    'spectral': [name for name, metric in REGISTRY.items() if metric.inputs == ('spectral',)],
+    'entropy': ['lat_sampen', 'lat_ci', 'ap_sampen', 'ap_ci'],
+    'diffusion': [name for name, metric in REGISTRY.items() if metric.inputs == ('diffusion',)],
+    'density': ['sd_peak', 'sd_distance', 'sd_time'],
+    'rambling': [name for name, metric in REGISTRY.items() if metric.inputs == ('rambling',)]
+}
+
+# Scalar metrics stored in the database
+PERSISTED = [name for group in GROUPS.values() for name in group]
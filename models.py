@@ -0,0 +1,165 @@
+"""
+Models
+
+This file contains the item models of the patients and studies menus.
+
+Rows are read from the database by keyset pages (the id of the last row
+loaded is the start of the next page) when the view asks for them with
+canFetchMore/fetchMore, so the menus only hold the rows the user scrolled
+through and startup does not depend on the size of the tables.
+
+Usage:
+    patients_model = models.PatientModel(parent)
+    menu.setModel(patients_model)
+    patients_model.reset()
+"""
+
+from PyQt6 import QtCore
+from PyQt6.QtCore import Qt
+
+import backend
+
+PAGE_SIZE = 50
+
+
+# ------------
+# Keyset Model
+# ------------
+class KeysetModel(QtCore.QAbstractListModel):
+    def __init__(self, parent=None, page_size: int = PAGE_SIZE) -> None:
+        """ List model of database rows fetched by keyset pages
+
+        Rows are named tuples with a database id. Subclasses define
+        (QObject subclasses cannot use abc.ABCMeta, so the base class has
+        no stubs):
+
+            fetch_page(after: int, limit: int) -> list
+                At most limit rows whose database id follows after, in id
+                order
+            text(row) -> str
+                Text of a row in the view
+
+        Parameters
+        ----------
+        page_size: int
+            Rows by database round trip
+
+        Returns
+        -------
+        None
+        """
+        super(KeysetModel, self).__init__(parent)
+
+        self.page_size = page_size
+        self.rows = []
+        self.ids = set()
+        self.after = 0
+        self.more = False
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index: QtCore.QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.rows):
+            return None
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return self.text(self.rows[index.row()])
+        if role == Qt.ItemDataRole.UserRole:
+            return self.rows[index.row()]
+        return None
+
+    def canFetchMore(self, parent: QtCore.QModelIndex) -> bool:
+        return not parent.isValid() and self.more
+
+    def fetchMore(self, parent: QtCore.QModelIndex) -> None:
+        """ Append the next page. Rows already added with append_row are
+            skipped
+        """
+        if parent.isValid() or not self.more:
+            return
+        page = self.fetch_page(self.after, self.page_size)
+        self.more = len(page) == self.page_size
+        if page:
+            self.after = page[-1].id
+        page = [row for row in page if row.id not in self.ids]
+        if page:
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.ids.update(row.id for row in page)
+            self.endInsertRows()
+
+    def reset(self, fetch: bool = True) -> None:
+        """ Drop the loaded rows and load the first page (none if fetch is
+            False)
+        """
+        self.beginResetModel()
+        self.rows, self.ids, self.after, self.more = [], set(), 0, fetch
+        self.endResetModel()
+        self.fetchMore(QtCore.QModelIndex())
+
+    def row(self, index: int):
+        """ Row at a view index, None if there is none """
+        return self.rows[index] if 0 <= index < len(self.rows) else None
+
+    def find(self, text: str) -> int:
+        """ View index of the loaded row with a text, -1 if not loaded """
+        for index, row in enumerate(self.rows):
+            if self.text(row) == text:
+                return index
+        return -1
+
+    def append_row(self, row) -> int:
+        """ Add a row after the loaded ones and return its view index """
+        self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows))
+        self.rows.append(row)
+        self.ids.add(row.id)
+        self.endInsertRows()
+        return len(self.rows) - 1
+
+    def replace_row(self, index: int, row) -> None:
+        """ Replace the row at a view index """
+        self.ids.discard(self.rows[index].id)
+        self.rows[index] = row
+        self.ids.add(row.id)
+        self.dataChanged.emit(self.index(index), self.index(index))
+
+    def remove_row(self, index: int) -> None:
+        """ Remove the row at a view index """
+        self.beginRemoveRows(QtCore.QModelIndex(), index, index)
+        self.ids.discard(self.rows.pop(index).id)
+        self.endRemoveRows()
+
+
+# -------------
+# Patient Model
+# -------------
+class PatientModel(KeysetModel):
+    """ Patients in insertion order, shown by id number """
+
+    def fetch_page(self, after: int, limit: int) -> list:
+        return backend.get_page('pacientes', after, limit)
+
+    def text(self, row) -> str:
+        return str(row.id_number)
+
+
+# -----------
+# Study Model
+# -----------
+class StudyModel(KeysetModel):
+    """ Studies of a patient in insertion order, shown by file name """
+
+    def __init__(self, parent=None, page_size: int = PAGE_SIZE) -> None:
+        super(StudyModel, self).__init__(parent, page_size)
+        self.id_number = None
+
+    def set_patient(self, id_number) -> None:
+        """ Show the studies of a patient, none if id_number is None """
+        self.id_number = id_number
+        self.reset(id_number is not None)
+
+    def fetch_page(self, after: int, limit: int) -> list:
+        return backend.get_page('estudios', after, limit, self.id_number)
+
+    def text(self, row) -> str:
+        return str(row.file_name)
@@ -37,6 +37,50 @@ import math
 
 import material3_components as mt3
 
+WEIGHT_UNITS = ('Kg', 'Lb')
+HEIGHT_UNITS = ('m', 'ft - in')
+
+
+# ---
+# IMC
+# ---
+def weight_kg(weight: float, weight_unit: str) -> float:
+    """ Weight in kilograms from a value in Kg or Lb """
+    return float(weight) * 0.454 if weight_unit == 'Lb' else float(weight)
+
+
+def height_m(height: float, height_unit: str) -> float:
+    """ Height in meters from a value in m or ft - in (5.09: 5 ft, 9 in) """
+    if height_unit == 'ft - in':
+        height_ft = math.floor(float(height))
+        height_in = (float(height) - height_ft) * 100
+        return ((height_ft * 12) + height_in) * 2.54 / 100
+    return float(height)
+
+
+def body_mass_index(weight: float, weight_unit: str, height: float, height_unit: str) -> float:
+    """ Body mass index from weight and height values and units
+
+    Parameters
+    ----------
+    weight: float
+        Weight value
+    weight_unit: str
+        Kg or Lb
+    height: float
+        Height value
+    height_unit: str
+        m or ft - in
+
+    Returns
+    -------
+    bmi: float
+        Body mass index in kg/m²
+    """
+    altura_m = height_m(height, height_unit)
+    return weight_kg(weight, weight_unit) / (altura_m * altura_m)
+
+
 class Patient(QtWidgets.QDialog):
     def __init__(self):
         """ UI Patient dialog class """
@@ -230,18 +274,7 @@ class Patient(QtWidgets.QDialog):
         if self.lb_button.isChecked():
             self.lb_button.set_state(False)
 
-        if self.peso_text.text_field.text() != '' and self.altura_text.text_field.text() != '':
-            if (self.mt_button.isChecked() or self.fi_button.isChecked()):
-                altura_m = 0.0
-                if self.mt_button.isChecked():
-                    altura_m = float(self.altura_text.text_field.text())
-                elif self.fi_button.isChecked():
-                    altura_ft = math.floor(float(self.altura_text.text_field.text()))
-                    altura_in = (float(self.altura_text.text_field.text()) - altura_ft) * 100
-                    altura_m = ((altura_ft * 12) + altura_in) * 2.54 / 100
-
-                bmi_value = float(self.peso_text.text_field.text()) / (altura_m * altura_m)
-                self.bmi_value_label.setText(f'{bmi_value:.1f}')
+        self.update_bmi()
 
 
     def on_lb_button_clicked(self) -> None:
@@ -251,18 +284,7 @@ class Patient(QtWidgets.QDialog):
         if self.kg_button.isChecked():
             self.kg_button.set_state(False)
 
-        if self.peso_text.text_field.text() != '' and self.altura_text.text_field.text() != '':
-            if (self.mt_button.isChecked() or self.fi_button.isChecked()):
-                altura_m = 0.0
-                if self.mt_button.isChecked():
-                    altura_m = float(self.altura_text.text_field.text())
-                elif self.fi_button.isChecked():
-                    altura_ft = math.floor(float(self.altura_text.text_field.text()))
-                    altura_in = (float(self.altura_text.text_field.text()) - altura_ft) * 100
-                    altura_m = ((altura_ft * 12) + altura_in) * 2.54 / 100
-
-                bmi_value = float(self.peso_text.text_field.text()) * 0.454 / (altura_m * altura_m)
-                self.bmi_value_label.setText(f'{bmi_value:.1f}')
+        self.update_bmi()
 
 
     def on_mt_button_clicked(self) -> None:
@@ -272,16 +294,7 @@ class Patient(QtWidgets.QDialog):
         if self.fi_button.isChecked():
             self.fi_button.set_state(False)
 
-        if self.peso_text.text_field.text() != '' and self.altura_text.text_field.text() != '':
-            if (self.kg_button.isChecked() or self.lb_button.isChecked()):
-                peso_kg = 0.0
-                if self.kg_button.isChecked():
-                    peso_kg = float(self.peso_text.text_field.text())
-                elif self.lb_button.isChecked():
-                    peso_kg = float(self.peso_text.text_field.text()) * 0.454
-
-                bmi_value = peso_kg / (float(self.altura_text.text_field.text()) * float(self.altura_text.text_field.text()))
-                self.bmi_value_label.setText(f'{bmi_value:.1f}')
+        self.update_bmi()
 
 
     def on_fi_button_clicked(self) -> None:
@@ -291,72 +304,36 @@ class Patient(QtWidgets.QDialog):
         if self.mt_button.isChecked():
             self.mt_button.set_state(False)
 
-        if self.peso_text.text_field.text() != '' and self.altura_text.text_field.text() != '':
-            if (self.kg_button.isChecked() or self.lb_button.isChecked()):
-                peso_kg = 0.0
-                if self.kg_button.isChecked():
-                    peso_kg = float(self.peso_text.text_field.text())
-                elif self.lb_button.isChecked():
-                    peso_kg = float(self.peso_text.text_field.text()) * 0.454
-
-                altura_ft = math.floor(float(self.altura_text.text_field.text()))
-                altura_in = (float(self.altura_text.text_field.text()) - altura_ft) * 100
-                altura_m = ((altura_ft * 12) + altura_in) * 2.54 / 100
-
-                bmi_value = peso_kg / (altura_m * altura_m)
-                self.bmi_value_label.setText(f'{bmi_value:.1f}')
+        self.update_bmi()
 
 
     def on_peso_text_textEdited(self) -> None:
         """ Weight value to calculate BMI """
-        if self.peso_text.text_field.text() != '' and self.altura_text.text_field.text() != '':
-            bmi_value = 0.0
-            
-            if (self.kg_button.isChecked() or self.lb_button.isChecked()):
-                peso_kg = 0.0
-                if self.kg_button.isChecked():
-                    peso_kg = float(self.peso_text.text_field.text())
-                elif self.lb_button.isChecked():
-                    peso_kg = float(self.peso_text.text_field.text()) * 0.454
-                bmi_value = peso_kg
-
-            if (self.mt_button.isChecked() or self.fi_button.isChecked()):
-                altura_m = 0.0
-                if self.mt_button.isChecked():
-                    altura_m = float(self.altura_text.text_field.text())
-                elif self.fi_button.isChecked():
-                    altura_ft = math.floor(float(self.altura_text.text_field.text()))
-                    altura_in = (float(self.altura_text.text_field.text()) - altura_ft) * 100
-                    altura_m = ((altura_ft * 12) + altura_in) * 2.54 / 100
-                bmi_value = bmi_value / (altura_m * altura_m)
-
-            self.bmi_value_label.setText(f'{bmi_value:.1f}')
+        self.update_bmi()
 
 
     def on_altura_text_textEdited(self) -> None:
         """ Height value to calculate BMI """
-        if self.peso_text.text_field.text() != '' and self.altura_text.text_field.text() != '':
-            bmi_value = 0.0
-            
-            if (self.kg_button.isChecked() or self.lb_button.isChecked()):
-                peso_kg = 0.0
-                if self.kg_button.isChecked():
-                    peso_kg = float(self.peso_text.text_field.text())
-                elif self.lb_button.isChecked():
-                    peso_kg = float(self.peso_text.text_field.text()) * 0.454
-                bmi_value = peso_kg
-
-            if (self.mt_button.isChecked() or self.fi_button.isChecked()):
-                altura_m = 0.0
-                if self.mt_button.isChecked():
-                    altura_m = float(self.altura_text.text_field.text())
-                elif self.fi_button.isChecked():
-                    altura_ft = math.floor(float(self.altura_text.text_field.text()))
-                    altura_in = (float(self.altura_text.text_field.text()) - altura_ft) * 100
-                    altura_m = ((altura_ft * 12) + altura_in) * 2.54 / 100
-                bmi_value = bmi_value / (altura_m * altura_m)
-
-            self.bmi_value_label.setText(f'{bmi_value:.1f}')
+        self.update_bmi()
+
+
+    def update_bmi(self) -> None:
+        """ BMI from the weight and height values once both units are selected """
+        if self.peso_text.text_field.text() == '' or self.altura_text.text_field.text() == '':
+            return
+        if not (self.kg_button.isChecked() or self.lb_button.isChecked()):
+            return
+        if not (self.mt_button.isChecked() or self.fi_button.isChecked()):
+            return
+
+        weight_unit = 'Kg' if self.kg_button.isChecked() else 'Lb'
+        height_unit = 'm' if self.mt_button.isChecked() else 'ft - in'
+        try:
+            bmi_value = body_mass_index(self.peso_text.text_field.text(), weight_unit,
+                self.altura_text.text_field.text(), height_unit)
+        except (ValueError, ZeroDivisionError):
+            return
+        self.bmi_value_label.setText(f'{bmi_value:.1f}')
 
 
     def on_aceptar_button_clicked(self) -> None:
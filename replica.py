@@ -0,0 +1,502 @@
+"""
+Replica
+
+This file contains the offline replica of the central PostgreSQL database,
+for stations whose connection to the server is unreliable: a storage engine
+with the functions of storage_sqlite over a local SQLite file that records
+every write in a change log, and the background synchronization with the
+server.
+
+Views never wait for the network: patients, studies, metrics and signals
+are read from the replica and writes are committed locally. Sync pushes the
+change log to the server and pulls the rows changed there since the last
+pull, in a thread, whenever the server answers.
+
+Conflicts are resolved by last write wins. Every patient, study, metric and
+signal row keeps the time of its last change (updated_at, UTC), and a change
+replaces the row on the other side only if it is newer. Patients and studies
+are matched by a uid given where they are created, or by id number and file
+name when both sides registered them while disconnected. Deletions are
+recorded with their time on both sides and lose against later changes.
+
+Cohort sketches are derived from the metrics and are not replicated: each
+database merges the studies it registers, and cohort.rebuild() recomputes
+them from the pulled metrics.
+
+Usage:
+    sync = replica.Sync(local_transaction, server_connection)
+    sync.start()
+"""
+
+import datetime
+import sqlite3
+import threading
+import uuid
+from collections import deque
+
+import psycopg2
+
+import storage
+import storage_sqlite
+from storage import REPLICA_COLUMNS, REPLICA_KEYS, REPLICA_ORDER
+from storage_sqlite import (connect, patients_page, get_patient, search_patients, registered_patients, get_studies,
+                            studies_page, registered_studies, get_signals, stale_metrics, patient_metrics, cohort_stats,
+                            cohort_values, get_cohort, merge_cohort, replace_cohort, _json, _value)
+
+SYNC_INTERVAL = 30.0
+SYNC_BATCH = 200
+CONFLICTS_KEPT = 100
+
+
+# -----------
+# Migraciones
+# -----------
+def migrate(cursor) -> int:
+    """ Apply the pending schema migrations of storage_sqlite and log the
+        rows written before the database was a replica, so they are pushed
+
+    Returns
+    -------
+    version: int
+        Schema version after the migrations
+    """
+    version = storage_sqlite.migrate(cursor)
+
+    for table in REPLICA_KEYS:
+        cursor.execute(f'SELECT id FROM {table} WHERE uid IS NULL')
+        _changed(cursor, table, [id_db for id_db, in cursor.fetchall()])
+    for table in ('metricas', 'senales'):
+        cursor.execute(f'SELECT DISTINCT file_name FROM {table} WHERE updated_at IS NULL')
+        file_names = [file_name for file_name, in cursor.fetchall()]
+        if file_names:
+            cursor.execute(f"""UPDATE {table} SET updated_at = ?
+                            WHERE updated_at IS NULL AND file_name IN (SELECT value FROM json_each(?))""",
+                           (_now(), _json(file_names)))
+            _log_studies(cursor, table, file_names)
+
+    return version
+
+
+# --------------
+# Log de Cambios
+# --------------
+def _now() -> str:
+    """ Current UTC time as stored in updated_at """
+    return _time(datetime.datetime.now(datetime.timezone.utc))
+
+
+def _time(value: datetime.datetime) -> str:
+    """ Time as ISO text in UTC with microseconds, ordered as text """
+    return value.astimezone(datetime.timezone.utc).isoformat(timespec='microseconds')
+
+
+def _changed(cursor, table: str, ids: list) -> None:
+    """ Stamp patients or studies by database id with the current time (and a
+        new uid if they have none) and log them
+    """
+    if not ids:
+        return
+    now = _now()
+    cursor.executemany(f'UPDATE {table} SET uid = COALESCE(uid, ?), updated_at = ? WHERE id = ?',
+                       [(str(uuid.uuid4()), now, id_db) for id_db in ids])
+    cursor.execute(f"""INSERT INTO cambios (tabla, uid)
+                    SELECT ?, uid FROM {table} WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id""",
+                   (table, _json(ids)))
+
+
+def _deleted(cursor, table: str, uid: str) -> None:
+    """ Log the deletion of a patient or study """
+    if uid is not None:
+        cursor.execute('INSERT INTO cambios (tabla, uid, deleted_at) VALUES (?, ?, ?)', (table, uid, _now()))
+
+
+def _uid(cursor, table: str, key: str, value) -> str:
+    """ uid of the patient or study with an id number or file name """
+    cursor.execute(f'SELECT uid FROM {table} WHERE {key} = ?', (value,))
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+def _log_studies(cursor, table: str, file_names: list) -> None:
+    """ Log the metrics or signals of studies by the study uid """
+    cursor.execute("""INSERT INTO cambios (tabla, uid)
+                    SELECT ?, uid FROM estudios WHERE file_name IN (SELECT value FROM json_each(?))""",
+                   (table, _json(sorted(set(file_names)))))
+
+
+# ---------
+# Pacientes
+# ---------
+def add_patient(cursor, data: dict) -> storage.Paciente:
+    """ Insert a patient, logged, and return the stored row """
+    row = storage_sqlite.add_patient(cursor, data)
+    _changed(cursor, 'pacientes', [row.id])
+    return row
+
+
+def edit_patient(cursor, id_db: int, data: dict) -> storage.Paciente:
+    """ Update a patient, logged, and return the updated row (None if
+        missing)
+    """
+    row = storage_sqlite.edit_patient(cursor, id_db, data)
+    if row is not None:
+        _changed(cursor, 'pacientes', [row.id])
+    return row
+
+
+def delete_patient(cursor, id_number) -> storage.Paciente:
+    """ Delete a patient, logged, and return the deleted row (None if
+        missing). Its studies are deleted by cascade on both sides
+    """
+    uid = _uid(cursor, 'pacientes', 'id_number', id_number)
+    row = storage_sqlite.delete_patient(cursor, id_number)
+    if row is not None:
+        _deleted(cursor, 'pacientes', uid)
+    return row
+
+
+def copy_patients(cursor, rows: list, update: bool = True) -> tuple:
+    """ Bulk load of patients as storage_sqlite.copy_patients, logging the
+        inserted and updated ones
+    """
+    inserted, updated, conflicts = storage_sqlite.copy_patients(cursor, rows, update)
+    cursor.execute('SELECT id FROM pacientes WHERE id_number IN (SELECT value FROM json_each(?))',
+                   (_json(int(id_number) for id_number in inserted + updated),))
+    _changed(cursor, 'pacientes', [id_db for id_db, in cursor.fetchall()])
+    return inserted, updated, conflicts
+
+
+# --------
+# Estudios
+# --------
+def add_study(cursor, id_number, file_name: str, file_path: str) -> storage.Estudio:
+    """ Insert a study, logged, and return the stored row """
+    row = storage_sqlite.add_study(cursor, id_number, file_name, file_path)
+    _changed(cursor, 'estudios', [row.id])
+    return row
+
+
+def add_studies(cursor, rows: list) -> list:
+    """ Insert studies as storage_sqlite.add_studies, logging the inserted
+        ones
+    """
+    inserted = storage_sqlite.add_studies(cursor, rows)
+    _changed(cursor, 'estudios', [row.id for row in inserted])
+    return inserted
+
+
+def edit_study(cursor, id_db: int, id_number, file_name: str, file_path: str) -> storage.Estudio:
+    """ Update a study, logged, and return the updated row (None if missing) """
+    row = storage_sqlite.edit_study(cursor, id_db, id_number, file_name, file_path)
+    if row is not None:
+        _changed(cursor, 'estudios', [row.id])
+    return row
+
+
+def delete_study(cursor, file_name: str) -> storage.Estudio:
+    """ Delete a study, logged, and return the deleted row (None if missing).
+        Its metrics and signals are deleted by cascade on both sides
+    """
+    uid = _uid(cursor, 'estudios', 'file_name', file_name)
+    row = storage_sqlite.delete_study(cursor, file_name)
+    if row is not None:
+        _deleted(cursor, 'estudios', uid)
+    return row
+
+
+# --------
+# Métricas
+# --------
+def insert_metrics(cursor, rows: list) -> None:
+    """ Upsert of (file_name, foot, metric, value, version, preprocessing)
+        rows, logged by study
+    """
+    storage_sqlite.insert_metrics(cursor, rows)
+    now = _now()
+    cursor.executemany('UPDATE metricas SET updated_at = ? WHERE file_name = ? AND foot = ? AND metric = ?',
+                       [(now, file_name, foot, metric) for file_name, foot, metric, *_ in rows])
+    _log_studies(cursor, 'metricas', [row[0] for row in rows])
+
+
+def insert_signals(cursor, rows: list) -> None:
+    """ Upsert of (file_name, foot, first_index, lateral, ap) rows, logged by
+        study
+    """
+    storage_sqlite.insert_signals(cursor, rows)
+    _signals_changed(cursor, rows)
+
+
+def copy_signals(cursor, rows: list) -> None:
+    """ Insert signal rows of new studies, logged by study """
+    storage_sqlite.copy_signals(cursor, rows)
+    _signals_changed(cursor, rows)
+
+
+def _signals_changed(cursor, rows: list) -> None:
+    now = _now()
+    cursor.executemany('UPDATE senales SET updated_at = ? WHERE file_name = ? AND foot = ?',
+                       [(now, row[0], row[1]) for row in rows])
+    _log_studies(cursor, 'senales', [row[0] for row in rows])
+
+
+# --------------
+# Sincronización
+# --------------
+def _order(table: str, row: tuple) -> tuple:
+    """ REPLICA_ORDER values of a pulled row """
+    if table == 'borrados':
+        return (row[1],)
+    return row[:len(REPLICA_ORDER[table])]
+
+
+class Sync:
+    def __init__(self, local, central, interval: float = SYNC_INTERVAL, batch: int = SYNC_BATCH) -> None:
+        """ Background synchronization of the replica with the server
+
+        Every cycle pushes the change log and then pulls the server changes.
+        A cycle that fails (server unreachable) is retried after the
+        interval, and the log keeps the local changes until they are pushed.
+
+        Parameters
+        ----------
+        local: callable
+            Context manager of a transaction on the replica, committed on
+            exit, with write=True for BEGIN IMMEDIATE
+            (backend._sqlite_connection)
+        central: callable
+            Context manager of a server connection, committed on exit
+            (backend._postgres_connection)
+        interval: float
+            Seconds between cycles, unless woken by a local write
+        batch: int
+            Changes by push transaction and rows by pulled page
+        """
+        self.local = local
+        self.central = central
+        self.interval = interval
+        self.batch = batch
+
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.migrated = False
+
+        self.error = None
+        self.synced_at = None
+        self.conflicts = deque(maxlen=CONFLICTS_KEPT)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            self.wake_event.clear()
+            try:
+                self.sync()
+                self.error = None
+            except (psycopg2.Error, sqlite3.Error) as err:
+                self.error = err
+            self.wake_event.wait(self.interval)
+
+    def wake(self) -> None:
+        """ Start a cycle now (after a local write) """
+        self.wake_event.set()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread:
+            self.thread.join(timeout=1)
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def pending(self) -> int:
+        """ Local changes not pushed yet """
+        with self.local() as connection:
+            return connection.execute('SELECT count(*) FROM cambios').fetchone()[0]
+
+    def sync(self) -> tuple:
+        """ Push the change log and pull the server changes
+
+        Returns
+        -------
+        pushed, pulled: tuple
+            Changes pushed and server rows applied to the replica
+        """
+        if not self.migrated:
+            with self.central() as connection:
+                storage.migrate(connection.cursor())
+            self.migrated = True
+
+        pushed = self.push()
+        pulled = self.pull()
+        self.synced_at = datetime.datetime.now(datetime.timezone.utc)
+        return pushed, pulled
+
+    # ----
+    # Push
+    # ----
+    def push(self) -> int:
+        """ Send the change log to the server by batches, each in one server
+            transaction, and remove the changes sent
+
+        The current replica row of every logged patient, study, metric or
+        signal is sent, once by batch, in the order of its first change
+        (patients before their studies). A change the server rejects
+        (conflicting keys) is dropped and kept in conflicts.
+        """
+        pushed = 0
+        while not self.stop_event.is_set():
+            with self.local() as connection:
+                cursor = connection.cursor()
+                cursor.execute('SELECT seq, tabla, uid, deleted_at FROM cambios ORDER BY seq LIMIT ?', (self.batch,))
+                entries = cursor.fetchall()
+                if not entries:
+                    break
+                changes = {}
+                for _, table, uid, deleted_at in entries:
+                    changes[(table, uid)] = deleted_at
+                changes = [(table, uid, deleted_at, self._rows(cursor, table, uid))
+                           for (table, uid), deleted_at in changes.items()]
+
+            with self.central() as connection:
+                cursor = connection.cursor()
+                for table, uid, deleted_at, rows in changes:
+                    cursor.execute('SAVEPOINT cambio')
+                    try:
+                        if table in REPLICA_KEYS and rows:
+                            storage.replicate_row(cursor, table, rows[0][:-1], rows[0][-1])
+                        elif table in REPLICA_KEYS and deleted_at is not None:
+                            storage.replicate_deletion(cursor, table, uid, deleted_at)
+                        elif table == 'metricas' and rows:
+                            storage.replicate_metrics(cursor, rows)
+                        elif table == 'senales' and rows:
+                            storage.replicate_signals(cursor, rows)
+                        cursor.execute('RELEASE SAVEPOINT cambio')
+                    except (psycopg2.IntegrityError, psycopg2.DataError) as err:
+                        cursor.execute('ROLLBACK TO SAVEPOINT cambio')
+                        self.conflicts.append((table, uid, str(err).strip()))
+
+            with self.local(write=True) as connection:
+                connection.execute('DELETE FROM cambios WHERE seq <= ?', (entries[-1][0],))
+            pushed += len(changes)
+
+        return pushed
+
+    def _rows(self, cursor, table: str, uid: str) -> list:
+        """ Replica rows of a logged change: the patient or study with its
+            updated_at (none if deleted), or the metrics or signals of a study
+        """
+        if table in REPLICA_KEYS:
+            cursor.execute(f'SELECT {REPLICA_COLUMNS[table]}, updated_at FROM {table} WHERE uid = ?', (uid,))
+        else:
+            columns = ', '.join(f't.{column}' for column in REPLICA_COLUMNS[table].split(', '))
+            cursor.execute(f"""SELECT {columns}, t.updated_at FROM {table} t
+                            JOIN estudios e ON e.file_name = t.file_name WHERE e.uid = ?""", (uid,))
+        return cursor.fetchall()
+
+    # ----
+    # Pull
+    # ----
+    def pull(self) -> int:
+        """ Apply the server rows changed since the last pull, by table and
+            in server write order, and the server deletions
+
+        The last pulled time of a table is kept below the start of the
+        server transactions still writing, so rows committed later with an
+        earlier time are pulled in the next cycle.
+        """
+        pulled = 0
+        with self.central() as connection:
+            cursor = connection.cursor()
+            horizon = _time(storage.replica_horizon(cursor))
+            for table in REPLICA_ORDER:
+                since, after = self._pulled_at(table), None
+                while not self.stop_event.is_set():
+                    rows = storage.replica_changes(cursor, table, since, after, self.batch)
+                    if not rows:
+                        break
+                    with self.local(write=True) as local:
+                        pulled += self._apply(local.cursor(), table, rows)
+                        local.execute("""INSERT INTO sincronizacion (tabla, synced_at) VALUES (?, ?)
+                                      ON CONFLICT (tabla) DO UPDATE SET synced_at = excluded.synced_at""",
+                                      (table, min(_time(rows[-1][-1]), horizon)))
+                    if len(rows) < self.batch:
+                        break
+                    since, after = rows[-1][-1], _order(table, rows[-1])
+        return pulled
+
+    def _pulled_at(self, table: str) -> str:
+        with self.local() as connection:
+            row = connection.execute('SELECT synced_at FROM sincronizacion WHERE tabla = ?', (table,)).fetchone()
+        return row[0] if row is not None else '-infinity'
+
+    def _apply(self, cursor, table: str, rows: list) -> int:
+        """ Apply a page of server rows to the replica, returning the rows
+            that changed it
+        """
+        applied = 0
+        for row in rows:
+            try:
+                if table == 'borrados':
+                    applied += self._apply_deletion(cursor, *row[:3])
+                elif table in REPLICA_KEYS:
+                    applied += self._apply_row(cursor, table, row[:-2], _time(row[-2]))
+                else:
+                    columns = REPLICA_COLUMNS[table].split(', ')
+                    key = ', '.join(columns[:2 if table == 'senales' else 3])
+                    updates = ', '.join(f'{column} = excluded.{column}' for column in columns[2:] + ['updated_at'])
+                    cursor.execute(f"""INSERT INTO {table} ({', '.join(columns)}, updated_at)
+                                    VALUES ({', '.join(['?'] * (len(columns) + 1))})
+                                    ON CONFLICT ({key}) DO UPDATE SET {updates}
+                                    WHERE {table}.updated_at IS NULL OR {table}.updated_at < excluded.updated_at""",
+                                   (*row[:-2], _time(row[-2])))
+                    applied += cursor.rowcount > 0
+            except sqlite3.IntegrityError as err:
+                # Study or patient missing (deleted here) or keys taken
+                self.conflicts.append((table, row[0], str(err)))
+        return applied
+
+    def _apply_row(self, cursor, table: str, row: tuple, updated_at: str) -> bool:
+        """ Insert or update a patient or study pulled from the server, unless
+            the replica row is newer or was deleted later
+        """
+        columns = REPLICA_COLUMNS[table].split(', ')
+        key = REPLICA_KEYS[table]
+        uid = row[0]
+        cursor.execute(f"""SELECT id, uid, updated_at FROM {table} WHERE uid = ? OR {key} = ?
+                        ORDER BY uid = ? DESC LIMIT 1""", (uid, row[columns.index(key)], uid))
+        found = cursor.fetchone()
+        values = [_value(value) for value in row]
+
+        if found is None:
+            cursor.execute('SELECT 1 FROM cambios WHERE uid = ? AND deleted_at >= ?', (uid, updated_at))
+            if cursor.fetchone() is not None:
+                return False
+            cursor.execute(f"""INSERT INTO {table} ({', '.join(columns)}, updated_at)
+                            VALUES ({', '.join(['?'] * (len(columns) + 1))})""", (*values, updated_at))
+            return True
+
+        id_db, local_uid, local_updated_at = found
+        if local_uid != uid:
+            # Registered here and on the server while disconnected: the row
+            # takes the server uid, also in the changes not pushed yet
+            cursor.execute(f'UPDATE {table} SET uid = ? WHERE id = ?', (uid, id_db))
+            cursor.execute('UPDATE cambios SET uid = ? WHERE uid = ?', (uid, local_uid))
+        if local_updated_at is not None and local_updated_at >= updated_at:
+            return False
+        cursor.execute(f"""UPDATE {table} SET ({', '.join(columns[1:])}, updated_at) = ({', '.join(['?'] * len(columns))})
+                        WHERE id = ?""", (*values[1:], updated_at, id_db))
+        return True
+
+    def _apply_deletion(self, cursor, table: str, uid: str, deleted_at) -> bool:
+        """ Delete a patient or study deleted on the server, unless the replica
+            row changed later
+        """
+        if table not in REPLICA_KEYS:
+            return False
+        cursor.execute(f'DELETE FROM {table} WHERE uid = ? AND (updated_at IS NULL OR updated_at <= ?)',
+                       (uid, _time(deleted_at)))
+        return cursor.rowcount > 0
@@ -0,0 +1,898 @@
+"""
+Storage
+
+This file contains the data-access layer of the PostgreSQL database:
+typed rows, server-side prepared statements and the queries of the stored
+metrics and cohort sketches.
+
+Every statement is prepared once by connection with PREPARE and run with
+EXECUTE, so the server parses and plans it only the first time and values
+are sent as parameters instead of being pasted into the query text.
+Functions receive a cursor, so the caller decides the transaction.
+
+Rows are named tuples: fields are read by name (patient.sex) and positional
+indexing keeps working (patient[6]).
+
+The schema is versioned: migrate() applies the pending MIGRATIONS in order
+and records them in the schema_version table.
+
+storage_sqlite has the same functions over SQLite, and backend calls the
+module of the engine configured in the settings file.
+
+Patients are searched on the server with search_patients(), backed by a
+GIN index (trigram with pg_trgm, full-text otherwise), and only a capped
+number of rows is returned.
+
+The server is also the central database of the offline replicas of
+replica.py: triggers stamp every change of the replicated tables and record
+deletions, and the replicas push and pull their changes with the Réplicas
+functions.
+
+Usage:
+    with backend.db_connection() as connection:
+        patient = storage.get_patient(connection.cursor(), 1020304050)
+"""
+
+import csv
+import datetime
+import io
+import math
+import re
+import struct
+import weakref
+from decimal import Decimal
+from typing import NamedTuple
+
+from psycopg2 import Binary
+from psycopg2.extras import execute_values
+
+
+class Paciente(NamedTuple):
+    id: int
+    last_name: str
+    first_name: str
+    id_type: str
+    id_number: int
+    birth_date: datetime.date
+    sex: str
+    weight: Decimal
+    weight_unit: str
+    height: Decimal
+    height_unit: str
+    bmi: Decimal
+
+    def birth_date_text(self) -> str:
+        """ Birth date as entered in the patient dialog (dd/mm/yyyy) """
+        return self.birth_date.strftime('%d/%m/%Y')
+
+
+class Estudio(NamedTuple):
+    id: int
+    id_number: int
+    file_name: str
+    file_path: str
+    study_date: datetime.date
+
+
+PACIENTE_COLUMNS = ', '.join(Paciente._fields)
+ESTUDIO_COLUMNS = ', '.join(Estudio._fields)
+PACIENTE_VALUES = ('last_name, first_name, id_type, id_number, birth_date, sex, weight, weight_unit, '
+                   'height, height_unit, bmi')
+PACIENTE_TYPES = ('VARCHAR', 'VARCHAR', 'CHAR(2)', 'BIGINT', 'DATE', 'CHAR(1)', 'NUMERIC', 'CHAR(2)',
+                  'NUMERIC', 'VARCHAR', 'NUMERIC')
+
+# Name: (parameter types, statement with $n parameters)
+STATEMENTS = {
+    'pacientes_page': (('INTEGER', 'INTEGER'),
+        f'SELECT {PACIENTE_COLUMNS} FROM pacientes WHERE id > $1 ORDER BY id ASC LIMIT $2'),
+    'pacientes_get': (('BIGINT',), f'SELECT {PACIENTE_COLUMNS} FROM pacientes WHERE id_number = $1'),
+    'pacientes_add': (PACIENTE_TYPES,
+        f"""INSERT INTO pacientes ({PACIENTE_VALUES}) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+            RETURNING {PACIENTE_COLUMNS}"""),
+    'pacientes_edit': (PACIENTE_TYPES + ('INTEGER',),
+        f"""UPDATE pacientes SET ({PACIENTE_VALUES}) = ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+            WHERE id = $12 RETURNING {PACIENTE_COLUMNS}"""),
+    'pacientes_delete': (('BIGINT',), f'DELETE FROM pacientes WHERE id_number = $1 RETURNING {PACIENTE_COLUMNS}'),
+    'estudios_get': (('BIGINT',), f'SELECT {ESTUDIO_COLUMNS} FROM estudios WHERE id_number = $1 ORDER BY id ASC'),
+    'estudios_page': (('BIGINT', 'INTEGER', 'INTEGER'),
+        f'SELECT {ESTUDIO_COLUMNS} FROM estudios WHERE id_number = $1 AND id > $2 ORDER BY id ASC LIMIT $3'),
+    'estudios_add': (('BIGINT', 'VARCHAR', 'VARCHAR'),
+        f'INSERT INTO estudios (id_number, file_name, file_path) VALUES ($1, $2, $3) RETURNING {ESTUDIO_COLUMNS}'),
+    'estudios_edit': (('BIGINT', 'VARCHAR', 'VARCHAR', 'INTEGER'),
+        f"""UPDATE estudios SET (id_number, file_name, file_path) = ($1, $2, $3) WHERE id = $4
+            RETURNING {ESTUDIO_COLUMNS}"""),
+    'estudios_delete': (('VARCHAR',), f'DELETE FROM estudios WHERE file_name = $1 RETURNING {ESTUDIO_COLUMNS}'),
+}
+
+# Patient search over id number, last and first name. With pg_trgm every
+# word is a substring (one statement by word count), otherwise the words
+# are prefixes of the full-text tokens. pg_trgm extracts no trigram from
+# words shorter than SEARCH_TRIGRAM_LENGTH, which only filter the rows found
+# by the longer ones
+SEARCH_TRIGRAM_LENGTH = 3
+SEARCH_TEXT = "(id_number::text || ' ' || last_name || ' ' || first_name)"
+SEARCH_VECTOR = f"to_tsvector('simple'::regconfig, {SEARCH_TEXT})"
+SEARCH_ORDER = 'ORDER BY last_name, first_name, id_number'
+SEARCH_WORDS = 4
+STATEMENTS.update({f'pacientes_search_{words}': (('VARCHAR',) * words + ('INTEGER',),
+    f"""SELECT {PACIENTE_COLUMNS} FROM pacientes
+        WHERE {' AND '.join(f'{SEARCH_TEXT} ILIKE ${n}' for n in range(1, words + 1))}
+        {SEARCH_ORDER} LIMIT ${words + 1}""") for words in range(1, SEARCH_WORDS + 1)})
+STATEMENTS['pacientes_search_fts'] = (('VARCHAR', 'INTEGER'),
+    f"""SELECT {PACIENTE_COLUMNS} FROM pacientes
+        WHERE {SEARCH_VECTOR} @@ to_tsquery('simple'::regconfig, $1)
+        {SEARCH_ORDER} LIMIT $2""")
+
+# Replicated tables: columns copied between the server and the replicas
+# (replica.py). Patients and studies are matched by uid, which survives
+# changes of their id number or file name; metrics and signals by their
+# primary key
+REPLICA_COLUMNS = {
+    'pacientes': f'uid, {PACIENTE_VALUES}',
+    'estudios': 'uid, id_number, file_name, file_path, study_date',
+    'metricas': 'file_name, foot, metric, value, version, preprocessing',
+    'senales': 'file_name, foot, first_index, lat_signal, ap_signal',
+}
+REPLICA_KEYS = {'pacientes': 'id_number', 'estudios': 'file_name'}
+# Order of the rows written at the same time (by the same statement)
+REPLICA_ORDER = {'pacientes': ('uid',), 'estudios': ('uid',), 'metricas': ('file_name', 'foot', 'metric'),
+                 'senales': ('file_name', 'foot'), 'borrados': ('uid',)}
+
+
+# Version: (description, statements). Versions are applied in order, once,
+# each in the transaction of the runner
+MIGRATIONS = {
+    1: ('Esquema base', (
+        """CREATE TABLE IF NOT EXISTS pacientes (
+            id serial PRIMARY KEY,
+            last_name VARCHAR(128) NOT NULL,
+            first_name VARCHAR(128) NOT NULL,
+            id_type CHAR(2) NOT NULL,
+            id_number BIGINT UNIQUE NOT NULL,
+            birth_date VARCHAR(128) NOT NULL,
+            sex CHAR(1) NOT NULL,
+            weight NUMERIC(5,2) NOT NULL,
+            weight_unit CHAR(2) NOT NULL,
+            height NUMERIC(3,2) NOT NULL,
+            height_unit VARCHAR(7) NOT NULL,
+            bmi NUMERIC(4,2) NOT NULL
+            )""",
+        """CREATE TABLE IF NOT EXISTS estudios (
+            id serial PRIMARY KEY,
+            id_number BIGINT NOT NULL,
+            file_name VARCHAR(128) UNIQUE NOT NULL,
+            file_path VARCHAR(128) UNIQUE NOT NULL,
+            study_date DATE DEFAULT CURRENT_DATE
+            )""",
+        # Studies registered before the column have no known date: they are
+        # left NULL (out of the age and date filters) and only new rows take
+        # the current date
+        'ALTER TABLE estudios ADD COLUMN IF NOT EXISTS study_date DATE',
+        'ALTER TABLE estudios ALTER COLUMN study_date SET DEFAULT CURRENT_DATE',
+        """CREATE TABLE IF NOT EXISTS metricas (
+            file_name VARCHAR(128) NOT NULL,
+            foot VARCHAR(6) NOT NULL,
+            metric VARCHAR(64) NOT NULL,
+            value DOUBLE PRECISION,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (file_name, foot, metric)
+            )""",
+        """CREATE TABLE IF NOT EXISTS senales (
+            file_name VARCHAR(128) NOT NULL,
+            foot VARCHAR(6) NOT NULL,
+            first_index INTEGER NOT NULL,
+            lat_signal BYTEA NOT NULL,
+            ap_signal BYTEA NOT NULL,
+            PRIMARY KEY (file_name, foot)
+            )""",
+        """CREATE TABLE IF NOT EXISTS cohortes (
+            bin VARCHAR(32) NOT NULL,
+            foot VARCHAR(6) NOT NULL,
+            metric VARCHAR(64) NOT NULL,
+            sketch BYTEA NOT NULL,
+            PRIMARY KEY (bin, foot, metric)
+            )""")),
+    2: ('Índices de consulta', (
+        # Studies by patient (and date), metrics by name; the remaining
+        # lookups use the primary and unique keys
+        'CREATE INDEX IF NOT EXISTS estudios_patient_date_idx ON estudios (id_number, study_date)',
+        'CREATE INDEX IF NOT EXISTS metricas_metric_idx ON metricas (metric, foot)')),
+    3: ('Llaves foráneas', (
+        # NOT VALID keeps studies of patients deleted before this version,
+        # new and updated rows are checked
+        """ALTER TABLE estudios ADD CONSTRAINT estudios_id_number_fkey FOREIGN KEY (id_number)
+            REFERENCES pacientes (id_number) ON UPDATE CASCADE ON DELETE CASCADE NOT VALID""",
+        """ALTER TABLE metricas ADD CONSTRAINT metricas_file_name_fkey FOREIGN KEY (file_name)
+            REFERENCES estudios (file_name) ON UPDATE CASCADE ON DELETE CASCADE NOT VALID""",
+        """ALTER TABLE senales ADD CONSTRAINT senales_file_name_fkey FOREIGN KEY (file_name)
+            REFERENCES estudios (file_name) ON UPDATE CASCADE ON DELETE CASCADE NOT VALID""")),
+    4: ('Fecha de nacimiento DATE', (
+        "ALTER TABLE pacientes ALTER COLUMN birth_date TYPE DATE USING to_date(birth_date, 'DD/MM/YYYY')",)),
+    5: ('Señales sin compresión', (
+        # Float samples barely compress and pglz dominates bulk writes
+        """ALTER TABLE senales ALTER COLUMN lat_signal SET STORAGE EXTERNAL,
+            ALTER COLUMN ap_signal SET STORAGE EXTERNAL""",)),
+    6: ('Búsqueda de pacientes', (
+        # pg_trgm is a contrib extension: without it (or without the
+        # privilege to create it) the index is full-text
+        """DO $$ BEGIN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        EXCEPTION WHEN OTHERS THEN
+            RAISE NOTICE 'pg_trgm no disponible: %', SQLERRM;
+        END $$""",
+        f"""DO $$ BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX IF NOT EXISTS pacientes_search_idx ON pacientes USING gin ({SEARCH_TEXT} gin_trgm_ops);
+            ELSE
+                CREATE INDEX IF NOT EXISTS pacientes_search_idx ON pacientes USING gin ({SEARCH_VECTOR});
+            END IF;
+        END $$""")),
+    7: ('Réplicas', (
+        # updated_at is the time of the last change where it was made (kept
+        # when a replica sends it) and decides conflicts; synced_at is the
+        # server time of the write, read by the replicas to pull changes
+        'ALTER TABLE pacientes ADD COLUMN IF NOT EXISTS uid UUID NOT NULL DEFAULT gen_random_uuid()',
+        'ALTER TABLE estudios ADD COLUMN IF NOT EXISTS uid UUID NOT NULL DEFAULT gen_random_uuid()',
+        'CREATE UNIQUE INDEX IF NOT EXISTS pacientes_uid_idx ON pacientes (uid)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS estudios_uid_idx ON estudios (uid)',
+        *(f"""ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            ADD COLUMN IF NOT EXISTS synced_at TIMESTAMPTZ NOT NULL DEFAULT now()""" for table in REPLICA_COLUMNS),
+        *(f'CREATE INDEX IF NOT EXISTS {table}_synced_idx ON {table} (synced_at)' for table in REPLICA_COLUMNS),
+        """CREATE TABLE IF NOT EXISTS borrados (
+            tabla VARCHAR(16) NOT NULL,
+            uid UUID NOT NULL,
+            deleted_at TIMESTAMPTZ NOT NULL,
+            synced_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+            )""",
+        'CREATE INDEX IF NOT EXISTS borrados_synced_idx ON borrados (synced_at)',
+        # An update that only sets synced_at republishes the row unchanged
+        """CREATE OR REPLACE FUNCTION replica_cambio() RETURNS trigger AS $$ BEGIN
+            IF TG_OP = 'UPDATE' THEN
+                NEW.synced_at := OLD.synced_at;
+                IF NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at AND NEW IS DISTINCT FROM OLD THEN
+                    NEW.updated_at := now();
+                END IF;
+            END IF;
+            NEW.synced_at := clock_timestamp();
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql""",
+        # Deletions sent by a replica keep their time (replica.deleted_at)
+        """CREATE OR REPLACE FUNCTION replica_borrado() RETURNS trigger AS $$ BEGIN
+            INSERT INTO borrados (tabla, uid, deleted_at) VALUES (TG_TABLE_NAME, OLD.uid,
+                COALESCE(NULLIF(current_setting('replica.deleted_at', true), '')::timestamptz, now()));
+            RETURN OLD;
+        END $$ LANGUAGE plpgsql""",
+        *(f"""CREATE TRIGGER {table}_cambio BEFORE INSERT OR UPDATE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION replica_cambio()""" for table in REPLICA_COLUMNS),
+        *(f"""CREATE TRIGGER {table}_borrado AFTER DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION replica_borrado()""" for table in REPLICA_KEYS))),
+    8: ('Preprocesamiento de métricas', (
+        # Filter settings and analysis parameters each metric was computed
+        # with (metrics.settingsName, '' for unfiltered signals and defaults)
+        "ALTER TABLE metricas ADD COLUMN IF NOT EXISTS preprocessing VARCHAR(128) NOT NULL DEFAULT ''",
+        'ALTER TABLE estudios ALTER COLUMN study_date DROP NOT NULL')),
+}
+
+_prepared = weakref.WeakKeyDictionary()
+_trigram = weakref.WeakKeyDictionary()
+
+
+# -----------
+# Migraciones
+# -----------
+def migrate(cursor) -> int:
+    """ Apply the pending schema migrations in order
+
+    The schema_version table records the applied versions. An advisory
+    lock serializes concurrent runners, and statements prepared on the
+    connection are released after a change so their plans are rebuilt.
+
+    Parameters
+    ----------
+    cursor: psycopg2 cursor
+        Cursor of the connection, committed by the caller
+
+    Returns
+    -------
+    version: int
+        Schema version after the migrations
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('schema_version'))")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description VARCHAR(128) NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now()
+                    )""")
+    cursor.execute('SELECT COALESCE(max(version), 0) FROM schema_version')
+    current = cursor.fetchone()[0]
+
+    pending = [version for version in sorted(MIGRATIONS) if version > current]
+    for version in pending:
+        description, statements = MIGRATIONS[version]
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute('INSERT INTO schema_version (version, description) VALUES (%s, %s)', (version, description))
+
+    if pending:
+        cursor.execute('DEALLOCATE ALL')
+        _prepared.pop(cursor.connection, None)
+        _trigram.pop(cursor.connection, None)
+
+    return pending[-1] if pending else current
+
+
+# ----------
+# Sentencias
+# ----------
+def execute(cursor, name: str, params: tuple = ()) -> None:
+    """ Execute a statement, prepared on the cursor connection on first use
+
+    Parameters
+    ----------
+    cursor: psycopg2 cursor
+        Cursor of the connection
+    name: str
+        Statement name in STATEMENTS
+    params: tuple
+        Statement parameter values
+    """
+    prepared = _prepared.setdefault(cursor.connection, set())
+    types, statement = STATEMENTS[name]
+    if name not in prepared:
+        signature = f' ({", ".join(types)})' if types else ''
+        cursor.execute(f'PREPARE {name}{signature} AS {statement}')
+        prepared.add(name)
+    if params:
+        cursor.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(params))})', tuple(params))
+    else:
+        cursor.execute(f'EXECUTE {name}')
+
+
+def _paciente_params(data: dict) -> tuple:
+    """ Statement parameters from the patient dialog data """
+    return (data['last_name'], data['first_name'], data['id_type'], data['id'], parse_date(data['birth_date']),
+            data['sex'], data['weight'], data['weight_unit'], data['height'], data['height_unit'], data['bmi'])
+
+
+def parse_date(value) -> datetime.date:
+    """ Date from a dd/mm/yyyy text (the patient dialog format) or a date """
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(str(value).strip(), '%d/%m/%Y').date()
+
+
+def _one(cursor, row_type):
+    """ Single returned row as row_type, None if no row was affected """
+    row = cursor.fetchone()
+    return row_type(*row) if row is not None else None
+
+
+# ---------
+# Pacientes
+# ---------
+def patients_page(cursor, after: int, limit: int) -> list:
+    """ Patients in insertion order whose id follows after (keyset page) """
+    execute(cursor, 'pacientes_page', (after, limit))
+    return [Paciente(*row) for row in cursor.fetchall()]
+
+
+def get_patient(cursor, id_number) -> list:
+    """ Patients with an id number (empty or a single row) """
+    execute(cursor, 'pacientes_get', (id_number,))
+    return [Paciente(*row) for row in cursor.fetchall()]
+
+
+def add_patient(cursor, data: dict) -> Paciente:
+    """ Insert a patient and return the stored row """
+    execute(cursor, 'pacientes_add', _paciente_params(data))
+    return _one(cursor, Paciente)
+
+
+def edit_patient(cursor, id_db: int, data: dict) -> Paciente:
+    """ Update a patient and return the updated row (None if missing) """
+    execute(cursor, 'pacientes_edit', _paciente_params(data) + (id_db,))
+    return _one(cursor, Paciente)
+
+
+def delete_patient(cursor, id_number) -> Paciente:
+    """ Delete a patient and return the deleted row (None if missing) """
+    execute(cursor, 'pacientes_delete', (id_number,))
+    return _one(cursor, Paciente)
+
+
+def search_patients(cursor, text: str, limit: int = 10) -> list:
+    """ Patients whose id number, last or first name match every word of
+        a search text, in name order
+
+    Words are matched as substrings with the pacientes_search_idx trigram
+    index, or as token prefixes with its full-text version. Only the first
+    SEARCH_WORDS words are used. With the trigram index at least one word
+    must have SEARCH_TRIGRAM_LENGTH characters, otherwise the index cannot
+    be used and no rows are returned.
+
+    Parameters
+    ----------
+    cursor: psycopg2 cursor
+        Cursor of the connection
+    text: str
+        Search text typed by the user
+    limit: int
+        Maximum number of patients
+
+    Returns
+    -------
+    patients: list
+        Matching rows, empty if the text has no words (or only short
+        words with the trigram index)
+    """
+    connection = cursor.connection
+    if connection not in _trigram:
+        cursor.execute("SELECT coalesce(bool_or(indexdef LIKE '%gin_trgm_ops%'), false) FROM pg_indexes "
+                       "WHERE indexname = 'pacientes_search_idx'")
+        _trigram[connection] = cursor.fetchone()[0]
+
+    if _trigram[connection]:
+        words = text.split()[:SEARCH_WORDS]
+        if all(len(word) < SEARCH_TRIGRAM_LENGTH for word in words):
+            return []
+        patterns = ['%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%' for word in words]
+        execute(cursor, f'pacientes_search_{len(words)}', (*patterns, limit))
+    else:
+        words = re.findall(r'\w+', text)[:SEARCH_WORDS]
+        if not words:
+            return []
+        execute(cursor, 'pacientes_search_fts', (' & '.join(f'{word}:*' for word in words), limit))
+    return [Paciente(*row) for row in cursor.fetchall()]
+
+
+def registered_patients(cursor, id_numbers: list) -> set:
+    """ Id numbers among the given ones with a patient row """
+    cursor.execute('SELECT id_number FROM pacientes WHERE id_number = ANY(%s::BIGINT[])', (list(id_numbers),))
+    return {id_number for id_number, in cursor.fetchall()}
+
+
+def copy_patients(cursor, rows: list, update: bool = True) -> tuple:
+    """ Bulk load of patients with COPY through a staging table
+
+    Parameters
+    ----------
+    cursor: psycopg2 cursor
+        Cursor of the connection, committed by the caller
+    rows: list
+        Tuples with the PACIENTE_VALUES fields, birth_date as a date
+    update: bool
+        Existing id numbers are updated with the new data if True, and
+        left untouched if False
+
+    Returns
+    -------
+    inserted, updated, conflicts: tuple
+        Lists of id numbers inserted, updated and not loaded because they
+        already existed
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(value.isoformat() if isinstance(value, datetime.date) else value for value in row)
+    buffer.seek(0)
+
+    cursor.execute("""CREATE TEMP TABLE pacientes_import (
+                    last_name VARCHAR(128), first_name VARCHAR(128), id_type CHAR(2), id_number BIGINT,
+                    birth_date DATE, sex CHAR(1), weight NUMERIC(5,2), weight_unit CHAR(2),
+                    height NUMERIC(3,2), height_unit VARCHAR(7), bmi NUMERIC(4,2)
+                    )""")
+    cursor.copy_expert(f'COPY pacientes_import ({PACIENTE_VALUES}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in PACIENTE_VALUES.split(', '))
+    action = f'DO UPDATE SET {updates}' if update else 'DO NOTHING'
+    cursor.execute(f"""INSERT INTO pacientes ({PACIENTE_VALUES})
+                    SELECT {PACIENTE_VALUES} FROM pacientes_import
+                    ON CONFLICT (id_number) {action}
+                    RETURNING id_number, xmax = 0""")
+    loaded = cursor.fetchall()
+    inserted = [id_number for id_number, new in loaded if new]
+    updated = [id_number for id_number, new in loaded if not new]
+    returned = {id_number for id_number, _ in loaded}
+    conflicts = [row[3] for row in rows if int(row[3]) not in returned]
+    cursor.execute('DROP TABLE pacientes_import')
+
+    return inserted, updated, conflicts
+
+
+# --------
+# Estudios
+# --------
+def get_studies(cursor, id_number) -> list:
+    """ Studies of a patient in insertion order """
+    execute(cursor, 'estudios_get', (id_number,))
+    return [Estudio(*row) for row in cursor.fetchall()]
+
+
+def studies_page(cursor, id_number, after: int, limit: int) -> list:
+    """ Studies of a patient in insertion order whose id follows after
+        (keyset page)
+    """
+    execute(cursor, 'estudios_page', (id_number, after, limit))
+    return [Estudio(*row) for row in cursor.fetchall()]
+
+
+def add_study(cursor, id_number, file_name: str, file_path: str) -> Estudio:
+    """ Insert a study and return the stored row """
+    execute(cursor, 'estudios_add', (id_number, file_name, file_path))
+    return _one(cursor, Estudio)
+
+
+def add_studies(cursor, rows: list) -> list:
+    """ Multi-row insert of studies, skipping those whose file name or
+        file path is already registered
+
+    Parameters
+    ----------
+    cursor: psycopg2 cursor
+        Cursor of the connection, committed by the caller
+    rows: list
+        Tuples (id_number, file_name, file_path, study_date), study_date
+        None for the current date
+
+    Returns
+    -------
+    studies: list
+        Inserted rows
+    """
+    if not rows:
+        return []
+    inserted = execute_values(cursor, f"""INSERT INTO estudios (id_number, file_name, file_path, study_date) VALUES %s
+                    ON CONFLICT DO NOTHING RETURNING {ESTUDIO_COLUMNS}""", rows,
+                    template='(%s, %s, %s, COALESCE(%s::DATE, CURRENT_DATE))', page_size=len(rows), fetch=True)
+    return [Estudio(*row) for row in inserted]
+
+
+def registered_studies(cursor, file_names: list, file_paths: list) -> tuple:
+    """ File names and file paths among the given ones already registered """
+    cursor.execute('SELECT file_name, file_path FROM estudios WHERE file_name = ANY(%s) OR file_path = ANY(%s)',
+                   (list(file_names), list(file_paths)))
+    rows = cursor.fetchall()
+    return {file_name for file_name, _ in rows}, {file_path for _, file_path in rows}
+
+
+def edit_study(cursor, id_db: int, id_number, file_name: str, file_path: str) -> Estudio:
+    """ Update a study and return the updated row (None if missing) """
+    execute(cursor, 'estudios_edit', (id_number, file_name, file_path, id_db))
+    return _one(cursor, Estudio)
+
+
+def delete_study(cursor, file_name: str) -> Estudio:
+    """ Delete a study, with its stored metrics and signals by cascade, and
+        return the deleted row (None if missing)
+    """
+    execute(cursor, 'estudios_delete', (file_name,))
+    return _one(cursor, Estudio)
+
+
+# --------
+# Métricas
+# --------
+def insert_metrics(cursor, rows: list, page_size: int = 1000) -> None:
+    """ Multi-row upsert of (file_name, foot, metric, value, version,
+        preprocessing) rows
+    """
+    execute_values(cursor, """INSERT INTO metricas (file_name, foot, metric, value, version, preprocessing) VALUES %s
+                    ON CONFLICT (file_name, foot, metric)
+                    DO UPDATE SET value = EXCLUDED.value, version = EXCLUDED.version,
+                        preprocessing = EXCLUDED.preprocessing""",
+                   [(file_name, foot, metric, sql_float(value), version, preprocessing)
+                    for file_name, foot, metric, value, version, preprocessing in rows], page_size=page_size)
+
+
+def insert_signals(cursor, rows: list) -> None:
+    """ Multi-row upsert of (file_name, foot, first_index, lateral, ap) rows,
+        signals as float64 little-endian bytes
+    """
+    execute_values(cursor, """INSERT INTO senales (file_name, foot, first_index, lat_signal, ap_signal) VALUES %s
+                    ON CONFLICT (file_name, foot)
+                    DO UPDATE SET first_index = EXCLUDED.first_index, lat_signal = EXCLUDED.lat_signal,
+                        ap_signal = EXCLUDED.ap_signal""",
+                   [(file_name, foot, first_index, Binary(lateral), Binary(ap))
+                    for file_name, foot, first_index, lateral, ap in rows])
+
+
+def copy_signals(cursor, rows: list) -> None:
+    """ Binary COPY of signal rows of studies without stored signals (new
+        studies), which skips the text decoding of the BYTEA values
+    """
+    buffer = io.BytesIO()
+    buffer.write(b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0))
+    for file_name, foot, first_index, lateral, ap in rows:
+        fields = (file_name.encode(), foot.encode(), struct.pack('!i', first_index), lateral, ap)
+        buffer.write(struct.pack('!h', len(fields)))
+        for field in fields:
+            buffer.write(struct.pack('!i', len(field)) + field)
+    buffer.write(struct.pack('!h', -1))
+    buffer.seek(0)
+    cursor.copy_expert('COPY senales (file_name, foot, first_index, lat_signal, ap_signal) FROM STDIN WITH (FORMAT binary)',
+                       buffer)
+
+
+def get_signals(cursor, file_names: list) -> list:
+    """ Signal rows (file_name, foot, first_index, lateral, ap) of studies """
+    cursor.execute('SELECT file_name, foot, first_index, lat_signal, ap_signal FROM senales WHERE file_name = ANY(%s)',
+                   (list(file_names),))
+    return cursor.fetchall()
+
+
+def stale_metrics(cursor, versions: dict, feet: tuple) -> list:
+    """ Tuples (file_name, file_path, stale metric names) of the studies with
+        metrics missing or computed with another version
+    """
+    current = ', '.join(cursor.mogrify('(%s, %s)', item).decode() for item in versions.items())
+    cursor.execute(f"""WITH current (metric, version) AS (VALUES {current})
+                    SELECT e.file_name, e.file_path, array_agg(DISTINCT c.metric ORDER BY c.metric)
+                    FROM estudios e
+                    CROSS JOIN current c
+                    CROSS JOIN unnest(%s::VARCHAR[]) AS f (foot)
+                    LEFT JOIN metricas m
+                        ON m.file_name = e.file_name AND m.foot = f.foot AND m.metric = c.metric
+                    WHERE m.version IS DISTINCT FROM c.version
+                    GROUP BY e.file_name, e.file_path
+                    ORDER BY e.file_name""", (list(feet),))
+    return cursor.fetchall()
+
+
+def patient_metrics(cursor, id_number, metric_names: list) -> list:
+    """ Tuples (study_date, file_name, foot, metric, value) of the studies of
+        a patient in date order
+    """
+    cursor.execute("""SELECT e.study_date, e.file_name, m.foot, m.metric, m.value
+                    FROM estudios e
+                    JOIN metricas m ON m.file_name = e.file_name
+                    WHERE e.id_number = %s AND m.metric = ANY(%s)
+                    ORDER BY e.study_date, e.file_name, m.foot, m.metric""", (id_number, list(metric_names)))
+    return cursor.fetchall()
+
+
+def sql_float(value):
+    """ Metric value as float with NaN and infinite values stored as NULL """
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+# --------
+# Cohortes
+# --------
+def cohort_stats(cursor, metric: str, foot: str, sex: str = None, age: tuple = None, bmi: tuple = None,
+                 dates: tuple = None) -> tuple:
+    """ Aggregates of a metric over the studies of a patient cohort, from
+        the metrics of unfiltered signals with the default parameters
+
+    Returns
+    -------
+    n, mean, std, min, quantiles, max: tuple
+        quantiles: 5, 25, 50, 75 and 95 percentiles (None if n is 0)
+    """
+    conditions = ['m.metric = %s', 'm.foot = %s', "m.preprocessing = ''", 'm.value IS NOT NULL']
+    values = [metric, foot]
+    if sex is not None:
+        conditions.append('p.sex = %s')
+        values.append(sex)
+    if age is not None:
+        conditions.append("date_part('year', age(e.study_date, p.birth_date)) BETWEEN %s AND %s")
+        values.extend(age)
+    if bmi is not None:
+        conditions.append('p.bmi BETWEEN %s AND %s')
+        values.extend(bmi)
+    if dates is not None:
+        conditions.append('e.study_date BETWEEN %s AND %s')
+        values.extend(dates)
+
+    cursor.execute(f"""SELECT count(*), avg(m.value), stddev_samp(m.value), min(m.value),
+                        percentile_cont(ARRAY[0.05, 0.25, 0.5, 0.75, 0.95]) WITHIN GROUP (ORDER BY m.value),
+                        max(m.value)
+                    FROM metricas m
+                    JOIN estudios e ON e.file_name = m.file_name
+                    JOIN pacientes p ON p.id_number = e.id_number
+                    WHERE {' AND '.join(conditions)}""", values)
+    return cursor.fetchone()
+
+
+def cohort_values(cursor, versions: dict) -> list:
+    """ Tuples (sex, age at study date, bmi, foot, metric, values) of the
+        studies with a known date, from the metrics of unfiltered signals
+        with the default parameters at the current version by metric name
+    """
+    current = ', '.join(cursor.mogrify('(%s, %s)', item).decode() for item in versions.items())
+    cursor.execute(f"""WITH current (metric, version) AS (VALUES {current})
+                    SELECT p.sex, date_part('year', age(e.study_date, p.birth_date)) AS age,
+                        p.bmi, m.foot, m.metric, array_agg(m.value)
+                    FROM metricas m
+                    JOIN current c ON c.metric = m.metric AND c.version = m.version
+                    JOIN estudios e ON e.file_name = m.file_name
+                    JOIN pacientes p ON p.id_number = e.id_number
+                    WHERE m.preprocessing = '' AND m.value IS NOT NULL AND e.study_date IS NOT NULL
+                    GROUP BY 1, 2, 3, 4, 5""")
+    return cursor.fetchall()
+
+
+def get_cohort(cursor) -> list:
+    """ Stored cohort sketches as tuples (bin, foot, metric, sketch) """
+    cursor.execute('SELECT bin, foot, metric, sketch FROM cohortes')
+    return [(bin_name, foot, metric, bytes(sketch)) for bin_name, foot, metric, sketch in cursor.fetchall()]
+
+
+def merge_cohort(cursor, sketches: dict, merge) -> None:
+    """ Merge serialized sketches by (bin, foot, metric) into the stored
+        ones, locked until the caller commits
+
+    Missing keys are first inserted with an empty sketch, in key order, so
+    FOR UPDATE also locks the keys no transaction has stored yet and
+    concurrent merges of a new key wait instead of overwriting each other.
+    """
+    keys = sorted(sketches)
+    execute_values(cursor, """INSERT INTO cohortes (bin, foot, metric, sketch) VALUES %s
+                    ON CONFLICT (bin, foot, metric) DO NOTHING""", [(*key, Binary(b'')) for key in keys])
+    cursor.execute("""SELECT bin, foot, metric, sketch FROM cohortes
+                    WHERE (bin, foot, metric) IN %s FOR UPDATE""", (tuple(keys),))
+    stored = {(bin_name, foot, metric): bytes(data) for bin_name, foot, metric, data in cursor.fetchall()}
+    rows = [(*key, Binary(merge(stored[key], sketches[key]) if stored.get(key) else sketches[key]))
+            for key in keys]
+    execute_values(cursor, """INSERT INTO cohortes (bin, foot, metric, sketch) VALUES %s
+                    ON CONFLICT (bin, foot, metric) DO UPDATE SET sketch = EXCLUDED.sketch""", rows)
+
+
+def replace_cohort(cursor, sketches: dict) -> None:
+    """ Replace all stored sketches with the serialized sketches by
+        (bin, foot, metric)
+    """
+    cursor.execute('DELETE FROM cohortes')
+    execute_values(cursor, 'INSERT INTO cohortes (bin, foot, metric, sketch) VALUES %s',
+                   [(*key, Binary(data)) for key, data in sketches.items()])
+
+
+# --------
+# Réplicas
+# --------
+def replica_horizon(cursor) -> datetime.datetime:
+    """ Server time before which every row write is committed: the start of
+        the oldest transaction in progress that has written (the current
+        time if none). Transactions of other roles are only seen with the
+        pg_read_all_stats privilege
+    """
+    cursor.execute("""SELECT COALESCE(min(xact_start), clock_timestamp()) FROM pg_stat_activity
+                    WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid()""")
+    return cursor.fetchone()[0]
+
+
+def replica_changes(cursor, table: str, since, after: tuple, limit: int) -> list:
+    """ Rows of a replicated table (or of borrados, the deletions) written on
+        the server from a time on, in write order
+
+    Parameters
+    ----------
+    cursor: psycopg2 cursor
+        Cursor of the connection
+    table: str
+        Replicated table or borrados
+    since: datetime or str
+        First synced_at, or synced_at of the last row of the previous page
+    after: tuple
+        REPLICA_ORDER values of the last row of the previous page (None for
+        the first page), to page through rows written at the same time
+    limit: int
+        Maximum number of rows
+
+    Returns
+    -------
+    rows: list
+        Tuples of the REPLICA_COLUMNS of the table with updated_at and
+        synced_at, uid as text and signals as bytes. Deletions as tuples
+        (table, uid, deleted_at, synced_at)
+    """
+    if table == 'borrados':
+        columns = 'tabla, uid::text, deleted_at'
+    else:
+        columns = REPLICA_COLUMNS[table].replace('uid', 'uid::text', 1) + ', updated_at'
+    order = ', '.join(REPLICA_ORDER[table])
+    if after is None:
+        condition, params = 'synced_at >= %s', (since,)
+    else:
+        condition, params = f'(synced_at, {order}) > ({", ".join(["%s"] * (len(after) + 1))})', (since, *after)
+    cursor.execute(f"""SELECT {columns}, synced_at FROM {table}
+                    WHERE {condition} ORDER BY synced_at, {order} LIMIT %s""", (*params, limit))
+    rows = cursor.fetchall()
+    if table == 'senales':
+        rows = [(*row[:3], bytes(row[3]), bytes(row[4]), *row[5:]) for row in rows]
+    return rows
+
+
+def replicate_row(cursor, table: str, row: tuple, updated_at) -> bool:
+    """ Store a patient or study changed on a replica, unless the server row
+        changed later (last write wins)
+
+    The row is matched by uid, or by id number or file name if the server
+    has none with that uid (registered on the server and on the replica
+    while disconnected), and then keeps the uid of the server.
+
+    Parameters
+    ----------
+    cursor: psycopg2 cursor
+        Cursor of the connection, committed by the caller
+    table: str
+        pacientes or estudios
+    row: tuple
+        Values of the REPLICA_COLUMNS of the table
+    updated_at: datetime or str
+        Time of the change on the replica
+
+    Returns
+    -------
+    stored: bool
+        False if the server row is newer
+    """
+    columns = REPLICA_COLUMNS[table].split(', ')
+    key = REPLICA_KEYS[table]
+    cursor.execute(f"""SELECT uid FROM {table} WHERE uid = %s::uuid OR {key} = %s
+                    ORDER BY uid = %s::uuid DESC LIMIT 1 FOR UPDATE""", (row[0], row[columns.index(key)], row[0]))
+    found = cursor.fetchone()
+    if found is None:
+        cursor.execute(f"""INSERT INTO {table} ({', '.join(columns)}, updated_at)
+                        VALUES ({', '.join(['%s'] * (len(columns) + 1))})""", (*row, updated_at))
+        return True
+
+    cursor.execute(f"""UPDATE {table} SET ({', '.join(columns[1:])}, updated_at) = ({', '.join(['%s'] * len(columns))})
+                    WHERE uid = %s AND updated_at < %s""", (*row[1:], updated_at, found[0], updated_at))
+    return cursor.rowcount > 0
+
+
+def replicate_deletion(cursor, table: str, uid: str, deleted_at) -> bool:
+    """ Delete a patient or study deleted on a replica, unless the server row
+        changed later (last write wins); False if it was not deleted
+
+    A row kept is published again with its studies, metrics and signals, so
+    the replica pulls back what its deletion removed.
+    """
+    cursor.execute("SELECT set_config('replica.deleted_at', %s, true)", (str(deleted_at),))
+    cursor.execute(f'DELETE FROM {table} WHERE uid = %s::uuid AND updated_at <= %s', (uid, deleted_at))
+    deleted = cursor.rowcount > 0
+    cursor.execute("SELECT set_config('replica.deleted_at', '', true)")
+    if deleted:
+        return True
+
+    # The trigger gives a new synced_at to updates that only set it
+    if table == 'pacientes':
+        cursor.execute('UPDATE pacientes SET synced_at = now() WHERE uid = %s::uuid', (uid,))
+        cursor.execute("""UPDATE estudios SET synced_at = now()
+                        WHERE id_number IN (SELECT id_number FROM pacientes WHERE uid = %s::uuid)
+                        RETURNING file_name""", (uid,))
+    else:
+        cursor.execute('UPDATE estudios SET synced_at = now() WHERE uid = %s::uuid RETURNING file_name', (uid,))
+    file_names = [file_name for file_name, in cursor.fetchall()]
+    if file_names:
+        cursor.execute('UPDATE metricas SET synced_at = now() WHERE file_name = ANY(%s)', (file_names,))
+        cursor.execute('UPDATE senales SET synced_at = now() WHERE file_name = ANY(%s)', (file_names,))
+    return False
+
+
+def replicate_metrics(cursor, rows: list) -> None:
+    """ Upsert of (file_name, foot, metric, value, version, preprocessing,
+        updated_at) rows changed on a replica, skipping those changed later on
+        the server
+    """
+    execute_values(cursor, """INSERT INTO metricas (file_name, foot, metric, value, version, preprocessing, updated_at)
+                    VALUES %s
+                    ON CONFLICT (file_name, foot, metric)
+                    DO UPDATE SET value = EXCLUDED.value, version = EXCLUDED.version,
+                        preprocessing = EXCLUDED.preprocessing, updated_at = EXCLUDED.updated_at
+                    WHERE metricas.updated_at < EXCLUDED.updated_at""", rows)
+
+
+def replicate_signals(cursor, rows: list) -> None:
+    """ Upsert of (file_name, foot, first_index, lateral, ap, updated_at) rows
+        changed on a replica, skipping those changed later on the server
+    """
+    execute_values(cursor, """INSERT INTO senales (file_name, foot, first_index, lat_signal, ap_signal, updated_at)
+                    VALUES %s
+                    ON CONFLICT (file_name, foot)
+                    DO UPDATE SET first_index = EXCLUDED.first_index, lat_signal = EXCLUDED.lat_signal,
+                        ap_signal = EXCLUDED.ap_signal, updated_at = EXCLUDED.updated_at
+                    WHERE senales.updated_at < EXCLUDED.updated_at""",
+                   [(file_name, foot, first_index, Binary(lateral), Binary(ap), updated_at)
+                    for file_name, foot, first_index, lateral, ap, updated_at in rows])
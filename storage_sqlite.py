@@ -0,0 +1,568 @@
+"""
+Storage SQLite
+
+This file contains the embedded SQLite storage engine: the functions of
+storage (migrate, get_patient, add_study, insert_metrics, cohort_stats, ...)
+with the same arguments and rows over a sqlite3 cursor, for installs
+without a PostgreSQL server.
+
+The database is a single file in WAL mode, so the views keep reading while
+a study is written. The schema has the same tables, keys and indexes as
+the PostgreSQL one, and patients are searched with an FTS5 index. sqlite3
+keeps the compiled statements of each connection in its statement cache,
+so the statements are parsed once as the prepared ones of storage.
+
+Dates are stored as ISO text and decimal values as REAL, both converted
+back when the rows are built.
+
+Usage:
+    connection = storage_sqlite.connect('estabilometria.db')
+    patient = storage_sqlite.get_patient(connection.cursor(), 1020304050)
+"""
+
+import datetime
+import itertools
+import json
+import re
+import sqlite3
+from decimal import Decimal
+
+import numpy as np
+
+from storage import (Paciente, Estudio, PACIENTE_COLUMNS, ESTUDIO_COLUMNS, PACIENTE_VALUES, SEARCH_ORDER,
+                     SEARCH_WORDS, sql_float, _paciente_params)
+
+# Name: statement with ? parameters
+STATEMENTS = {
+    'pacientes_page': f'SELECT {PACIENTE_COLUMNS} FROM pacientes WHERE id > ? ORDER BY id ASC LIMIT ?',
+    'pacientes_get': f'SELECT {PACIENTE_COLUMNS} FROM pacientes WHERE id_number = ?',
+    'pacientes_add': f"""INSERT INTO pacientes ({PACIENTE_VALUES}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING {PACIENTE_COLUMNS}""",
+    'pacientes_edit': f"""UPDATE pacientes SET ({PACIENTE_VALUES}) = (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        WHERE id = ? RETURNING {PACIENTE_COLUMNS}""",
+    'pacientes_delete': f'DELETE FROM pacientes WHERE id_number = ? RETURNING {PACIENTE_COLUMNS}',
+    'pacientes_search': f"""SELECT {PACIENTE_COLUMNS} FROM pacientes
+        WHERE id IN (SELECT rowid FROM pacientes_search WHERE pacientes_search MATCH ?)
+        {SEARCH_ORDER} LIMIT ?""",
+    'estudios_get': f'SELECT {ESTUDIO_COLUMNS} FROM estudios WHERE id_number = ? ORDER BY id ASC',
+    'estudios_page': f'SELECT {ESTUDIO_COLUMNS} FROM estudios WHERE id_number = ? AND id > ? ORDER BY id ASC LIMIT ?',
+    'estudios_add': f'INSERT INTO estudios (id_number, file_name, file_path) VALUES (?, ?, ?) RETURNING {ESTUDIO_COLUMNS}',
+    'estudios_edit': f"""UPDATE estudios SET (id_number, file_name, file_path) = (?, ?, ?) WHERE id = ?
+        RETURNING {ESTUDIO_COLUMNS}""",
+    'estudios_delete': f'DELETE FROM estudios WHERE file_name = ? RETURNING {ESTUDIO_COLUMNS}',
+}
+
+# Age in years at the study date
+AGE = ("(CAST(strftime('%Y', e.study_date) AS INTEGER) - CAST(strftime('%Y', p.birth_date) AS INTEGER)"
+       " - (strftime('%m-%d', e.study_date) < strftime('%m-%d', p.birth_date)))")
+
+# Version: (description, statements). Version 1 is the PostgreSQL schema
+# of storage up to its version 6
+MIGRATIONS = {
+    1: ('Esquema base', (
+        """CREATE TABLE IF NOT EXISTS pacientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            last_name VARCHAR(128) NOT NULL,
+            first_name VARCHAR(128) NOT NULL,
+            id_type CHAR(2) NOT NULL,
+            id_number BIGINT UNIQUE NOT NULL,
+            birth_date DATE NOT NULL,
+            sex CHAR(1) NOT NULL,
+            weight NUMERIC(5,2) NOT NULL,
+            weight_unit CHAR(2) NOT NULL,
+            height NUMERIC(3,2) NOT NULL,
+            height_unit VARCHAR(7) NOT NULL,
+            bmi NUMERIC(4,2) NOT NULL
+            )""",
+        """CREATE TABLE IF NOT EXISTS estudios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_number BIGINT NOT NULL
+                REFERENCES pacientes (id_number) ON UPDATE CASCADE ON DELETE CASCADE,
+            file_name VARCHAR(128) UNIQUE NOT NULL,
+            file_path VARCHAR(128) UNIQUE NOT NULL,
+            study_date DATE DEFAULT CURRENT_DATE
+            )""",
+        """CREATE TABLE IF NOT EXISTS metricas (
+            file_name VARCHAR(128) NOT NULL
+                REFERENCES estudios (file_name) ON UPDATE CASCADE ON DELETE CASCADE,
+            foot VARCHAR(6) NOT NULL,
+            metric VARCHAR(64) NOT NULL,
+            value DOUBLE PRECISION,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (file_name, foot, metric)
+            )""",
+        """CREATE TABLE IF NOT EXISTS senales (
+            file_name VARCHAR(128) NOT NULL
+                REFERENCES estudios (file_name) ON UPDATE CASCADE ON DELETE CASCADE,
+            foot VARCHAR(6) NOT NULL,
+            first_index INTEGER NOT NULL,
+            lat_signal BLOB NOT NULL,
+            ap_signal BLOB NOT NULL,
+            PRIMARY KEY (file_name, foot)
+            )""",
+        """CREATE TABLE IF NOT EXISTS cohortes (
+            bin VARCHAR(32) NOT NULL,
+            foot VARCHAR(6) NOT NULL,
+            metric VARCHAR(64) NOT NULL,
+            sketch BLOB NOT NULL,
+            PRIMARY KEY (bin, foot, metric)
+            )""",
+        'CREATE INDEX IF NOT EXISTS estudios_patient_date_idx ON estudios (id_number, study_date)',
+        'CREATE INDEX IF NOT EXISTS metricas_metric_idx ON metricas (metric, foot)',
+        # Full-text index of pacientes kept by triggers (remove_diacritics
+        # lets 'perez' find 'Pérez')
+        """CREATE VIRTUAL TABLE IF NOT EXISTS pacientes_search USING fts5 (
+            id_number, last_name, first_name, content = 'pacientes', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2')""",
+        """CREATE TRIGGER IF NOT EXISTS pacientes_search_insert AFTER INSERT ON pacientes BEGIN
+            INSERT INTO pacientes_search (rowid, id_number, last_name, first_name)
+                VALUES (new.id, new.id_number, new.last_name, new.first_name);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS pacientes_search_delete AFTER DELETE ON pacientes BEGIN
+            INSERT INTO pacientes_search (pacientes_search, rowid, id_number, last_name, first_name)
+                VALUES ('delete', old.id, old.id_number, old.last_name, old.first_name);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS pacientes_search_update AFTER UPDATE ON pacientes BEGIN
+            INSERT INTO pacientes_search (pacientes_search, rowid, id_number, last_name, first_name)
+                VALUES ('delete', old.id, old.id_number, old.last_name, old.first_name);
+            INSERT INTO pacientes_search (rowid, id_number, last_name, first_name)
+                VALUES (new.id, new.id_number, new.last_name, new.first_name);
+        END""")),
+    2: ('Réplica', (
+        # Columns and tables of the offline replicas (replica.py), unused by
+        # a standalone database: uid and updated_at as in the server, the
+        # change log to push and the time of the last pulled change by table
+        'ALTER TABLE pacientes ADD COLUMN uid VARCHAR(36)',
+        'ALTER TABLE estudios ADD COLUMN uid VARCHAR(36)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS pacientes_uid_idx ON pacientes (uid)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS estudios_uid_idx ON estudios (uid)',
+        'ALTER TABLE pacientes ADD COLUMN updated_at VARCHAR(32)',
+        'ALTER TABLE estudios ADD COLUMN updated_at VARCHAR(32)',
+        'ALTER TABLE metricas ADD COLUMN updated_at VARCHAR(32)',
+        'ALTER TABLE senales ADD COLUMN updated_at VARCHAR(32)',
+        # Rows written before the database was a replica, sent on first use
+        'CREATE INDEX IF NOT EXISTS metricas_unstamped_idx ON metricas (file_name) WHERE updated_at IS NULL',
+        'CREATE INDEX IF NOT EXISTS senales_unstamped_idx ON senales (file_name) WHERE updated_at IS NULL',
+        """CREATE TABLE IF NOT EXISTS cambios (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabla VARCHAR(16) NOT NULL,
+            uid VARCHAR(36) NOT NULL,
+            deleted_at VARCHAR(32)
+            )""",
+        """CREATE TABLE IF NOT EXISTS sincronizacion (
+            tabla VARCHAR(16) PRIMARY KEY,
+            synced_at VARCHAR(32) NOT NULL
+            )""")),
+    3: ('Preprocesamiento de métricas', (
+        "ALTER TABLE metricas ADD COLUMN preprocessing VARCHAR(128) NOT NULL DEFAULT ''",)),
+}
+
+
+# --------
+# Conexión
+# --------
+def connect(db_file: str) -> sqlite3.Connection:
+    """ Connection to a database file in WAL mode with foreign keys
+
+    Transactions are opened by the caller (BEGIN) and closed with commit or
+    rollback.
+    """
+    connection = sqlite3.connect(db_file, timeout=30, isolation_level=None)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    connection.execute('PRAGMA foreign_keys = ON')
+    return connection
+
+
+# -----------
+# Migraciones
+# -----------
+def migrate(cursor) -> int:
+    """ Apply the pending schema migrations in order
+
+    Parameters
+    ----------
+    cursor: sqlite3 cursor
+        Cursor of the connection, committed by the caller
+
+    Returns
+    -------
+    version: int
+        Schema version after the migrations
+    """
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description VARCHAR(128) NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )""")
+    # A write takes the database lock, which serializes concurrent runners
+    cursor.execute('DELETE FROM schema_version WHERE version IS NULL')
+    cursor.execute('SELECT COALESCE(max(version), 0) FROM schema_version')
+    current = cursor.fetchone()[0]
+
+    pending = [version for version in sorted(MIGRATIONS) if version > current]
+    for version in pending:
+        description, statements = MIGRATIONS[version]
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (version, description))
+
+    return pending[-1] if pending else current
+
+
+# ----------
+# Sentencias
+# ----------
+def execute(cursor, name: str, params: tuple = ()) -> None:
+    """ Execute a statement of STATEMENTS, dates and decimals as stored """
+    cursor.execute(STATEMENTS[name], [_value(value) for value in params])
+
+
+def _value(value):
+    """ Parameter value as stored: dates as ISO text, decimals as float """
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _decimal(value) -> Decimal:
+    """ Stored REAL as the NUMERIC(x,2) value of PostgreSQL """
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def _date(value) -> datetime.date:
+    return datetime.date.fromisoformat(value) if value is not None else None
+
+
+def _paciente(row) -> Paciente:
+    (id_db, last_name, first_name, id_type, id_number, birth_date, sex, weight, weight_unit,
+     height, height_unit, bmi) = row
+    return Paciente(id_db, last_name, first_name, id_type, id_number, _date(birth_date), sex, _decimal(weight),
+                    weight_unit, _decimal(height), height_unit, _decimal(bmi))
+
+
+def _estudio(row) -> Estudio:
+    return Estudio(*row[:4], _date(row[4]))
+
+
+def _one(cursor, row_builder):
+    """ Single returned row, None if no row was affected """
+    row = cursor.fetchone()
+    return row_builder(row) if row is not None else None
+
+
+def _json(values) -> str:
+    """ JSON array parameter, read with json_each as an array of PostgreSQL """
+    return json.dumps(list(values))
+
+
+# ---------
+# Pacientes
+# ---------
+def patients_page(cursor, after: int, limit: int) -> list:
+    """ Patients in insertion order whose id follows after (keyset page) """
+    execute(cursor, 'pacientes_page', (after, limit))
+    return [_paciente(row) for row in cursor.fetchall()]
+
+
+def get_patient(cursor, id_number) -> list:
+    """ Patients with an id number (empty or a single row) """
+    execute(cursor, 'pacientes_get', (id_number,))
+    return [_paciente(row) for row in cursor.fetchall()]
+
+
+def add_patient(cursor, data: dict) -> Paciente:
+    """ Insert a patient and return the stored row """
+    execute(cursor, 'pacientes_add', _paciente_params(data))
+    return _one(cursor, _paciente)
+
+
+def edit_patient(cursor, id_db: int, data: dict) -> Paciente:
+    """ Update a patient and return the updated row (None if missing) """
+    execute(cursor, 'pacientes_edit', _paciente_params(data) + (id_db,))
+    return _one(cursor, _paciente)
+
+
+def delete_patient(cursor, id_number) -> Paciente:
+    """ Delete a patient and return the deleted row (None if missing) """
+    execute(cursor, 'pacientes_delete', (id_number,))
+    return _one(cursor, _paciente)
+
+
+def search_patients(cursor, text: str, limit: int = 10) -> list:
+    """ Patients whose id number, last or first name have tokens starting
+        with every word of a search text, in name order
+    """
+    words = re.findall(r'\w+', text)[:SEARCH_WORDS]
+    if not words:
+        return []
+    execute(cursor, 'pacientes_search', (' AND '.join(f'"{word}"*' for word in words), limit))
+    return [_paciente(row) for row in cursor.fetchall()]
+
+
+def registered_patients(cursor, id_numbers: list) -> set:
+    """ Id numbers among the given ones with a patient row """
+    cursor.execute('SELECT id_number FROM pacientes WHERE id_number IN (SELECT value FROM json_each(?))',
+                   (_json(int(id_number) for id_number in id_numbers),))
+    return {id_number for id_number, in cursor.fetchall()}
+
+
+def copy_patients(cursor, rows: list, update: bool = True) -> tuple:
+    """ Bulk load of patients with a single multi-row upsert statement
+
+    Parameters
+    ----------
+    cursor: sqlite3 cursor
+        Cursor of the connection, committed by the caller
+    rows: list
+        Tuples with the PACIENTE_VALUES fields, birth_date as a date
+    update: bool
+        Existing id numbers are updated with the new data if True, and
+        left untouched if False
+
+    Returns
+    -------
+    inserted, updated, conflicts: tuple
+        Lists of id numbers inserted, updated and not loaded because they
+        already existed
+    """
+    existing = registered_patients(cursor, [row[3] for row in rows])
+
+    updates = ', '.join(f'{column} = excluded.{column}' for column in PACIENTE_VALUES.split(', '))
+    action = f'DO UPDATE SET {updates}' if update else 'DO NOTHING'
+    cursor.executemany(f"""INSERT INTO pacientes ({PACIENTE_VALUES}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (id_number) {action}""",
+                       [[_value(value) for value in row] for row in rows])
+
+    inserted = [row[3] for row in rows if int(row[3]) not in existing]
+    found = [row[3] for row in rows if int(row[3]) in existing]
+    return (inserted, found, []) if update else (inserted, [], found)
+
+
+# --------
+# Estudios
+# --------
+def get_studies(cursor, id_number) -> list:
+    """ Studies of a patient in insertion order """
+    execute(cursor, 'estudios_get', (id_number,))
+    return [_estudio(row) for row in cursor.fetchall()]
+
+
+def studies_page(cursor, id_number, after: int, limit: int) -> list:
+    """ Studies of a patient in insertion order whose id follows after
+        (keyset page)
+    """
+    execute(cursor, 'estudios_page', (id_number, after, limit))
+    return [_estudio(row) for row in cursor.fetchall()]
+
+
+def add_study(cursor, id_number, file_name: str, file_path: str) -> Estudio:
+    """ Insert a study and return the stored row """
+    execute(cursor, 'estudios_add', (id_number, file_name, file_path))
+    return _one(cursor, _estudio)
+
+
+def add_studies(cursor, rows: list) -> list:
+    """ Insert studies, skipping those whose file name or file path is
+        already registered, and return the inserted rows
+
+    rows: tuples (id_number, file_name, file_path, study_date), study_date
+    None for the current date
+    """
+    inserted = []
+    for row in rows:
+        cursor.execute(f"""INSERT INTO estudios (id_number, file_name, file_path, study_date)
+                        VALUES (?, ?, ?, COALESCE(?, CURRENT_DATE))
+                        ON CONFLICT DO NOTHING RETURNING {ESTUDIO_COLUMNS}""", [_value(value) for value in row])
+        study = _one(cursor, _estudio)
+        if study is not None:
+            inserted.append(study)
+    return inserted
+
+
+def registered_studies(cursor, file_names: list, file_paths: list) -> tuple:
+    """ File names and file paths among the given ones already registered """
+    cursor.execute("""SELECT file_name, file_path FROM estudios
+                    WHERE file_name IN (SELECT value FROM json_each(?))
+                        OR file_path IN (SELECT value FROM json_each(?))""", (_json(file_names), _json(file_paths)))
+    rows = cursor.fetchall()
+    return {file_name for file_name, _ in rows}, {file_path for _, file_path in rows}
+
+
+def edit_study(cursor, id_db: int, id_number, file_name: str, file_path: str) -> Estudio:
+    """ Update a study and return the updated row (None if missing) """
+    execute(cursor, 'estudios_edit', (id_number, file_name, file_path, id_db))
+    return _one(cursor, _estudio)
+
+
+def delete_study(cursor, file_name: str) -> Estudio:
+    """ Delete a study, with its stored metrics and signals by cascade, and
+        return the deleted row (None if missing)
+    """
+    execute(cursor, 'estudios_delete', (file_name,))
+    return _one(cursor, _estudio)
+
+
+# --------
+# Métricas
+# --------
+def insert_metrics(cursor, rows: list) -> None:
+    """ Upsert of (file_name, foot, metric, value, version, preprocessing) rows """
+    cursor.executemany("""INSERT INTO metricas (file_name, foot, metric, value, version, preprocessing)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (file_name, foot, metric)
+                        DO UPDATE SET value = excluded.value, version = excluded.version,
+                            preprocessing = excluded.preprocessing""",
+                       [(file_name, foot, metric, sql_float(value), version, preprocessing)
+                        for file_name, foot, metric, value, version, preprocessing in rows])
+
+
+def insert_signals(cursor, rows: list) -> None:
+    """ Upsert of (file_name, foot, first_index, lateral, ap) rows, signals
+        as float64 little-endian bytes
+    """
+    cursor.executemany("""INSERT INTO senales (file_name, foot, first_index, lat_signal, ap_signal)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (file_name, foot)
+                        DO UPDATE SET first_index = excluded.first_index, lat_signal = excluded.lat_signal,
+                            ap_signal = excluded.ap_signal""", rows)
+
+
+def copy_signals(cursor, rows: list) -> None:
+    """ Insert signal rows of studies without stored signals (new studies) """
+    cursor.executemany("""INSERT INTO senales (file_name, foot, first_index, lat_signal, ap_signal)
+                        VALUES (?, ?, ?, ?, ?)""", rows)
+
+
+def get_signals(cursor, file_names: list) -> list:
+    """ Signal rows (file_name, foot, first_index, lateral, ap) of studies """
+    cursor.execute("""SELECT file_name, foot, first_index, lat_signal, ap_signal FROM senales
+                    WHERE file_name IN (SELECT value FROM json_each(?))""", (_json(file_names),))
+    return cursor.fetchall()
+
+
+def stale_metrics(cursor, versions: dict, feet: tuple) -> list:
+    """ Tuples (file_name, file_path, stale metric names) of the studies with
+        metrics missing or computed with another version
+    """
+    current = ', '.join(['(?, ?)'] * len(versions))
+    cursor.execute(f"""WITH current (metric, version) AS (VALUES {current})
+                    SELECT DISTINCT e.file_name, e.file_path, c.metric
+                    FROM estudios e
+                    CROSS JOIN current c
+                    CROSS JOIN json_each(?) AS f
+                    LEFT JOIN metricas m
+                        ON m.file_name = e.file_name AND m.foot = f.value AND m.metric = c.metric
+                    WHERE m.version IS NOT c.version
+                    ORDER BY e.file_name, c.metric""", (*itertools.chain(*versions.items()), _json(feet)))
+    return [(file_name, file_path, [metric for _, _, metric in rows])
+            for (file_name, file_path), rows in itertools.groupby(cursor.fetchall(), lambda row: row[:2])]
+
+
+def patient_metrics(cursor, id_number, metric_names: list) -> list:
+    """ Tuples (study_date, file_name, foot, metric, value) of the studies of
+        a patient in date order
+    """
+    cursor.execute("""SELECT e.study_date, e.file_name, m.foot, m.metric, m.value
+                    FROM estudios e
+                    JOIN metricas m ON m.file_name = e.file_name
+                    WHERE e.id_number = ? AND m.metric IN (SELECT value FROM json_each(?))
+                    ORDER BY e.study_date, e.file_name, m.foot, m.metric""", (id_number, _json(metric_names)))
+    return [(_date(study_date), *row) for study_date, *row in cursor.fetchall()]
+
+
+# --------
+# Cohortes
+# --------
+def cohort_stats(cursor, metric: str, foot: str, sex: str = None, age: tuple = None, bmi: tuple = None,
+                 dates: tuple = None) -> tuple:
+    """ Aggregates of a metric over the studies of a patient cohort, from
+        the metrics of unfiltered signals with the default parameters,
+        computed from its values (SQLite has no percentiles)
+
+    Returns
+    -------
+    n, mean, std, min, quantiles, max: tuple
+        quantiles: 5, 25, 50, 75 and 95 percentiles (None if n is 0)
+    """
+    conditions = ['m.metric = ?', 'm.foot = ?', "m.preprocessing = ''", 'm.value IS NOT NULL']
+    values = [metric, foot]
+    if sex is not None:
+        conditions.append('p.sex = ?')
+        values.append(sex)
+    if age is not None:
+        conditions.append(f'{AGE} BETWEEN ? AND ?')
+        values.extend(age)
+    if bmi is not None:
+        conditions.append('p.bmi BETWEEN ? AND ?')
+        values.extend(bmi)
+    if dates is not None:
+        conditions.append('e.study_date BETWEEN ? AND ?')
+        values.extend(dates)
+
+    cursor.execute(f"""SELECT m.value
+                    FROM metricas m
+                    JOIN estudios e ON e.file_name = m.file_name
+                    JOIN pacientes p ON p.id_number = e.id_number
+                    WHERE {' AND '.join(conditions)}""", [_value(value) for value in values])
+    sample = np.array([value for value, in cursor.fetchall()], dtype=float)
+    if sample.size == 0:
+        return 0, None, None, None, None, None
+
+    # Linear interpolation, as percentile_cont
+    quantiles = np.quantile(sample, [0.05, 0.25, 0.5, 0.75, 0.95]).tolist()
+    std = float(sample.std(ddof=1)) if sample.size > 1 else None
+    return sample.size, float(sample.mean()), std, float(sample.min()), quantiles, float(sample.max())
+
+
+def cohort_values(cursor, versions: dict) -> list:
+    """ Tuples (sex, age at study date, bmi, foot, metric, values) of the
+        studies with a known date, from the metrics of unfiltered signals
+        with the default parameters at the current version by metric name
+    """
+    cursor.execute(f"""SELECT p.sex, {AGE} AS age, p.bmi, m.foot, m.metric, m.value
+                    FROM metricas m
+                    JOIN json_each(?) c ON c.key = m.metric AND c.value = m.version
+                    JOIN estudios e ON e.file_name = m.file_name
+                    JOIN pacientes p ON p.id_number = e.id_number
+                    WHERE m.preprocessing = '' AND m.value IS NOT NULL AND e.study_date IS NOT NULL
+                    ORDER BY 1, 2, 3, 4, 5""", (json.dumps(versions),))
+    return [(sex, float(age), _decimal(bmi), foot, metric, [row[-1] for row in rows])
+            for (sex, age, bmi, foot, metric), rows in itertools.groupby(cursor.fetchall(), lambda row: row[:5])]
+
+
+def get_cohort(cursor) -> list:
+    """ Stored cohort sketches as tuples (bin, foot, metric, sketch) """
+    cursor.execute('SELECT bin, foot, metric, sketch FROM cohortes')
+    return cursor.fetchall()
+
+
+def merge_cohort(cursor, sketches: dict, merge) -> None:
+    """ Merge serialized sketches by (bin, foot, metric) into the stored
+        ones, in the write transaction of the caller
+
+    Missing keys are first inserted with an empty sketch, so the write lock
+    is held before the stored sketches are read and concurrent merges are
+    serialized instead of failing on a stale snapshot.
+    """
+    keys = sorted(sketches)
+    cursor.executemany('INSERT INTO cohortes (bin, foot, metric, sketch) VALUES (?, ?, ?, ?) ON CONFLICT DO NOTHING',
+                       [(*key, b'') for key in keys])
+    cursor.execute(f"""SELECT bin, foot, metric, sketch FROM cohortes
+                    WHERE (bin, foot, metric) IN (VALUES {', '.join(['(?, ?, ?)'] * len(keys))})""",
+                   list(itertools.chain(*keys)))
+    stored = {(bin_name, foot, metric): data for bin_name, foot, metric, data in cursor.fetchall()}
+    cursor.executemany("""INSERT INTO cohortes (bin, foot, metric, sketch) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (bin, foot, metric) DO UPDATE SET sketch = excluded.sketch""",
+                       [(*key, merge(stored[key], sketches[key]) if stored.get(key) else sketches[key]) for key in keys])
+
+
+def replace_cohort(cursor, sketches: dict) -> None:
+    """ Replace all stored sketches with the serialized sketches by
+        (bin, foot, metric)
+    """
+    cursor.execute('DELETE FROM cohortes')
+    cursor.executemany('INSERT INTO cohortes (bin, foot, metric, sketch) VALUES (?, ?, ?, ?)',
+                       [(*key, data) for key, data in sketches.items()])